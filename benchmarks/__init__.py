@@ -0,0 +1,4 @@
+"""Performance benchmarks.
+
+Run each benchmark from the repository root, e.g. ``python -m benchmarks.quantizer``.
+"""
@@ -0,0 +1,47 @@
+# Standard library imports
+import argparse
+import time
+
+# Third-party imports
+import torch
+
+# Local imports
+from src.model.music_net import EfficientHarmonicMusicNet
+from src.model.tokenizer import MusicTokenizer
+from src.generation.batched import generate_batch
+from src.generation.beam import KeyConstraint, NoVoiceCrossing, VoiceRange, beam_search
+
+def time_ms(fn, repeats):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Per-step cost of beam search vs sampling one sequence')
+    parser.add_argument('--embedding-dim', type=int, default=32)
+    parser.add_argument('--hidden-size', type=int, default=64)
+    parser.add_argument('--num-steps', type=int, default=64)
+    parser.add_argument('--beam-widths', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--causal', action='store_true', help='Benchmark the causal (unidirectional) model')
+    parser.add_argument('--repeats', type=int, default=3)
+
+    args = parser.parse_args()
+    torch.manual_seed(0)
+    tokenizer = MusicTokenizer(max_vocab_size=128)
+    vocab_size = len(tokenizer.note_to_id)
+    model = EfficientHarmonicMusicNet(vocab_size, args.embedding_dim, args.hidden_size, dropout=0.0,
+                                      bidirectional=not args.causal).eval()
+    seed = torch.randint(0, vocab_size, (1, 1, 4))
+    constraints = [VoiceRange(pitch_ranges=('C2', 'C6')), KeyConstraint('C'), NoVoiceCrossing()]
+
+    sampling_ms = time_ms(lambda: generate_batch(model, seed, args.num_steps), args.repeats) / args.num_steps
+    print(f"sampling, 1 sequence: {sampling_ms:.3f} ms/step")
+    print(f"{'beams':>6} {'ms/step':>10} {'x sampling':>11} {'constrained ms/step':>20}")
+    for beam_width in args.beam_widths:
+        plain_ms = time_ms(lambda: beam_search(model, seed, args.num_steps, tokenizer, beam_width=beam_width),
+                           args.repeats) / args.num_steps
+        constrained_ms = time_ms(lambda: beam_search(model, seed, args.num_steps, tokenizer, beam_width=beam_width,
+                                                     constraints=constraints), args.repeats) / args.num_steps
+        print(f"{beam_width:>6} {plain_ms:>10.3f} {plain_ms / sampling_ms:>11.2f} {constrained_ms:>20.3f}")
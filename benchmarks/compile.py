@@ -0,0 +1,72 @@
+# Standard library imports
+import argparse
+import time
+
+# Third-party imports
+import torch
+import torch.nn as nn
+
+# Local imports
+from src.model.music_net import EfficientHarmonicMusicNet
+from src.model.compile import COMPILE_MODES, DEFAULT_CACHE_DIR, compile_model
+
+def benchmark_mode(mode, args):
+    """Warm-up time, generation per-step latency and training throughput of one execution mode"""
+    torch.manual_seed(0)
+    model = EfficientHarmonicMusicNet(args.vocab_size, args.embedding_dim, args.hidden_size, dropout=0.0)
+    forward_model = compile_model(model, mode, args.cache_dir)
+    result = {'mode': mode}
+    
+    # Generation: one window of sequence_length steps per call, batch 1
+    model.eval()
+    window = torch.randint(0, args.vocab_size, (1, args.sequence_length, 4))
+    with torch.no_grad():
+        start = time.perf_counter()
+        forward_model(window)
+        result['warmup_s'] = time.perf_counter() - start
+        for _ in range(3):
+            forward_model(window)
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            forward_model(window)
+        result['step_ms'] = (time.perf_counter() - start) / args.steps * 1000
+    
+    # Training: forward + backward + optimizer step
+    model.train()
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+    criterion = nn.CrossEntropyLoss()
+    data = torch.randint(0, args.vocab_size, (args.batch_size, args.sequence_length, 4))
+    target = torch.randint(0, args.vocab_size, (args.batch_size, args.sequence_length, 4))
+    
+    def train_step():
+        optimizer.zero_grad(set_to_none=True)
+        output = forward_model(data)
+        loss = criterion(output.reshape(-1, args.vocab_size), target.view(-1))
+        loss.backward()
+        optimizer.step()
+    
+    for _ in range(3):
+        train_step()
+    start = time.perf_counter()
+    for _ in range(args.train_steps):
+        train_step()
+    result['train_samples_per_s'] = args.batch_size * args.train_steps / (time.perf_counter() - start)
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark eager vs compiled execution of EfficientHarmonicMusicNet')
+    parser.add_argument('--modes', nargs='+', choices=COMPILE_MODES, default=list(COMPILE_MODES))
+    parser.add_argument('--embedding-dim', type=int, default=32)
+    parser.add_argument('--hidden-size', type=int, default=64)
+    parser.add_argument('--vocab-size', type=int, default=128)
+    parser.add_argument('--sequence-length', type=int, default=32)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--steps', type=int, default=200, help='Timed generation steps')
+    parser.add_argument('--train-steps', type=int, default=20, help='Timed training steps')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    
+    args = parser.parse_args()
+    print(f"{'mode':>8} {'warm-up (s)':>12} {'step (ms)':>10} {'train (samples/s)':>18}")
+    for mode in args.modes:
+        result = benchmark_mode(mode, args)
+        print(f"{mode:>8} {result['warmup_s']:>12.2f} {result['step_ms']:>10.3f} {result['train_samples_per_s']:>18.1f}")
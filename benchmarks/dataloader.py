@@ -0,0 +1,39 @@
+# Standard library imports
+import argparse
+import time
+
+# Local imports
+from src.data_processing.prepare_dataset import prepare_dataloaders
+
+def benchmark_loader(loader, max_batches):
+    """Samples/s of iterating a DataLoader (no model), after one warm-up batch"""
+    iterator = iter(loader)
+    next(iterator)
+    samples, batches = 0, 0
+    start = time.perf_counter()
+    for data, target in iterator:
+        samples += data.shape[0]
+        batches += 1
+        if batches >= max_batches:
+            break
+    return samples / (time.perf_counter() - start)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark per-item vs batched window gathering')
+    parser.add_argument('--dataset', default='output/music_dataset.pt',
+                        help='Path to the dataset (.pt file or sharded directory)')
+    parser.add_argument('--sequence-lengths', type=int, nargs='+', default=[4, 32, 64])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[16, 128, 1024])
+    parser.add_argument('--max-batches', type=int, default=200,
+                        help='Batches timed per configuration')
+    
+    args = parser.parse_args()
+    print(f"{'seq_len':>8} {'batch':>6} {'item (samples/s)':>18} {'batch (samples/s)':>18} {'speedup':>8}")
+    for sequence_length in args.sequence_lengths:
+        for batch_size in args.batch_sizes:
+            results = {}
+            for gather in ('item', 'batch'):
+                train_loader, _ = prepare_dataloaders(args.dataset, sequence_length, batch_size, gather=gather)
+                results[gather] = benchmark_loader(train_loader, args.max_batches)
+            print(f"{sequence_length:>8} {batch_size:>6} {results['item']:>18.0f} {results['batch']:>18.0f} "
+                  f"{results['batch'] / results['item']:>7.1f}x")
@@ -0,0 +1,161 @@
+# Standard library imports
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+
+# Third-party imports
+import numpy as np
+import torch
+
+# Local imports
+from src.model.music_net import EfficientHarmonicMusicNet
+from src.model.checkpoint import build_model, load_checkpoint
+from src.model.compile import COMPILE_MODES, compile_model
+from src.model.profiler import forward_flops, parameter_counts
+from src.generation.batched import stream_batch
+from src.generation.sampling import Sampler
+
+def peak_rss_mb():
+    """Peak resident set size of this process, if available (ru_maxrss is in KB on Linux, in bytes on macOS)"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+def run_config(config):
+    """Generate once for warm-up, then time every step of a second run; returns the config with its results"""
+    torch.set_num_threads(config['threads'])
+    torch.manual_seed(0)
+    if config['model_path']:
+        model = build_model(load_checkpoint(config['model_path']))
+    else:
+        model = EfficientHarmonicMusicNet(config['vocab_size'], config['embedding_dim'], config['hidden_size'],
+                                          dropout=0.0, bidirectional=not config['causal'])
+    config.update(embedding_dim=model.embedding_dim, hidden_size=model.hidden_size, vocab_size=model.num_notes,
+                  causal=not model.bidirectional, parameters=parameter_counts(model)['total'],
+                  # A causal step feeds one timestep from the LSTM state, a bidirectional one the whole window
+                  flops_per_step=forward_flops(model, config['batch_size'],
+                                               config['sequence_length'] if model.bidirectional else 1)['total'])
+    model = compile_model(model.eval(), config['compile'])
+    # A full context window of random notes, so bidirectional models always see sequence_length steps
+    seed = torch.randint(0, config['vocab_size'], (config['batch_size'], config['sequence_length'], 4))
+    sampler = Sampler(temperature=0.8, seed=0)
+
+    for _ in stream_batch(model, seed, config['warmup_steps'], sequence_length=config['sequence_length'],
+                          sampler=sampler):
+        pass
+
+    step_times = []
+    steps = stream_batch(model, seed, config['num_steps'], sequence_length=config['sequence_length'], sampler=sampler)
+    start = last = time.perf_counter()
+    for _ in steps:
+        now = time.perf_counter()
+        step_times.append(now - last)
+        last = now
+    total = last - start
+
+    step_ms = np.array(step_times) * 1000
+    config.update({
+        'total_s': round(total, 4),
+        'steps_per_s': round(config['num_steps'] / total, 2),
+        'sequences_steps_per_s': round(config['num_steps'] * config['batch_size'] / total, 2),
+        'tokens_per_s': round(config['num_steps'] * config['batch_size'] * 4 / total, 2),
+        'gflops_per_s': round(config['flops_per_step'] * config['num_steps'] / total / 1e9, 3),
+        'latency_mean_ms': round(float(step_ms.mean()), 4),
+        'latency_p50_ms': round(float(np.percentile(step_ms, 50)), 4),
+        'latency_p95_ms': round(float(np.percentile(step_ms, 95)), 4),
+        'latency_p99_ms': round(float(np.percentile(step_ms, 99)), 4),
+        'peak_rss_mb': peak_rss_mb(),
+    })
+    return config
+
+def environment():
+    """What the numbers depend on besides the configuration, to compare runs between versions and machines"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'torch': torch.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'cuda': torch.cuda.is_available(),
+    }
+
+def parse_model_size(spec):
+    """'32x64' -> (embedding_dim, hidden_size)"""
+    embedding_dim, hidden_size = spec.lower().split('x')
+    return int(embedding_dim), int(hidden_size)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generation throughput, per-step latency and memory, as JSON')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 16, 64, 256])
+    parser.add_argument('--sequence-lengths', type=int, nargs='+', default=[32],
+                        help='Context window of bidirectional models (and length of the random seed)')
+    parser.add_argument('--num-steps', type=int, nargs='+', default=[128], help='Timed steps per run')
+    parser.add_argument('--threads', type=int, nargs='+', default=[torch.get_num_threads()])
+    parser.add_argument('--model-sizes', type=parse_model_size, nargs='+', default=[(32, 64)],
+                        metavar='EMBxHIDDEN', help="Random-weight models to sweep, e.g. 32x64 128x256")
+    parser.add_argument('--model-path', type=str,
+                        help='Benchmark this checkpoint instead of random weights (its sizes replace --model-sizes)')
+    parser.add_argument('--vocab-size', type=int, default=128)
+    parser.add_argument('--causal', action='store_true', help='Random-weight models are causal (unidirectional)')
+    parser.add_argument('--compile', choices=COMPILE_MODES, default='eager')
+    parser.add_argument('--warmup-steps', type=int, default=8)
+    parser.add_argument('--in-process', action='store_true',
+                        help='Run all configurations in this process (faster; peak RSS then only grows)')
+    parser.add_argument('--output', type=str, help='Write the JSON report here (default: stdout)')
+
+    args = parser.parse_args()
+    model_sizes = [(None, None)] if args.model_path else args.model_sizes
+    configs = [
+        {
+            'model_path': args.model_path, 'embedding_dim': embedding_dim, 'hidden_size': hidden_size,
+            'vocab_size': args.vocab_size, 'causal': args.causal, 'compile': args.compile,
+            'batch_size': batch_size, 'sequence_length': sequence_length, 'num_steps': num_steps,
+            'threads': threads, 'warmup_steps': args.warmup_steps,
+        }
+        for (embedding_dim, hidden_size), batch_size, sequence_length, num_steps, threads in itertools.product(
+            model_sizes, args.batch_sizes, args.sequence_lengths, args.num_steps, args.threads)
+    ]
+
+    # The table goes to stderr, so that stdout is only the JSON report
+    print(f"{'model':>10} {'batch':>6} {'context':>8} {'steps':>6} {'threads':>8} {'steps/s':>9} {'tokens/s':>11} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'RSS MB':>8}", file=sys.stderr)
+    results = []
+    if args.in_process:
+        runs = map(run_config, configs)
+    else:
+        # A fresh process per configuration: peak RSS and thread settings do not leak between runs
+        pool = multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1)
+        runs = pool.imap(run_config, configs)
+    for result in runs:
+        results.append(result)
+        print(f"{result['embedding_dim']:>4}x{result['hidden_size']:<5} {result['batch_size']:>6} "
+              f"{result['sequence_length']:>8} {result['num_steps']:>6} {result['threads']:>8} "
+              f"{result['steps_per_s']:>9.1f} {result['tokens_per_s']:>11.1f} {result['latency_p50_ms']:>8.3f} "
+              f"{result['latency_p95_ms']:>8.3f} {result['latency_p99_ms']:>8.3f} {result['peak_rss_mb'] or float('nan'):>8.1f}",
+              file=sys.stderr)
+    if not args.in_process:
+        pool.close()
+        pool.join()
+
+    report = json.dumps({'benchmark': 'generation', 'environment': environment(), 'results': results}, indent=1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+        print(f"Report saved to {args.output}", file=sys.stderr)
+    else:
+        print(report)
@@ -0,0 +1,57 @@
+# Standard library imports
+import argparse
+import time
+
+# Third-party imports
+import torch
+
+# Local imports
+from src.model.music_net import EfficientHarmonicMusicNet
+from src.generation.incremental import IncrementalGenerator
+
+def window_step_ms(model, context, window, repeats):
+    """Per-step latency of sliding-window generation: the last `window` steps are re-run every step"""
+    x = context[:, -window:]
+    with torch.no_grad():
+        model(x)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model(x)
+    return (time.perf_counter() - start) / repeats * 1000
+
+def incremental_step_ms(model, context, repeats):
+    """Per-step latency of incremental generation after `context` timesteps"""
+    generator = IncrementalGenerator(model)
+    generator.feed(context)
+    state = generator.state
+    new_step = context[:, -1:]
+    with torch.no_grad():
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model.step(new_step, state)
+    return (time.perf_counter() - start) / repeats * 1000
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Per-step generation latency: sliding window vs incremental state')
+    parser.add_argument('--embedding-dim', type=int, default=32)
+    parser.add_argument('--hidden-size', type=int, default=64)
+    parser.add_argument('--vocab-size', type=int, default=128)
+    parser.add_argument('--window', type=int, default=32, help='Context window of the sliding-window generator')
+    parser.add_argument('--contexts', type=int, nargs='+', default=[32, 256, 1024, 4096],
+                        help='Number of timesteps already generated')
+    parser.add_argument('--repeats', type=int, default=200)
+    
+    args = parser.parse_args()
+    torch.manual_seed(0)
+    bidirectional = EfficientHarmonicMusicNet(args.vocab_size, args.embedding_dim, args.hidden_size, dropout=0.0).eval()
+    causal = EfficientHarmonicMusicNet(args.vocab_size, args.embedding_dim, args.hidden_size, dropout=0.0,
+                                       bidirectional=False).eval()
+    
+    print(f"{'context':>8} {'window (ms)':>12} {'full context (ms)':>18} {'incremental (ms)':>17}")
+    for context_length in args.contexts:
+        context = torch.randint(0, args.vocab_size, (1, context_length, 4))
+        window_ms = window_step_ms(bidirectional, context, args.window, args.repeats)
+        # A causal model without state has to re-run the whole history to see all of it
+        full_ms = window_step_ms(causal, context, context_length, max(1, args.repeats // 10))
+        incremental_ms = incremental_step_ms(causal, context, args.repeats)
+        print(f"{context_length:>8} {window_ms:>12.3f} {full_ms:>18.3f} {incremental_ms:>17.3f}")
@@ -0,0 +1,79 @@
+# Standard library imports
+import argparse
+from pathlib import Path
+import time
+
+# Third-party imports
+import pretty_midi
+import torch
+
+# Local imports
+from src.data_processing.midi_to_dataset import MidiConverter
+
+def benchmark_quantizer(input_dir, repeats=1, limit=None):
+    """Compare the 'scan' and 'sweep' quantization engines on a MIDI corpus.
+    
+    MIDI parsing is done once per file and excluded from the timings, so only
+    the quantization itself is measured. Returns a dict with the totals.
+    """
+    scan = MidiConverter(engine='scan')
+    sweep = MidiConverter(engine='sweep')
+    
+    midi_files = sorted(p for p in Path(input_dir).glob('**/*')
+                        if p.suffix.lower() in ('.mid', '.midi', '.kar'))
+    if limit:
+        midi_files = midi_files[:limit]
+    
+    totals = {'files': 0, 'timesteps': 0, 'scan_s': 0.0, 'sweep_s': 0.0, 'mismatches': []}
+    for midi_path in midi_files:
+        try:
+            midi_data = pretty_midi.PrettyMIDI(str(midi_path))
+        except Exception as e:
+            print(f"Skipping {midi_path}: {e}")
+            continue
+        
+        results = {}
+        for name, converter in (('scan', scan), ('sweep', sweep)):
+            start = time.perf_counter()
+            for _ in range(repeats):
+                try:
+                    results[name] = converter._quantize_scan(midi_data) if name == 'scan' \
+                        else converter._quantize_sweep(midi_data)
+                except KeyError as e:
+                    results[name] = f"KeyError({e.args[0]})"
+            totals[f'{name}_s'] += (time.perf_counter() - start) / repeats
+        
+        same = type(results['scan']) is type(results['sweep']) and (
+            results['scan'] == results['sweep'] if isinstance(results['scan'], str)
+            else torch.equal(results['scan'], results['sweep']))
+        if not same:
+            totals['mismatches'].append(str(midi_path))
+        totals['files'] += 1
+        if torch.is_tensor(results['scan']):
+            totals['timesteps'] += len(results['scan'])
+    
+    return totals
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the MIDI quantization engines')
+    parser.add_argument('--input-dir', default='beatles',
+                        help='Directory containing MIDI files')
+    parser.add_argument('--repeats', type=int, default=1,
+                        help='Timed repetitions per file')
+    parser.add_argument('--limit', type=int,
+                        help='Only benchmark the first N files')
+    
+    args = parser.parse_args()
+    totals = benchmark_quantizer(args.input_dir, args.repeats, args.limit)
+    
+    print(f"Files: {totals['files']}, timesteps: {totals['timesteps']}")
+    print(f"scan:  {totals['scan_s']:.3f}s")
+    print(f"sweep: {totals['sweep_s']:.3f}s")
+    if totals['sweep_s'] > 0:
+        print(f"Speedup: {totals['scan_s'] / totals['sweep_s']:.1f}x")
+    if totals['mismatches']:
+        print(f"Token mismatches in {len(totals['mismatches'])} files:")
+        for path in totals['mismatches']:
+            print(f"  {path}")
+    else:
+        print("Token tensors are identical for every file")
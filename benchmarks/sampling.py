@@ -0,0 +1,49 @@
+# Standard library imports
+import argparse
+import time
+
+# Third-party imports
+import torch
+
+# Local imports
+from src.model.music_net import EfficientHarmonicMusicNet
+from src.model.tokenizer import MusicTokenizer
+from src.generation.sampling import Sampler, channel_mask
+
+def time_ms(fn, repeats):
+    with torch.no_grad():
+        for _ in range(5):
+            fn()
+        start = time.perf_counter()
+        for _ in range(repeats):
+            fn()
+    return (time.perf_counter() - start) / repeats * 1000
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Per-step cost of the sampling engine vs the model forward pass')
+    parser.add_argument('--embedding-dim', type=int, default=32)
+    parser.add_argument('--hidden-size', type=int, default=64)
+    parser.add_argument('--sequence-length', type=int, default=32)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 64, 256])
+    parser.add_argument('--repeats', type=int, default=200)
+    
+    args = parser.parse_args()
+    torch.manual_seed(0)
+    tokenizer = MusicTokenizer(max_vocab_size=128)
+    vocab_size = len(tokenizer.note_to_id)
+    model = EfficientHarmonicMusicNet(vocab_size, args.embedding_dim, args.hidden_size, dropout=0.0).eval()
+    samplers = {
+        'temperature': Sampler(temperature=0.8),
+        'top-k': Sampler(temperature=0.8, top_k=16),
+        'top-p': Sampler(temperature=0.8, top_p=0.9),
+        'all': Sampler(temperature=0.8, top_k=16, top_p=0.9, repetition_penalty=1.2,
+                       mask=channel_mask(tokenizer, allow_rest=False, pitch_ranges=('C2', 'C6')), seed=0),
+    }
+    
+    print(f"{'batch':>6} {'forward (ms)':>13} " + ' '.join(f"{name + ' (ms)':>17}" for name in samplers))
+    for batch_size in args.batch_sizes:
+        window = torch.randint(0, vocab_size, (batch_size, args.sequence_length, 4))
+        logits = model(window)[:, -1]
+        forward_ms = time_ms(lambda: model(window), args.repeats)
+        sampler_ms = [time_ms(lambda: sampler(logits, window), args.repeats) for sampler in samplers.values()]
+        print(f"{batch_size:>6} {forward_ms:>13.3f} " + ' '.join(f"{ms:>17.3f}" for ms in sampler_ms))
@@ -0,0 +1,103 @@
+# Standard library imports
+import argparse
+import itertools
+import json
+import multiprocessing
+import sys
+import time
+
+# Third-party imports
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+# Local imports
+from src.model.music_net import EfficientHarmonicMusicNet
+from src.model.profiler import profile_model
+from benchmarks.generation import environment, parse_model_size, peak_rss_mb
+
+def run_config(config):
+    """Predicted cost of a training step next to the measured time and peak RSS growth"""
+    torch.set_num_threads(config['threads'])
+    torch.manual_seed(0)
+    model = EfficientHarmonicMusicNet(config['vocab_size'], config['embedding_dim'], config['hidden_size'],
+                                      dropout=0.0, bidirectional=not config['causal'])
+    profile = profile_model(model, config['batch_size'], config['sequence_length'])
+    data = torch.randint(0, config['vocab_size'], (config['batch_size'], config['sequence_length'], 4))
+    target = torch.randint(0, config['vocab_size'], (config['batch_size'] * config['sequence_length'] * 4,))
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(model.parameters())
+
+    def step():
+        optimizer.zero_grad(set_to_none=True)
+        loss = criterion(model(data).view(target.numel(), -1), target)
+        loss.backward()
+        optimizer.step()
+
+    rss_before = peak_rss_mb()
+    step()
+    start = time.perf_counter()
+    for _ in range(config['steps']):
+        step()
+    step_s = (time.perf_counter() - start) / config['steps']
+    rss_after = peak_rss_mb()
+
+    mb = 1024 * 1024
+    config.update({
+        'parameters': profile['parameters']['total'],
+        'forward_gflops': round(profile['forward_flops'] / 1e9, 4),
+        'backward_gflops': round(profile['backward_flops'] / 1e9, 4),
+        'activation_mb': round(profile['activation_bytes'] / mb, 2),
+        'predicted_peak_mb': round(profile['peak_training_bytes'] / mb, 2),
+        # Includes allocator and kernel workspaces the prediction leaves out
+        'measured_peak_growth_mb': None if rss_before is None else round(rss_after - rss_before, 2),
+        'step_ms': round(step_s * 1000, 3),
+        'gflops_per_s': round((profile['forward_flops'] + profile['backward_flops']) / step_s / 1e9, 3),
+    })
+    return config
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Predicted (src/model/profiler.py) vs measured cost of a training step')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[16, 128])
+    parser.add_argument('--sequence-lengths', type=int, nargs='+', default=[64])
+    parser.add_argument('--model-sizes', type=parse_model_size, nargs='+', default=[(64, 128)],
+                        metavar='EMBxHIDDEN', help="Models to sweep, e.g. 32x64 128x256")
+    parser.add_argument('--vocab-size', type=int, default=128)
+    parser.add_argument('--causal', action='store_true', help='Causal (unidirectional) models')
+    parser.add_argument('--threads', type=int, default=torch.get_num_threads())
+    parser.add_argument('--steps', type=int, default=5, help='Timed training steps per configuration')
+    parser.add_argument('--output', type=str, help='Write the JSON report here (default: stdout)')
+
+    args = parser.parse_args()
+    configs = [
+        {
+            'embedding_dim': embedding_dim, 'hidden_size': hidden_size, 'vocab_size': args.vocab_size,
+            'causal': args.causal, 'batch_size': batch_size, 'sequence_length': sequence_length,
+            'threads': args.threads, 'steps': args.steps,
+        }
+        for (embedding_dim, hidden_size), batch_size, sequence_length in itertools.product(
+            args.model_sizes, args.batch_sizes, args.sequence_lengths)
+    ]
+
+    print(f"{'model':>10} {'batch':>6} {'context':>8} {'GFLOPs':>9} {'act MB':>9} {'peak MB':>9} "
+          f"{'RSS +MB':>9} {'step ms':>9} {'GFLOP/s':>9}", file=sys.stderr)
+    # A fresh process per configuration, so that the peak RSS growth is this configuration's
+    pool = multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1)
+    results = []
+    for result in pool.imap(run_config, configs):
+        results.append(result)
+        print(f"{result['embedding_dim']:>4}x{result['hidden_size']:<5} {result['batch_size']:>6} "
+              f"{result['sequence_length']:>8} {result['forward_gflops'] + result['backward_gflops']:>9.3f} "
+              f"{result['activation_mb']:>9.1f} {result['predicted_peak_mb']:>9.1f} "
+              f"{result['measured_peak_growth_mb'] or float('nan'):>9.1f} {result['step_ms']:>9.2f} "
+              f"{result['gflops_per_s']:>9.2f}", file=sys.stderr)
+    pool.close()
+    pool.join()
+
+    report = json.dumps({'benchmark': 'training_cost', 'environment': environment(), 'results': results}, indent=1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+        print(f"Report saved to {args.output}", file=sys.stderr)
+    else:
+        print(report)
@@ -0,0 +1,193 @@
+import argparse
+import io
+import os
+import time
+import numpy as np
+import torch
+import torch.nn.functional as F
+from src.model.checkpoint import DEFAULT_SEQUENCE_LENGTH
+from src.model.quantize import DYNAMIC_INT8, quantize_dynamic_int8
+from src.model.onnx_export import export_onnx
+from src.data_processing.prepare_dataset import prepare_dataloaders
+from src.generation.onnx_backend import OnnxModel
+from generate_efficient import load_model
+
+def checkpoint_size(model):
+    """Bytes of a checkpoint holding only the model's state dict"""
+    buffer = io.BytesIO()
+    torch.save({'model_state_dict': model.state_dict()}, buffer)
+    return buffer.tell()
+
+@torch.no_grad()
+def step_latency_ms(model, sequence_length=32, batch_size=1, repeats=200):
+    """
+    Mean latency of one generation step: a forward pass over a sequence_length window for
+    bidirectional models, one incremental step from the LSTM state for causal ones.
+    """
+    window = torch.randint(0, model.num_notes, (batch_size, sequence_length, model.num_channels))
+    if model.bidirectional:
+        def step():
+            model(window)
+    else:
+        _, state = model.step(window, None)
+        def step():
+            model.step(window[:, -1:], state)
+    for _ in range(10):
+        step()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        step()
+    return (time.perf_counter() - start) / repeats * 1000
+
+@torch.no_grad()
+def distribution_divergence(reference, candidate, loader, max_batches=20):
+    """
+    How far candidate's next-step distributions are from reference's on the windows of
+    `loader`: KL(reference || candidate) of every predicted (position, channel) distribution,
+    how often both pick the same most likely token, and the loss of each model on the targets.
+    """
+    divergences, agreements = [], []
+    reference_loss = candidate_loss = 0.0
+    batches = 0
+    for data, target in loader:
+        if batches == max_batches:
+            break
+        reference_log_probs = F.log_softmax(reference(data).float(), dim=-1)
+        candidate_log_probs = F.log_softmax(candidate(data).float(), dim=-1)
+        divergences.append(F.kl_div(candidate_log_probs, reference_log_probs, log_target=True,
+                                    reduction='none').sum(-1).flatten())
+        agreements.append((reference_log_probs.argmax(-1) == candidate_log_probs.argmax(-1)).flatten())
+        reference_loss += F.nll_loss(reference_log_probs.flatten(0, 2), target.flatten()).item()
+        candidate_loss += F.nll_loss(candidate_log_probs.flatten(0, 2), target.flatten()).item()
+        batches += 1
+    divergences = torch.cat(divergences).numpy()
+    return {
+        'distributions': len(divergences),
+        'kl_mean': float(divergences.mean()),
+        'kl_p99': float(np.percentile(divergences, 99)),
+        'kl_max': float(divergences.max()),
+        'top1_agreement': torch.cat(agreements).float().mean().item(),
+        'reference_loss': reference_loss / batches,
+        'candidate_loss': candidate_loss / batches,
+    }
+
+def report_divergence(reference, candidate, args):
+    """Print distribution_divergence() on the validation windows of --dataset (the ones training held out)"""
+    if not args.dataset:
+        print("No --dataset: skipping the comparison of next-step distributions")
+        return
+    _, val_loader = prepare_dataloaders(args.dataset, args.sequence_length, args.batch_size, split=args.split)
+    result = distribution_divergence(reference, candidate, val_loader, args.eval_batches)
+    print(f"\nNext-step distributions on {result['distributions']} held-out (position, channel) pairs:")
+    print(f"  KL(fp32 || exported): mean {result['kl_mean']:.6f}, p99 {result['kl_p99']:.6f}, max {result['kl_max']:.6f}")
+    print(f"  Same most likely note: {result['top1_agreement'] * 100:.2f}%")
+    print(f"  Loss: fp32 {result['reference_loss']:.6f}, exported {result['candidate_loss']:.6f}")
+
+def quantize(args):
+    """Write an int8 copy of a checkpoint (LSTM and output layer) and compare it with the original"""
+    torch.set_num_threads(args.threads or torch.get_num_threads())
+    model, metadata = load_model(args, torch.device('cpu'))
+    if args.sequence_length is None:
+        args.sequence_length = metadata.get('sequence_length', DEFAULT_SEQUENCE_LENGTH)
+    quantized = quantize_dynamic_int8(model)
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    torch.save({'model_state_dict': quantized.state_dict(), 'quantization': DYNAMIC_INT8, **metadata}, args.output)
+    print(f"Quantized model saved to {args.output}")
+
+    fp32_size, int8_size = checkpoint_size(model), os.path.getsize(args.output)
+    print(f"\nSize: fp32 {fp32_size / 1024:.1f} KB, int8 {int8_size / 1024:.1f} KB "
+          f"({fp32_size / int8_size:.2f}x smaller)")
+    fp32_ms = step_latency_ms(model, args.sequence_length, args.latency_batch_size)
+    int8_ms = step_latency_ms(quantized, args.sequence_length, args.latency_batch_size)
+    print(f"Step latency (batch {args.latency_batch_size}, {torch.get_num_threads()} threads): "
+          f"fp32 {fp32_ms:.3f} ms, int8 {int8_ms:.3f} ms ({fp32_ms / int8_ms:.2f}x)")
+    report_divergence(model, quantized, args)
+
+@torch.no_grad()
+def onnx_max_error(model, onnx_model, shapes=((1, 1), (3, 7), (17, 40))):
+    """
+    Largest absolute logit difference between the PyTorch model and its ONNX export over
+    several (batch, time) shapes, so the dynamic axes are exercised too. For causal models
+    the sequence is also fed in two pieces, carrying the state across.
+    """
+    error = 0.0
+    for batch_size, length in shapes:
+        tokens = torch.randint(0, model.num_notes, (batch_size, length, model.num_channels))
+        expected = model(tokens)
+        error = max(error, (onnx_model(tokens) - expected).abs().max().item())
+        if not model.bidirectional and length > 1:
+            split = length // 2
+            first, state = onnx_model.step(tokens[:, :split], None)
+            second, _ = onnx_model.step(tokens[:, split:], state)
+            error = max(error, (torch.cat([first, second], dim=1) - expected).abs().max().item())
+    return error
+
+def onnx(args):
+    """Export a checkpoint to ONNX and check the exported graph against the PyTorch model"""
+    torch.set_num_threads(args.threads or torch.get_num_threads())
+    start = time.perf_counter()
+    model, metadata = load_model(args, torch.device('cpu'))
+    if args.sequence_length is None:
+        args.sequence_length = metadata.get('sequence_length', DEFAULT_SEQUENCE_LENGTH)
+    torch_load_s = time.perf_counter() - start
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    export_onnx(model, args.output, args.opset, metadata)
+    print(f"ONNX model saved to {args.output} ({'bidirectional' if model.bidirectional else 'causal, stateful step'})")
+
+    start = time.perf_counter()
+    onnx_model = OnnxModel(args.output, threads=args.threads)
+    onnx_load_s = time.perf_counter() - start
+    error = onnx_max_error(model, onnx_model)
+    print(f"\nMax logit difference from PyTorch: {error:.2e} (tolerance {args.atol:.0e})")
+    print(f"Load time: PyTorch {torch_load_s * 1000:.1f} ms, onnxruntime {onnx_load_s * 1000:.1f} ms")
+    torch_ms = step_latency_ms(model, args.sequence_length, args.latency_batch_size)
+    onnx_ms = step_latency_ms(onnx_model, args.sequence_length, args.latency_batch_size)
+    print(f"Step latency (batch {args.latency_batch_size}): PyTorch {torch_ms:.3f} ms, onnxruntime {onnx_ms:.3f} ms")
+    report_divergence(model, onnx_model, args)
+    if error > args.atol:
+        raise SystemExit("The ONNX model does not match the PyTorch model")
+
+def add_model_arguments(parser):
+    parser.add_argument('--model-path', type=str, default='model.pt')
+    parser.add_argument('--embedding-dim', type=int,
+                        help='Only for checkpoints that do not record their model (older quantized ones)')
+    parser.add_argument('--hidden-size', type=int,
+                        help='Only for checkpoints that do not record their model (older quantized ones)')
+    parser.add_argument('--causal', action='store_true',
+                        help='Only for checkpoints that do not record their model: it was trained with --causal')
+    parser.add_argument('--dataset', type=str,
+                        help='Dataset the model was trained on: its validation windows are used to compare '
+                             'the exported model with the original')
+    parser.add_argument('--split', choices=['window', 'song'], default='window',
+                        help='Validation split used in training')
+    parser.add_argument('--sequence-length', type=int,
+                        help='Window length used in training, which the validation split depends on '
+                             '(default: the one recorded in the checkpoint)')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--eval-batches', type=int, default=20, help='Validation batches compared')
+    parser.add_argument('--latency-batch-size', type=int, default=1)
+    parser.add_argument('--threads', type=int, help='CPU threads (default: torch default)')
+    # load_model options that an export does not change
+    parser.set_defaults(compile='eager', quantize=False, backend='torch')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export a trained model for CPU inference')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    quantize_parser = subparsers.add_parser('quantize', help='Dynamic int8 quantization of the LSTM and output layer')
+    add_model_arguments(quantize_parser)
+    quantize_parser.add_argument('--output', type=str, default='model_int8.pt')
+    quantize_parser.set_defaults(handler=quantize)
+
+    onnx_parser = subparsers.add_parser('onnx', help='ONNX graph for onnxruntime (causal models: stateful step)')
+    add_model_arguments(onnx_parser)
+    onnx_parser.add_argument('--output', type=str, default='model.onnx')
+    onnx_parser.add_argument('--opset', type=int, default=17)
+    onnx_parser.add_argument('--atol', type=float, default=1e-4,
+                             help='Largest logit difference from the PyTorch model accepted')
+    onnx_parser.set_defaults(handler=onnx)
+
+    args = parser.parse_args()
+    args.handler(args)
@@ -1,112 +1,265 @@
 import argparse
+import json
+import os
 from pathlib import Path
 import torch
-import torch.nn.functional as F
-from src.model.music_net import EfficientHarmonicMusicNet
-from src.model.tokenizer import MusicTokenizer
+from src.model.compile import COMPILE_MODES, compile_model
+from src.model.checkpoint import DEFAULT_SEQUENCE_LENGTH, build_model, checkpoint_config, checkpoint_tokenizer, load_checkpoint
+from src.model.quantize import is_quantized_checkpoint, quantize_dynamic_int8
+from src.generation import KeyConstraint, NoVoiceCrossing, Sampler, VoiceRange, beam_search, generate_batch, stream_batch
+from src.generation.beam import combined_token_mask
+from src.generation.onnx_backend import OnnxModel
+from src.generation.seeds import load_seeds
+from src.generation.writers import MidiStreamWriter, NoteDecoder, TextSequenceWriter
 
-def sample_from_logits(logits, temperature=1.0):
-    if temperature == 0:
-        return torch.argmax(logits, dim=-1)
-    else:
-        logits = logits / temperature
-        probs = F.softmax(logits, dim=-1)
-        return torch.multinomial(probs, num_samples=1).squeeze(-1)
+def default_seed(tokenizer, device):
+    notes = ['C4', 'E4', 'G4', 'C5']
+    indices = [tokenizer.note_to_id.get(note, 0) for note in notes]
+    return torch.tensor([indices], dtype=torch.long, device=device).unsqueeze(1)
 
-def generate_music(model, tokenizer, device, seed_sequence=None, num_steps=64, temperature=0.8, sequence_length=32, show_progress=True):
-    model.eval()
-    
+def generate_music_batch(model, tokenizer, device, seed_sequence=None, num_samples=1, num_steps=64, temperature=0.8,
+                         sequence_length=32, show_progress=True, sampler=None):
+    """num_samples continuations of every seed, generated in parallel; returns one note list per sequence"""
     if seed_sequence is None:
-        notes = ['C4', 'E4', 'G4', 'C5']
-        indices = [tokenizer.note_to_id.get(note, 0) for note in notes]
-        seed_sequence = torch.tensor([indices], dtype=torch.long, device=device).unsqueeze(1)
+        seed_sequence = default_seed(tokenizer, device)
+    generated = generate_batch(model, seed_sequence, num_steps, temperature=temperature,
+                               sequence_length=sequence_length, num_samples=num_samples,
+                               show_progress=show_progress, sampler=sampler)
+    return NoteDecoder(tokenizer)(generated).tolist()
+
+def generate_music(model, tokenizer, device, seed_sequence=None, num_steps=64, temperature=0.8, sequence_length=32, show_progress=True):
+    return generate_music_batch(model, tokenizer, device, seed_sequence=seed_sequence, num_steps=num_steps,
+                                temperature=temperature, sequence_length=sequence_length,
+                                show_progress=show_progress)[0]
+
+def sample_output_paths(output, num_samples):
+    """The output path itself for one sample, else <stem>_000<suffix>, <stem>_001<suffix>, ..."""
+    output_path = Path(output)
+    if num_samples == 1:
+        return [output_path]
+    return [output_path.with_name(f"{output_path.stem}_{i:03d}{output_path.suffix}") for i in range(num_samples)]
+
+def write_sequences(steps, seed_notes, output_paths, decoder, num_steps, midi=False, tempo=120, show_progress=True):
+    """
+    Write the generated timesteps to one text file (and optionally one MIDI file) per sequence
+    as soon as they are sampled. seed_notes is the (sequences, time, channels) array of seed note names.
+    Returns the first 5 steps of the first sequence.
+    """
+    sequence_writers = []
+    for path in output_paths:
+        writers = [TextSequenceWriter(path)]
+        if midi:
+            writers.append(MidiStreamWriter(path.with_suffix('.mid'), tempo=tempo))
+        sequence_writers.append(writers)
+    first_steps = []
     
-    generated_sequence = seed_sequence.clone()
+    def write_step(step_notes):
+        for writers, notes in zip(sequence_writers, step_notes):
+            for writer in writers:
+                writer.write(notes)
+        if len(first_steps) < 5:
+            first_steps.append(step_notes[0].tolist())
     
-    with torch.no_grad():
-        for step in range(num_steps):
+    try:
+        for t in range(seed_notes.shape[1]):
+            write_step(seed_notes[:, t])
+        for step, tokens in enumerate(steps):
             if show_progress:
                 print(f'Generating step {step + 1}/{num_steps}', end='\r')
-            
-            input_sequence = generated_sequence[:, -sequence_length:, :] if generated_sequence.size(1) > sequence_length else generated_sequence
-            output = model(input_sequence)
-            last_output = output[:, -1, :, :]
-            
-            new_notes = torch.zeros((1, 1, 4), dtype=torch.long, device=device)
-            for channel in range(4):
-                channel_logits = last_output[0, channel]
-                new_notes[0, 0, channel] = sample_from_logits(channel_logits, temperature)
-            
-            generated_sequence = torch.cat([generated_sequence, new_notes], dim=1)
-    
-    if show_progress:
-        print('\nGeneration completed!')
+            write_step(decoder(tokens))
+        if show_progress:
+            print('\nGeneration completed!')
+    finally:
+        for writers in sequence_writers:
+            for writer in writers:
+                writer.close()
+    return first_steps
+
+def build_constraints(args):
+    """Decoding constraints requested on the command line"""
+    constraints = []
+    if args.no_rest or args.pitch_range:
+        constraints.append(VoiceRange(pitch_ranges=args.pitch_range, allow_rest=not args.no_rest))
+    if args.key:
+        constraints.append(KeyConstraint(*args.key))
+    if args.no_voice_crossing:
+        constraints.append(NoVoiceCrossing())
+    return constraints
+
+def beam_steps(model, tokenizer, seed_sequence, constraints, args):
+    """
+    Beam search, then the timesteps of the best num_samples beams of every seed
+    (rows seed-major, like stream_batch). Nothing is final before the search ends,
+    so the steps are only yielded afterwards.
+    """
+    sequences, scores = beam_search(model, seed_sequence, args.num_steps, tokenizer, beam_width=args.beam_width,
+                                    constraints=constraints, sequence_length=args.sequence_length)
+    print(f"Beam search done, best log-probability: {scores[:, 0].max().item():.2f}")
+    best = sequences[:, :args.num_samples].flatten(0, 1)
+    for t in range(seed_sequence.shape[1], best.shape[1]):
+        yield best[:, t]
+
+def decode_steps(model, tokenizer, seed_sequence, sampler, constraints, args):
+    """Generated timesteps of every seed: beam search if --beam-width is set, otherwise sampling"""
+    if args.beam_width:
+        return beam_steps(model, tokenizer, seed_sequence, constraints, args)
+    return stream_batch(model, seed_sequence, args.num_steps, sequence_length=args.sequence_length,
+                        num_samples=args.num_samples, sampler=sampler)
+
+def generate_from_seeds(model, tokenizer, device, sampler, constraints, line_numbers, seeds, args):
+    """
+    Batch mode: num_samples continuations of every seed, written to
+    <output_dir>/seed_<line>_<sample>.txt, with <output_dir>/index.json listing them.
+    Seeds are generated in batches of up to --batch-size sequences with one model load.
+    """
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    decoder = NoteDecoder(tokenizer)
+    seeds_per_batch = max(1, args.batch_size // args.num_samples)
+    index = {
+        'seed_file': str(args.seed_file),
+        'num_steps': args.num_steps,
+        'num_samples': args.num_samples,
+        'sequences': [],
+    }
+    print(f"Generating {args.num_samples} sequence(s) for each of {len(line_numbers)} seeds")
     
-    notes_sequence = []
-    for step in range(generated_sequence.size(1)):
-        step_notes = [tokenizer.id_to_note[generated_sequence[0, step, channel].item()] for channel in range(4)]
-        notes_sequence.append(step_notes)
+    for start in range(0, len(line_numbers), seeds_per_batch):
+        batch_lines = line_numbers[start:start + seeds_per_batch]
+        batch_seeds = seeds[start:start + seeds_per_batch].to(device)
+        # Rows are seed-major, samples of a seed adjacent (as stream_batch orders them)
+        output_paths = [output_dir / f"seed_{line:06d}_{sample:03d}.txt"
+                        for line in batch_lines for sample in range(args.num_samples)]
+        steps = decode_steps(model, tokenizer, batch_seeds, sampler, constraints, args)
+        seed_notes = decoder(batch_seeds).repeat(args.num_samples, axis=0)
+        write_sequences(steps, seed_notes, output_paths, decoder, args.num_steps, midi=args.midi,
+                        show_progress=False)
+        
+        for i, path in enumerate(output_paths):
+            entry = {'line': batch_lines[i // args.num_samples], 'seed': seed_notes[i, 0].tolist(),
+                     'sample': i % args.num_samples, 'file': path.name}
+            if args.midi:
+                entry['midi'] = path.with_suffix('.mid').name
+            index['sequences'].append(entry)
+        # Rewritten after every batch, so an interrupted run still lists what it completed
+        tmp_path = output_dir / 'index.json.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp_path, output_dir / 'index.json')
+        print(f"{start + len(batch_lines)}/{len(line_numbers)} seeds done")
     
-    return notes_sequence
-
-def main(args):
-    device = torch.device("cuda" if torch.cuda.is_available() and not args.force_cpu else "cpu")
-    print(f"Using {device}")
+    print(f"\n{len(index['sequences'])} sequences saved to {output_dir} (index: {output_dir / 'index.json'})")
 
-    tokenizer = MusicTokenizer(max_vocab_size=128)
-    vocab_size = len(tokenizer.note_to_id)
-    print(f"Using vocabulary size: {vocab_size}")
+def load_model(args, device):
+    """
+    Load the model of args.model_path; returns (model, metadata), metadata holding what the
+    checkpoint records about its training (model_config, vocab_size, vocab_hash, sequence_length).
 
-    model = EfficientHarmonicMusicNet(
-        num_notes=vocab_size,
-        embedding_dim=args.embedding_dim,
-        hidden_size=args.hidden_size,
-        dropout=0.0
-    ).to(device)
+    Checkpoints describe their model, so --embedding-dim, --hidden-size and --causal are only
+    needed for quantized checkpoints older than that. Checkpoints written by
+    export_efficient.py quantize load as int8 models; with --quantize an fp32 checkpoint is
+    quantized after loading. Both run on CPU only. With --backend onnx, model_path is a
+    graph written by export_efficient.py onnx.
+    """
+    if args.backend == 'onnx':
+        print(f"Loading ONNX model from {args.model_path}")
+        model = OnnxModel(args.model_path)
+        return model, model.metadata
 
     print(f"Loading model from {args.model_path}")
-    checkpoint = torch.load(args.model_path, map_location=device)
-    if isinstance(checkpoint, dict) and 'model_state_dict' in checkpoint:
-        model.load_state_dict(checkpoint['model_state_dict'])
-    else:
-        model.load_state_dict(checkpoint)
+    checkpoint = load_checkpoint(args.model_path, map_location=device)
+    quantized = is_quantized_checkpoint(checkpoint)
+    if (quantized or args.quantize) and device.type != 'cpu':
+        raise SystemExit("Quantized models run on CPU only: use --force-cpu")
+    fallback = {'num_notes': 128, 'embedding_dim': args.embedding_dim, 'hidden_size': args.hidden_size,
+                'num_channels': 4, 'bidirectional': not args.causal}
+    try:
+        config = checkpoint_config(checkpoint, fallback)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    for name in ('embedding_dim', 'hidden_size'):
+        if getattr(args, name) not in (None, config[name]):
+            print(f"Ignoring --{name.replace('_', '-')} {getattr(args, name)}: the checkpoint's model has {config[name]}")
+    if args.causal and config['bidirectional']:
+        print("Ignoring --causal: the checkpoint's model is bidirectional")
+    print(f"Model: embedding {config['embedding_dim']}, hidden {config['hidden_size']}, "
+          f"{'bidirectional' if config['bidirectional'] else 'causal'}")
+
+    model = build_model(checkpoint, config)
+    if quantized:
+        print("Int8 (dynamically quantized) checkpoint")
+    elif args.quantize:
+        print("Quantizing LSTM and output layer to int8")
+        model = quantize_dynamic_int8(model)
+    metadata = {key: checkpoint[key] for key in ('vocab_size', 'vocab_hash', 'sequence_length')
+                if isinstance(checkpoint, dict) and key in checkpoint}
+    metadata.setdefault('vocab_size', config['num_notes'])
+    metadata['model_config'] = config
+    return compile_model(model, args.compile), metadata
+
+def main(args):
+    device = torch.device("cuda" if torch.cuda.is_available() and not args.force_cpu and args.backend == 'torch'
+                          else "cpu")
+    print(f"Using {device}")
+
+    model, metadata = load_model(args, device)
+    tokenizer = checkpoint_tokenizer(metadata)
+    print(f"Using vocabulary size: {len(tokenizer.note_to_id)}")
+    if args.sequence_length is None:
+        # The context the model was trained on
+        args.sequence_length = metadata.get('sequence_length', DEFAULT_SEQUENCE_LENGTH)
+    print(f"Context: {args.sequence_length} steps")
     
-    # Load seed sequence if specified
-    seed_sequence = None
-    if args.seed_file:
-        with open(args.seed_file, 'r') as f:
-            lines = f.readlines()
-            if 0 < args.seed_line <= len(lines):
-                seed_line = lines[args.seed_line - 1].strip()
-                notes = seed_line.split(',')
-                if len(notes) == 4:  # Ensure we have exactly 4 notes
-                    device = torch.device("cuda" if torch.cuda.is_available() and not args.force_cpu else "cpu")
-                    tokenizer = MusicTokenizer(max_vocab_size=128)
-                    indices = [tokenizer.note_to_id.get(note.strip(), 0) for note in notes]
-                    seed_sequence = torch.tensor([indices], dtype=torch.long, device=device).unsqueeze(1)
-                    print(f"Using seed sequence: {notes}")
-
-    generated_sequence = generate_music(
-        model,
-        tokenizer,
-        device,
-        seed_sequence=seed_sequence,  # Pass the seed sequence
-        num_steps=args.num_steps,
+    if args.beam_width and args.num_samples > args.beam_width:
+        raise SystemExit("--num-samples cannot exceed --beam-width: the best beams are the samples")
+    if args.no_voice_crossing and not args.beam_width:
+        raise SystemExit("--no-voice-crossing needs beam search (--beam-width)")
+    constraints = build_constraints(args)
+    mask = combined_token_mask(constraints, tokenizer, 4)
+    sampler = Sampler(
         temperature=args.temperature,
-        sequence_length=32  # Match training
+        top_k=args.top_k,
+        top_p=args.top_p,
+        repetition_penalty=args.repetition_penalty,
+        mask=mask,
+        seed=args.random_seed
     )
     
-    output_path = Path(args.output)
-    output_path.parent.mkdir(parents=True, exist_ok=True)
+    if args.output_dir:
+        if not args.seed_file:
+            raise SystemExit("--output-dir needs a --seed-file")
+        line_numbers, seeds = load_seeds(args.seed_file, tokenizer, lines=args.seed_lines,
+                                         sample=args.seed_sample, random_seed=args.random_seed)
+        generate_from_seeds(model, tokenizer, device, sampler, constraints, line_numbers, seeds, args)
+        return
     
-    with open(output_path, 'w') as f:
-        for step_notes in generated_sequence:
-            f.write(','.join(step_notes) + '\n')
+    # Load seed sequence if specified
+    seed_sequence = None
+    if args.seed_file:
+        _, seeds = load_seeds(args.seed_file, tokenizer, lines=[args.seed_line])
+        if len(seeds):
+            seed_sequence = seeds.to(device)
+            print(f"Using seed sequence: {tokenizer.decode(seeds[0, 0].tolist())}")
+    if seed_sequence is None:
+        seed_sequence = default_seed(tokenizer, device)
+    steps = decode_steps(model, tokenizer, seed_sequence, sampler, constraints, args)
     
-    print(f'\nSequence saved to {output_path}')
-    print(f'Sequence length: {len(generated_sequence)} steps')
+    output_paths = sample_output_paths(args.output, args.num_samples)
+    output_paths[0].parent.mkdir(parents=True, exist_ok=True)
+    decoder = NoteDecoder(tokenizer)
+    seed_notes = decoder(seed_sequence).repeat(args.num_samples, axis=0)
+    # Every step reaches the files as soon as it is sampled; nothing but the model's context is kept in memory
+    first_steps = write_sequences(steps, seed_notes, output_paths, decoder, args.num_steps, midi=args.midi)
+    
+    if len(output_paths) == 1:
+        print(f'\nSequence saved to {output_paths[0]}')
+    else:
+        print(f'\n{len(output_paths)} sequences saved to {output_paths[0]} ... {output_paths[-1]}')
+    if args.midi:
+        print(f'MIDI files saved next to the sequences ({output_paths[0].with_suffix(".mid")})')
+    print(f'Sequence length: {seed_notes.shape[1] + args.num_steps} steps')
     print(f'First 5 steps example:')
-    for i, step_notes in enumerate(generated_sequence[:5]):
+    for i, step_notes in enumerate(first_steps):
         print(f'Step {i + 1}: {step_notes}')
 
 if __name__ == '__main__':
@@ -115,27 +268,53 @@ if __name__ == '__main__':
     parser.add_argument('--output', type=str, default='output/generated_sequence.txt')
     parser.add_argument('--num-steps', type=int, default=64)
     parser.add_argument('--temperature', type=float, default=0.8)
-    parser.add_argument('--embedding-dim', type=int, default=128)
-    parser.add_argument('--hidden-size', type=int, default=256)
+    parser.add_argument('--top-k', type=int, default=0, help='Sample only among the k most likely notes (0 = off)')
+    parser.add_argument('--top-p', type=float, default=1.0, help='Nucleus sampling threshold (1.0 = off)')
+    parser.add_argument('--repetition-penalty', type=float, default=1.0,
+                        help='Penalize notes a channel played in the last 32 steps (1.0 = off)')
+    parser.add_argument('--no-rest', action='store_true', help="Never generate rests ('O')")
+    parser.add_argument('--pitch-range', nargs=2, metavar=('LOWEST', 'HIGHEST'),
+                        help='Limit generated notes to a range, e.g. C2 C6')
+    parser.add_argument('--key', nargs=2, metavar=('TONIC', 'MODE'),
+                        help='Only notes of a key, e.g. D minor (MODE: major or minor)')
+    parser.add_argument('--beam-width', type=int, default=0,
+                        help='Beam search with this many beams instead of sampling (0 = sampling); '
+                             'the best --num-samples beams are written')
+    parser.add_argument('--no-voice-crossing', action='store_true',
+                        help='Beam search only: every voice strictly above the one below, rests on top')
+    parser.add_argument('--random-seed', type=int, help='Seed of the sampling RNG, for reproducible output')
+    parser.add_argument('--num-samples', type=int, default=1,
+                        help='Number of sequences generated in parallel, written to <output>_000.txt, <output>_001.txt, ...')
+    parser.add_argument('--midi', action='store_true',
+                        help='Also write a MIDI file next to each output, step by step as it is generated')
+    parser.add_argument('--embedding-dim', type=int,
+                        help='Only for checkpoints that do not record their model (older quantized ones)')
+    parser.add_argument('--hidden-size', type=int,
+                        help='Only for checkpoints that do not record their model (older quantized ones)')
+    parser.add_argument('--sequence-length', type=int,
+                        help=f'Context window of bidirectional models (default: the training one recorded in the '
+                             f'checkpoint, else {DEFAULT_SEQUENCE_LENGTH})')
     parser.add_argument('--force-cpu', action='store_true')
+    parser.add_argument('--causal', action='store_true',
+                        help='Only for checkpoints that do not record their model: it was trained with --causal')
     parser.add_argument('--seed-file', type=str, help='File containing the initial sequence')
     parser.add_argument('--seed-line', type=int, default=1, help='Line number to use from seed file (1-based)')
+    parser.add_argument('--output-dir', type=str,
+                        help='Batch mode: continue many lines of --seed-file in one run, writing the sequences '
+                             'and an index.json to this directory')
+    parser.add_argument('--seed-lines', type=str, default='all',
+                        help="Batch mode: seed lines to use, 'all' or e.g. '1-100,250' (1-based)")
+    parser.add_argument('--seed-sample', type=int, help='Batch mode: use a random subset of this many seed lines')
+    parser.add_argument('--batch-size', type=int, default=256,
+                        help='Batch mode: maximum number of sequences generated together')
+    parser.add_argument('--backend', choices=['torch', 'onnx'], default='torch',
+                        help='onnx: run a model exported by export_efficient.py onnx (--model-path model.onnx) '
+                             'with onnxruntime on CPU; model sizes and direction come from the graph')
+    parser.add_argument('--quantize', action='store_true',
+                        help='Run an fp32 checkpoint with int8 LSTM and output layer (CPU only); checkpoints '
+                             'written by export_efficient.py quantize are recognised without this flag')
+    parser.add_argument('--compile', choices=COMPILE_MODES, default='eager',
+                        help='Execution mode: eager, torch.compile (kernels cached in .compile_cache) or TorchScript')
     
     args = parser.parse_args()
-
-    # Load seed sequence if specified
-    seed_sequence = None
-    if args.seed_file:
-        with open(args.seed_file, 'r') as f:
-            lines = f.readlines()
-            if 0 < args.seed_line <= len(lines):
-                seed_line = lines[args.seed_line - 1].strip()
-                notes = seed_line.split(',')
-                if len(notes) == 4:  # Ensure we have exactly 4 notes
-                    device = torch.device("cuda" if torch.cuda.is_available() and not args.force_cpu else "cpu")
-                    tokenizer = MusicTokenizer(max_vocab_size=128)
-                    indices = [tokenizer.note_to_id.get(note.strip(), 0) for note in notes]
-                    seed_sequence = torch.tensor([indices], dtype=torch.long, device=device).unsqueeze(1)
-                    print(f"Using seed sequence: {notes}")
-
-    main(args)
\ No newline at end of file
+    main(args)
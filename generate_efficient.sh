@@ -17,9 +17,22 @@ MODEL_PATH=${MODEL_PATH:-"checkpoints/best/best_model.pt"}
 OUTPUT=${OUTPUT:-"output/generated_sequence.txt"}
 NUM_STEPS=${NUM_STEPS:-256}
 TEMPERATURE=${TEMPERATURE:-0.8}
-EMBEDDING_DIM=${EMBEDDING_DIM:-32}
-HIDDEN_SIZE=${HIDDEN_SIZE:-64}
+TOP_K=${TOP_K:-0}  # 0 = disattivato
+TOP_P=${TOP_P:-1.0}  # 1.0 = disattivato
+REPETITION_PENALTY=${REPETITION_PENALTY:-1.0}  # 1.0 = disattivato
+# Dimensioni e contesto del modello sono letti dal checkpoint; impostali solo per sovrascriverli
+# (EMBEDDING_DIM e HIDDEN_SIZE servono solo per i vecchi checkpoint quantizzati)
+EMBEDDING_DIM=${EMBEDDING_DIM:-}
+HIDDEN_SIZE=${HIDDEN_SIZE:-}
+SEQUENCE_LENGTH=${SEQUENCE_LENGTH:-}
 FORCE_CPU=${FORCE_CPU:-false}
+COMPILE=${COMPILE:-eager}  # eager, compile (torch.compile) o script (TorchScript)
+CAUSAL=${CAUSAL:-false}  # LSTM unidirezionale, generazione incrementale
+QUANTIZE=${QUANTIZE:-false}  # LSTM e layer di output in int8 (solo CPU)
+NUM_SAMPLES=${NUM_SAMPLES:-1}  # Sequenze generate in parallelo
+BEAM_WIDTH=${BEAM_WIDTH:-0}  # 0 = sampling, altrimenti beam search con BEAM_WIDTH beam
+KEY=${KEY:-}  # Tonalità, es. "D minor" (vuoto = nessun vincolo)
+NO_VOICE_CROSSING=${NO_VOICE_CROSSING:-false}  # Solo con la beam search
 
 # Stampa la configurazione
 echo "Configurazione:"
@@ -27,9 +40,20 @@ echo "MODEL_PATH: $MODEL_PATH"
 echo "OUTPUT: $OUTPUT"
 echo "NUM_STEPS: $NUM_STEPS"
 echo "TEMPERATURE: $TEMPERATURE"
+echo "TOP_K: $TOP_K"
+echo "TOP_P: $TOP_P"
+echo "REPETITION_PENALTY: $REPETITION_PENALTY"
+echo "NUM_SAMPLES: $NUM_SAMPLES"
+echo "BEAM_WIDTH: $BEAM_WIDTH"
+echo "KEY: $KEY"
+echo "NO_VOICE_CROSSING: $NO_VOICE_CROSSING"
 echo "EMBEDDING_DIM: $EMBEDDING_DIM"
 echo "HIDDEN_SIZE: $HIDDEN_SIZE"
+echo "SEQUENCE_LENGTH: $SEQUENCE_LENGTH"
 echo "FORCE_CPU: $FORCE_CPU"
+echo "COMPILE: $COMPILE"
+echo "CAUSAL: $CAUSAL"
+echo "QUANTIZE: $QUANTIZE"
 echo
 
 # Costruisci il comando
@@ -38,14 +62,46 @@ CMD="python3 generate_efficient.py \
     --output $OUTPUT \
     --num-steps $NUM_STEPS \
     --temperature $TEMPERATURE \
-    --embedding-dim $EMBEDDING_DIM \
-    --hidden-size $HIDDEN_SIZE"
+    --top-k $TOP_K \
+    --top-p $TOP_P \
+    --repetition-penalty $REPETITION_PENALTY \
+    --num-samples $NUM_SAMPLES \
+    --beam-width $BEAM_WIDTH \
+    --compile $COMPILE"
 
 # Aggiungi opzioni condizionali
+if [ -n "$EMBEDDING_DIM" ]; then
+    CMD="$CMD --embedding-dim $EMBEDDING_DIM"
+fi
+
+if [ -n "$HIDDEN_SIZE" ]; then
+    CMD="$CMD --hidden-size $HIDDEN_SIZE"
+fi
+
+if [ -n "$SEQUENCE_LENGTH" ]; then
+    CMD="$CMD --sequence-length $SEQUENCE_LENGTH"
+fi
+
 if [ "$FORCE_CPU" = true ]; then
     CMD="$CMD --force-cpu"
 fi
 
+if [ "$CAUSAL" = true ]; then
+    CMD="$CMD --causal"
+fi
+
+if [ "$QUANTIZE" = true ]; then
+    CMD="$CMD --quantize"
+fi
+
+if [ -n "$KEY" ]; then
+    CMD="$CMD --key $KEY"
+fi
+
+if [ "$NO_VOICE_CROSSING" = true ]; then
+    CMD="$CMD --no-voice-crossing"
+fi
+
 # Esegui il comando
 echo "Esecuzione comando:"
 echo "$CMD"
@@ -54,21 +110,30 @@ eval "$CMD"
 
 # Se la generazione è riuscita, converti in MIDI e OGG
 if [ $? -eq 0 ]; then
-    echo
-    echo "Conversione in MIDI..."
-    python3 src/data_processing/sequence_to_midi.py \
-        --input $OUTPUT \
-        --output "${OUTPUT%.*}.mid"
-    
-    if [ $? -eq 0 ]; then
+    # Con NUM_SAMPLES > 1 lo script Python scrive <OUTPUT>_000.txt, <OUTPUT>_001.txt, ...
+    if [ "$NUM_SAMPLES" -gt 1 ]; then
+        OUTPUTS=$(ls "${OUTPUT%.*}"_[0-9][0-9][0-9]."${OUTPUT##*.}")
+    else
+        OUTPUTS=$OUTPUT
+    fi
+
+    for SEQUENCE in $OUTPUTS; do
         echo
-        echo "Conversione in OGG..."
-        timidity "${OUTPUT%.*}.mid" -Ov -o "${OUTPUT%.*}.ogg"
-        echo "File OGG salvato in: ${OUTPUT%.*}.ogg"
+        echo "Conversione in MIDI..."
+        python3 src/data_processing/sequence_to_midi.py \
+            --input $SEQUENCE \
+            --output "${SEQUENCE%.*}.mid"
         
-        echo
-        echo "Conversione in MP3..."
-        ffmpeg -i "${OUTPUT%.*}.ogg" -codec:a libmp3lame -qscale:a 2 "${OUTPUT%.*}.mp3" -y
-        echo "File MP3 salvato in: ${OUTPUT%.*}.mp3"
-    fi
-fi 
\ No newline at end of file
+        if [ $? -eq 0 ]; then
+            echo
+            echo "Conversione in OGG..."
+            timidity "${SEQUENCE%.*}.mid" -Ov -o "${SEQUENCE%.*}.ogg"
+            echo "File OGG salvato in: ${SEQUENCE%.*}.ogg"
+            
+            echo
+            echo "Conversione in MP3..."
+            ffmpeg -i "${SEQUENCE%.*}.ogg" -codec:a libmp3lame -qscale:a 2 "${SEQUENCE%.*}.mp3" -y
+            echo "File MP3 salvato in: ${SEQUENCE%.*}.mp3"
+        fi
+    done
+fi
@@ -0,0 +1,55 @@
+import argparse
+import torch
+from src.model.checkpoint import DEFAULT_SEQUENCE_LENGTH, checkpoint_tokenizer
+from src.model.compile import COMPILE_MODES
+from src.generation.server import GenerationService, serve
+from generate_efficient import load_model
+
+def main(args):
+    device = torch.device("cuda" if torch.cuda.is_available() and not args.force_cpu and args.backend == 'torch'
+                          else "cpu")
+    print(f"Using {device}")
+
+    # Tokenizer and model are loaded once and stay resident for every request
+    model, metadata = load_model(args, device)
+    tokenizer = checkpoint_tokenizer(metadata)
+    sequence_length = args.sequence_length or metadata.get('sequence_length', DEFAULT_SEQUENCE_LENGTH)
+
+    service = GenerationService(
+        model,
+        tokenizer,
+        device,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        sequence_length=sequence_length
+    )
+    print(f"Batching: up to {args.max_batch_size} sequences per forward pass, max wait {args.max_wait_ms} ms")
+    serve(service, args.host, args.port)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local music generation server with request batching')
+    parser.add_argument('--model-path', type=str, default='model.pt')
+    parser.add_argument('--embedding-dim', type=int,
+                        help='Only for checkpoints that do not record their model (older quantized ones)')
+    parser.add_argument('--hidden-size', type=int,
+                        help='Only for checkpoints that do not record their model (older quantized ones)')
+    parser.add_argument('--sequence-length', type=int,
+                        help='Context window of bidirectional models (default: the training one of the checkpoint)')
+    parser.add_argument('--force-cpu', action='store_true')
+    parser.add_argument('--causal', action='store_true',
+                        help='Only for checkpoints that do not record their model: it was trained with --causal')
+    parser.add_argument('--backend', choices=['torch', 'onnx'], default='torch',
+                        help='onnx: serve a model exported by export_efficient.py onnx with onnxruntime (CPU)')
+    parser.add_argument('--quantize', action='store_true',
+                        help='Run an fp32 checkpoint with int8 LSTM and output layer (CPU only)')
+    parser.add_argument('--compile', choices=COMPILE_MODES, default='eager',
+                        help='Execution mode: eager, torch.compile (kernels cached in .compile_cache) or TorchScript')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max-batch-size', type=int, default=64,
+                        help='Maximum number of sequences generated in one forward pass')
+    parser.add_argument('--max-wait-ms', type=float, default=10,
+                        help='How long an idle server waits for more requests before starting a batch')
+    
+    args = parser.parse_args()
+    main(args)
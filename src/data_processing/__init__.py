@@ -3,12 +3,18 @@
 This package contains utilities for processing MIDI files and preparing datasets.
 """
 
+from .augment import TranspositionAugmenter
 from .midi_to_dataset import MidiConverter, process_midi_directory
 from .prepare_dataset import MusicSequenceDataset, prepare_dataloaders
+from .token_store import ShardWriter, TokenStore, load_token_dataset
 
 __all__ = [
     'MidiConverter',
     'MusicSequenceDataset',
+    'ShardWriter',
+    'TokenStore',
+    'TranspositionAugmenter',
+    'load_token_dataset',
     'prepare_dataloaders',
     'process_midi_directory'
 ]
@@ -1,5 +1,5 @@
-import torch
 from src.model.tokenizer import MusicTokenizer
+from src.data_processing.token_store import TokenStore, load_token_dataset
 import numpy as np
 from collections import Counter
 
@@ -7,7 +7,7 @@ def analyze_dataset(dataset_path):
     """Analizza il dataset musicale"""
     # Carica il dataset e il tokenizer
     print("Caricamento dataset...")
-    data = torch.load(dataset_path)
+    data = load_token_dataset(dataset_path)
     tokenizer = MusicTokenizer()
     
     # Informazioni di base sul dataset
@@ -16,6 +16,9 @@ def analyze_dataset(dataset_path):
     print(f"Tipo di dati: {data.dtype}")
     print(f"Numero di timestep: {data.shape[0]}")
     print(f"Numero di canali: {data.shape[1]}")
+    if isinstance(data, TokenStore):
+        print(f"Numero di brani: {len(data.songs)}")
+        print(f"Shard: {len(data.shards)}")
     
     # Analisi delle note
     print("\nAnalisi delle note:")
@@ -63,7 +66,7 @@ if __name__ == "__main__":
     
     parser = argparse.ArgumentParser(description='Analizza il dataset musicale')
     parser.add_argument('--dataset', default='output/music_dataset.pt',
-                      help='Percorso del dataset PyTorch')
+                      help='Percorso del dataset (file .pt o directory di shard)')
     
     args = parser.parse_args()
     analyze_dataset(args.dataset) 
\ No newline at end of file
@@ -0,0 +1,60 @@
+# Third-party imports
+import torch
+
+# Local imports
+from src.model.tokenizer import pitch_to_note
+
+class TranspositionAugmenter:
+    """Random key transposition of whole batches through a precomputed token -> token table.
+
+    table[k, t] is the token of note t transposed by (k - max_shift)
+    semitones, so transposing a batch is a single indexing operation, on
+    whatever device the table lives on. Rests stay rests. Notes that leave
+    the vocabulary's pitch range become rests (out_of_range='rest') or are
+    moved back into range by whole octaves (out_of_range='fold').
+    """
+    def __init__(self, tokenizer, max_shift=6, out_of_range='rest', device='cpu'):
+        if out_of_range not in ('rest', 'fold'):
+            raise ValueError(f"Unknown out_of_range mode: {out_of_range}")
+        self.max_shift = max_shift
+        self.out_of_range = out_of_range
+        self.table = self._build_table(tokenizer).to(device)
+
+    def _build_table(self, tokenizer):
+        pitches = tokenizer.pitch_table()
+        rest_id = tokenizer.note_to_id['O']
+        # Transposed notes are written with the canonical names the MIDI converter produces
+        pitch_to_id = {pitch: tokenizer.note_to_id[pitch_to_note(pitch)]
+                       for pitch in set(pitches) if pitch >= 0 and pitch_to_note(pitch) in tokenizer.note_to_id}
+        lowest, highest = min(pitch_to_id), max(pitch_to_id)
+
+        table = torch.full((2 * self.max_shift + 1, len(pitches)), rest_id, dtype=torch.long)
+        for row, shift in enumerate(range(-self.max_shift, self.max_shift + 1)):
+            for token, pitch in enumerate(pitches):
+                if pitch < 0:
+                    table[row, token] = token  # rests (and unparsable tokens) are left alone
+                    continue
+                pitch += shift
+                if self.out_of_range == 'fold':
+                    while pitch > highest:
+                        pitch -= 12
+                    while pitch < lowest:
+                        pitch += 12
+                table[row, token] = pitch_to_id.get(pitch, rest_id)
+        return table
+
+    def to(self, device):
+        self.table = self.table.to(device)
+        return self
+
+    def __call__(self, data, target, shifts=None):
+        """Transpose each sequence of a (batch, time, channels) batch, and its target, by a random shift.
+
+        `shifts` optionally gives the shift (in semitones) of every sequence.
+        """
+        if shifts is None:
+            rows = torch.randint(0, self.table.shape[0], (data.shape[0],), device=self.table.device)
+        else:
+            rows = torch.as_tensor(shifts, device=self.table.device) + self.max_shift
+        rows = rows.view(-1, 1, 1)
+        return self.table[rows, data], self.table[rows, target]
@@ -8,6 +8,8 @@ import pretty_midi
 
 # Local imports
 from src.model import MusicTokenizer
+from src.model.tokenizer import note_to_pitch
+from src.data_processing.token_store import TokenStore, load_token_dataset
 
 class DatasetToMidiConverter:
     def __init__(self, channels=4, time_step=0.25, max_vocab_size=128):
@@ -17,25 +19,8 @@ class DatasetToMidiConverter:
         self.id_to_note = {v: k for k, v in self.tokenizer.note_to_id.items()}  # Reverse mapping
         
     def _pitch_name_to_midi_number(self, pitch_name):
-        """Convert pitch name (e.g., 'C4' or 'C4#') to MIDI note number"""
-        if pitch_name == 'O':  # Rest
-            return None
-            
-        # Handle sharp notes (e.g., 'C4#')
-        if '#' in pitch_name:
-            note = pitch_name[0]
-            octave = int(pitch_name[2:-1])
-            sharp = True
-        else:
-            note = pitch_name[0]
-            octave = int(pitch_name[1:])
-            sharp = False
-            
-        NOTES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-        note_index = NOTES.index(note)
-        if sharp:
-            note_index += 1
-        return (octave + 1) * 12 + note_index
+        """Convert pitch name (e.g., 'C4', 'C4#' or 'D4b') to MIDI note number; None for a rest"""
+        return note_to_pitch(pitch_name)
     
     def convert_to_midi(self, tokens, output_path):
         """Convert tokenized tensor back to MIDI file"""
@@ -87,7 +72,17 @@ def process_dataset_to_midi(dataset_path, output_dir):
     
     # Load the dataset
     try:
-        dataset = torch.load(dataset_path)
+        dataset = load_token_dataset(dataset_path)
+        
+        if isinstance(dataset, TokenStore):
+            # Song boundaries are known: write one MIDI file per song
+            for i, song in enumerate(dataset.songs):
+                song_name = Path(song['name']).stem
+                output_path = os.path.join(output_dir, f"{i:05d}_{song_name}.mid")
+                if not converter.convert_to_midi(dataset.song(i), output_path):
+                    print(f"Failed to convert song {song['name']}")
+            print(f"Successfully processed {dataset_path}")
+            return
         
         # Generate output filename
         dataset_name = Path(dataset_path).stem
@@ -107,7 +102,7 @@ if __name__ == "__main__":
     import argparse
     
     parser = argparse.ArgumentParser(description='Convert tokenized dataset to MIDI files')
-    parser.add_argument('dataset_path', help='Path to the .pt dataset file')
+    parser.add_argument('dataset_path', help='Path to the .pt dataset file or sharded dataset directory')
     parser.add_argument('output_dir', help='Directory to save the MIDI files')
     
     args = parser.parse_args()
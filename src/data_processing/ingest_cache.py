@@ -0,0 +1,105 @@
+# Standard library imports
+import hashlib
+import json
+import os
+from pathlib import Path
+
+# Third-party imports
+import numpy as np
+
+MANIFEST_VERSION = 1
+
+def file_content_hash(path, chunk_size=1 << 20):
+    """SHA-256 of a file's bytes"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class IngestionCache:
+    """Persistent cache of converted MIDI files, keyed by content hash.
+    
+    The manifest (``manifest.json``) maps each source path to its size, mtime
+    and content hash, so unchanged files are not even re-hashed. Token arrays
+    are stored once per (content hash, converter settings) under
+    ``tokens/<settings key>/<hash>.npy``, which also means byte-identical
+    files share a single entry. Conversion failures are remembered too, so a
+    file the converter cannot read is not retried on every run (timeouts and
+    crashed workers are not stored: see midi_to_dataset._is_transient_failure).
+    """
+    def __init__(self, cache_dir, settings):
+        self.cache_dir = Path(cache_dir)
+        # Settings that change the produced tokens (e.g. not the engine, which is exact)
+        self.settings = dict(settings)
+        self.settings_key = hashlib.sha256(
+            json.dumps(self.settings, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        self.tokens_dir = self.cache_dir / 'tokens' / self.settings_key
+        self.tokens_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.cache_dir / 'manifest.json'
+        self.manifest = self._load_manifest()
+        self.failures = self.manifest['failures'].setdefault(self.settings_key, {})
+    
+    def _load_manifest(self):
+        if self.manifest_path.exists():
+            try:
+                with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                if manifest.get('version') == MANIFEST_VERSION:
+                    return manifest
+                print(f"Ignoring ingestion manifest with unknown version: {self.manifest_path}")
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable ingestion manifest {self.manifest_path}: {e}")
+        return {'version': MANIFEST_VERSION, 'files': {}, 'settings': {}, 'failures': {}}
+    
+    def content_hash(self, midi_path):
+        """Content hash of a file, reusing the manifest entry if size and mtime are unchanged"""
+        key = str(midi_path)
+        stat = os.stat(midi_path)
+        entry = self.manifest['files'].get(key)
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry['hash']
+        content_hash = file_content_hash(midi_path)
+        self.manifest['files'][key] = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'hash': content_hash,
+        }
+        return content_hash
+    
+    def _tokens_path(self, content_hash):
+        return self.tokens_dir / f"{content_hash}.npy"
+    
+    def has_tokens(self, content_hash):
+        return self._tokens_path(content_hash).exists()
+    
+    def load_tokens(self, content_hash):
+        """Cached token array (int64) for a content hash, or None"""
+        path = self._tokens_path(content_hash)
+        if not path.exists():
+            return None
+        return np.load(path).astype(np.int64)
+    
+    def store_tokens(self, content_hash, tokens):
+        """Store a converted token array (written atomically, in the smallest fitting dtype)"""
+        dtype = np.uint8 if tokens.size == 0 or tokens.max() < 256 else np.uint16
+        path = self._tokens_path(content_hash)
+        tmp_path = path.with_suffix('.tmp.npy')
+        np.save(tmp_path, tokens.astype(dtype))
+        os.replace(tmp_path, path)
+        self.failures.pop(content_hash, None)
+    
+    def failure(self, content_hash):
+        """Error message of a previous failed conversion, or None"""
+        return self.failures.get(content_hash)
+    
+    def store_failure(self, content_hash, error):
+        self.failures[content_hash] = error
+    
+    def save(self):
+        """Write the manifest atomically"""
+        self.manifest['settings'][self.settings_key] = self.settings
+        tmp_path = self.manifest_path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
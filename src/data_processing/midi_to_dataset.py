@@ -1,6 +1,13 @@
 # Standard library imports
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 import os
 from pathlib import Path
+import signal
+import sys
+import time
 
 # Third-party imports
 import numpy as np
@@ -9,103 +16,474 @@ import torch
 
 # Local imports
 from src.model import MusicTokenizer
+from src.model.tokenizer import pitch_to_note
+from src.data_processing.ingest_cache import IngestionCache, file_content_hash
+from src.data_processing.token_store import DEFAULT_SHARD_TIMESTEPS, ShardWriter, token_dtype, write_songs_index
 
 class MidiConverter:
-    def __init__(self, channels=4, time_step=0.25, max_vocab_size=128):  # time_step = quarter note
+    def __init__(self, channels=4, time_step=0.25, max_vocab_size=128, engine='sweep'):  # time_step = quarter note
+        if engine not in ('sweep', 'scan'):
+            raise ValueError(f"Unknown quantization engine: {engine}")
         self.tokenizer = MusicTokenizer(max_vocab_size=max_vocab_size)
         self.channels = channels
         self.time_step = time_step
+        self.max_vocab_size = max_vocab_size
+        self.engine = engine  # 'sweep' (vectorized) or 'scan' (reference)
+        self._pitch_table = None
     
     def _note_to_pitch_name(self, note_number):
-        """Convert MIDI note number to pitch name (e.g., 60 -> 'C4')"""
-        NOTES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-        octave = (note_number // 12) - 1
-        note = NOTES[note_number % 12]
-        # Format note to match vocab.txt format (all sharps after octave number)
-        if '#' in note:
-            base_note = note[0]
-            return f"{base_note}{octave}#"  # Format for all sharp notes (e.g., C4#)
-        return f"{note}{octave}"
+        """Convert MIDI note number to pitch name (e.g., 60 -> 'C4', 61 -> 'C4#' as in vocab.txt)"""
+        return pitch_to_note(note_number)
     
     def convert_midi_file(self, midi_path):
         """Convert a single MIDI file to our model's format"""
         try:
-            # Convert Path object to string
-            midi_path_str = str(midi_path)
-            midi_data = pretty_midi.PrettyMIDI(midi_path_str)
-            
-            # Get the total duration in beats
-            total_beats = int(midi_data.get_end_time() / self.time_step)
-            
-            # Initialize empty sequence
-            sequence = []
-            
-            # Process each beat
-            for beat in range(total_beats):
-                start_time = beat * self.time_step
-                end_time = (beat + 1) * self.time_step
-                
-                # Find all notes that are active in this time step
-                active_notes = []
-                for instrument in midi_data.instruments:
-                    if instrument.is_drum:  # Skip drum tracks
-                        continue
-                    for note in instrument.notes:
-                        if note.start < end_time and note.end > start_time:
-                            active_notes.append(note.pitch)
-                
-                # Convert MIDI note numbers to pitch names
-                if active_notes:
-                    # Sort and take up to channels notes
-                    active_notes = sorted(set(active_notes))[:self.channels]
-                    chord = [self._note_to_pitch_name(note) for note in active_notes]
-                    # Pad with 'O' if fewer than channels notes
-                    chord.extend(['O'] * (self.channels - len(chord)))
-                else:
-                    # If no notes are active, represent as a rest
-                    chord = ['O'] * self.channels
-                
-                sequence.append(chord)
-            
-            # Convert to tensor using tokenizer
-            tokens = torch.tensor([
-                [self.tokenizer.note_to_id[note] for note in bar]
-                for bar in sequence
-            ], dtype=torch.long)
-            
-            return tokens
-            
+            return self._convert(midi_path)
         except Exception as e:
             print(f"Error processing {midi_path}: {str(e)}")
             if isinstance(e, KeyError):
                 print("Note not found in vocabulary. Available notes in vocabulary:", sorted(self.tokenizer.note_to_id.keys()))
                 print("Problematic note:", e.args[0])  # Print the specific note that caused the error
             return None
+    
+    def settings(self):
+        """Keyword arguments that recreate an equivalent converter (e.g. in a worker process)"""
+        return {
+            'channels': self.channels,
+            'time_step': self.time_step,
+            'max_vocab_size': self.max_vocab_size,
+            'engine': self.engine,
+        }
+    
+    def _convert(self, midi_path):
+        """Like convert_midi_file, but lets exceptions propagate to the caller"""
+        # Convert Path object to string
+        midi_path_str = str(midi_path)
+        midi_data = pretty_midi.PrettyMIDI(midi_path_str)
+        
+        if self.engine == 'scan':
+            return self._quantize_scan(midi_data)
+        return self._quantize_sweep(midi_data)
+    
+    def _quantize_scan(self, midi_data):
+        """Reference quantizer: scans every note for every beat (O(beats x notes))"""
+        # Get the total duration in beats
+        total_beats = int(midi_data.get_end_time() / self.time_step)
+        
+        # Initialize empty sequence
+        sequence = []
+        
+        # Process each beat
+        for beat in range(total_beats):
+            start_time = beat * self.time_step
+            end_time = (beat + 1) * self.time_step
+            
+            # Find all notes that are active in this time step
+            active_notes = []
+            for instrument in midi_data.instruments:
+                if instrument.is_drum:  # Skip drum tracks
+                    continue
+                for note in instrument.notes:
+                    if note.start < end_time and note.end > start_time:
+                        active_notes.append(note.pitch)
+            
+            # Convert MIDI note numbers to pitch names
+            if active_notes:
+                # Sort and take up to channels notes
+                active_notes = sorted(set(active_notes))[:self.channels]
+                chord = [self._note_to_pitch_name(note) for note in active_notes]
+                # Pad with 'O' if fewer than channels notes
+                chord.extend(['O'] * (self.channels - len(chord)))
+            else:
+                # If no notes are active, represent as a rest
+                chord = ['O'] * self.channels
+            
+            sequence.append(chord)
+        
+        # Convert to tensor using tokenizer
+        tokens = torch.tensor([
+            [self.tokenizer.note_to_id[note] for note in bar]
+            for bar in sequence
+        ], dtype=torch.long)
+        
+        return tokens
+    
+    def _quantize_sweep(self, midi_data):
+        """Interval-sweep quantizer: builds the piano-roll in one vectorized pass.
+        
+        Produces exactly the same tokens as ``_quantize_scan``.
+        """
+        total_beats = int(midi_data.get_end_time() / self.time_step)
+        if total_beats <= 0:
+            return torch.tensor([], dtype=torch.long)
+        
+        # Collect (start, end, pitch) of every non-drum note
+        notes = [(note.start, note.end, note.pitch)
+                 for instrument in midi_data.instruments if not instrument.is_drum
+                 for note in instrument.notes]
+        rest_id = self.tokenizer.note_to_id['O']
+        if not notes:
+            return torch.full((total_beats, self.channels), rest_id, dtype=torch.long)
+        starts, ends, pitches = (np.array(column) for column in zip(*notes))
+        pitches = pitches.astype(np.int64)
+        
+        # Beat boundaries computed exactly like the reference (beat * time_step)
+        edges = np.arange(total_beats + 1, dtype=np.float64) * self.time_step
+        # A note is active in beat b iff edges[b] < end and edges[b + 1] > start
+        first_beat = np.searchsorted(edges[1:], starts, side='right')
+        last_beat = np.searchsorted(edges[:-1], ends, side='left')
+        valid = first_beat < last_beat
+        
+        # Difference array over (beat, pitch), then prefix sum -> piano-roll
+        roll = np.zeros((total_beats + 1, 128), dtype=np.int32)
+        np.add.at(roll, (first_beat[valid], pitches[valid]), 1)
+        np.add.at(roll, (last_beat[valid], pitches[valid]), -1)
+        active = np.cumsum(roll[:-1], axis=0) > 0
+        
+        # Keep the lowest `channels` active pitches of every beat
+        rank = np.cumsum(active, axis=1) - 1
+        selected = active & (rank < self.channels)
+        beats, selected_pitches = np.nonzero(selected)
+        token_ids = self._pitch_token_table()[selected_pitches]
+        
+        missing = np.flatnonzero(token_ids < 0)
+        if missing.size:
+            raise KeyError(self._note_to_pitch_name(int(selected_pitches[missing[0]])))
+        
+        tokens = np.full((total_beats, self.channels), rest_id, dtype=np.int64)
+        tokens[beats, rank[beats, selected_pitches]] = token_ids
+        return torch.from_numpy(tokens)
+    
+    def _pitch_token_table(self):
+        """Lookup table MIDI pitch -> token id (-1 if the pitch is not in the vocabulary)"""
+        if self._pitch_table is None:
+            self._pitch_table = np.array([
+                self.tokenizer.note_to_id.get(self._note_to_pitch_name(pitch), -1)
+                for pitch in range(128)
+            ], dtype=np.int64)
+        return self._pitch_table
+
+DEFAULT_FILE_TIMEOUT = 120  # seconds
+# Extra wait of the parent before recycling the pool, so the worker's own SIGALRM fires first
+POOL_TIMEOUT_GRACE = 5  # seconds
+
+# Converter owned by each worker process (see _init_worker)
+_worker_converter = None
+
+@contextmanager
+def _time_limit(seconds):
+    """Raise TimeoutError if the body runs longer than `seconds`.
+    
+    A no-op without SIGALRM (Windows): there convert_midi_files always uses a
+    process pool and enforces the timeout from the parent.
+    """
+    if not seconds or not hasattr(signal, 'SIGALRM'):
+        yield
+        return
+    
+    def _on_timeout(signum, frame):
+        raise TimeoutError(f"conversion exceeded {seconds}s")
+    
+    previous = signal.signal(signal.SIGALRM, _on_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+def _init_worker(settings):
+    global _worker_converter
+    _worker_converter = MidiConverter(**settings)
+
+def _convert_task(converter, midi_path, timeout):
+    """Convert one file; returns (tokens as numpy array or None, seconds, error message or None)"""
+    start = time.perf_counter()
+    try:
+        with _time_limit(timeout):
+            tokens = converter._convert(midi_path)
+        return tokens.numpy(), time.perf_counter() - start, None
+    except Exception as e:
+        return None, time.perf_counter() - start, f"{type(e).__name__}: {e}"
+
+def _worker_convert(midi_path, timeout):
+    return _convert_task(_worker_converter, midi_path, timeout)
+
+def _is_transient_failure(error):
+    """True for the error message of a conversion that timed out or lost its worker process.
+    
+    These depend on the run (machine load, --timeout, a crash of a worker
+    converting another file), not on the file, so they are not cached.
+    """
+    return error.startswith((f"{TimeoutError.__name__}:", f"{BrokenProcessPool.__name__}:"))
 
-def process_midi_directory(input_dir, output_dir):
-    """Process all MIDI files in a directory and save the converted data"""
+def _start_pool(converter, workers):
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                               initargs=(converter.settings(),))
+
+def _stop_pool(executor):
+    """Shut down a pool even if a worker is stuck in a conversion"""
+    # A running task cannot be cancelled: terminate the worker processes
+    for process in list((executor._processes or {}).values()):
+        process.terminate()
+    executor.shutdown(wait=True, cancel_futures=True)
+
+def _restart_pool(executor, converter, workers):
+    _stop_pool(executor)
+    return _start_pool(converter, max(workers, 1))
+
+def _pool_result(future, timeout):
+    """(result of a conversion submitted to the pool, whether the pool must be replaced)"""
+    try:
+        # Every earlier file is done, so this one has been running at least this long
+        return future.result(timeout=timeout + POOL_TIMEOUT_GRACE if timeout else None), False
+    except FutureTimeoutError:
+        return (None, float(timeout), f"TimeoutError: conversion exceeded {timeout}s"), True
+    except BrokenProcessPool as e:  # A worker died, e.g. by a crash in a native library
+        return (None, 0.0, f"{type(e).__name__}: {e}"), True
+    except Exception as e:
+        return (None, 0.0, f"{type(e).__name__}: {e}"), False
+
+def _resubmit(executor, pending, timeout):
+    """Files in flight on a stopped pool: those that finished keep their result, the others go to `executor`"""
+    for midi_path, future in pending:
+        if not future.done() or future.cancelled() or future.exception() is not None:
+            future = executor.submit(_worker_convert, midi_path, timeout)
+        yield midi_path, future
+
+def find_midi_files(input_dir):
+    """All MIDI/karaoke files below input_dir, in a deterministic order"""
+    return sorted(list(Path(input_dir).glob('**/*.mid')) + \
+                  list(Path(input_dir).glob('**/*.midi')) + \
+                  list(Path(input_dir).glob('**/*.kar')))  # Aggiunto supporto per file .kar
+
+def convert_midi_files(converter, midi_files, workers=1, timeout=DEFAULT_FILE_TIMEOUT):
+    """Convert MIDI files, optionally across a process pool.
+    
+    Yields (midi_path, tokens, seconds, error) in the order of `midi_files`,
+    whatever the number of workers. A file that fails or exceeds `timeout`
+    seconds yields tokens=None and an error message instead of stopping the batch.
+    
+    Workers stop a slow conversion themselves with SIGALRM where available;
+    the parent also gives up on a file that keeps a worker busy past the
+    timeout (a platform without SIGALRM, a long call in a native library)
+    and replaces the pool. A pool whose worker died is replaced too, and
+    only the file that killed it is reported: the others in flight are
+    converted again.
+    """
+    if workers <= 1 and (not timeout or hasattr(signal, 'SIGALRM')):
+        for midi_path in midi_files:
+            yield (midi_path,) + _convert_task(converter, midi_path, timeout)
+        return
+    
+    executor = _start_pool(converter, max(workers, 1))
+    # Keep a bounded window of files in flight and consume it in submission order
+    pending = deque()
+    try:
+        files = iter(midi_files)
+        for midi_path in files:
+            pending.append((midi_path, executor.submit(_worker_convert, midi_path, timeout)))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            midi_path, future = pending.popleft()
+            result, broken = _pool_result(future, timeout)
+            if broken:
+                # Free the stuck or dead worker; the files in flight with it are resubmitted below
+                executor = _restart_pool(executor, converter, workers)
+                if result[2].startswith(BrokenProcessPool.__name__):
+                    # Every file in flight fails with a dead worker: convert this one alone to tell
+                    # whether it is the one that killed it
+                    result, broken = _pool_result(executor.submit(_worker_convert, midi_path, timeout), timeout)
+                    if broken:
+                        executor = _restart_pool(executor, converter, workers)
+                pending = deque(_resubmit(executor, pending, timeout))
+            yield (midi_path,) + result
+            next_path = next(files, None)
+            if next_path is not None:
+                pending.append((next_path, executor.submit(_worker_convert, next_path, timeout)))
+    finally:
+        # Files still in flight if the caller stopped early
+        if pending:
+            _stop_pool(executor)
+        else:
+            executor.shutdown()
+
+def _iter_corpus(converter, midi_files, cache, workers, timeout, retry_failed, stats, known_hashes=None):
+    """Yield (midi_path, content_hash, tokens) for every distinct file, converting only what the cache lacks.
+    
+    Byte-identical files are yielded once (for their first path), and files
+    whose hash is in `known_hashes` (hash -> name, e.g. songs already written
+    by a resumed ingest) are not yielded at all. Conversion failures are
+    recorded in `stats` and skipped.
+    """
+    # Hash every file and drop byte-identical duplicates
+    unique = []
+    known_hashes = known_hashes or {}
+    first_path = {}
+    for midi_path in midi_files:
+        content_hash = cache.content_hash(midi_path) if cache else file_content_hash(midi_path)
+        if content_hash in first_path:
+            stats['duplicates'].append((midi_path, first_path[content_hash]))
+            continue
+        first_path[content_hash] = midi_path
+        # Copies of a song already written count as duplicates above, not as resumed songs
+        if content_hash in known_hashes:
+            stats['resumed'] += 1
+            continue
+        failure = cache.failure(content_hash) if cache and not retry_failed else None
+        if failure and not _is_transient_failure(failure):
+            stats['failures'].append((midi_path, f"cached failure: {failure}"))
+            continue
+        unique.append((midi_path, content_hash))
+    
+    to_convert = [midi_path for midi_path, content_hash in unique
+                  if not (cache and cache.has_tokens(content_hash))]
+    conversions = convert_midi_files(converter, to_convert, workers, timeout)
+    
+    try:
+        for midi_path, content_hash in unique:
+            tokens = cache.load_tokens(content_hash) if cache else None
+            if tokens is not None:
+                stats['cached'] += 1
+                yield midi_path, content_hash, tokens
+                continue
+            
+            # Conversions come back in the same order as to_convert
+            _, tokens, seconds, error = next(conversions)
+            print(f"Processed {midi_path} ({seconds:.2f}s)")
+            stats['timings'][midi_path] = seconds
+            if error is not None:
+                print(f"Error processing {midi_path}: {error}")
+                stats['failures'].append((midi_path, error))
+                # Convert the file again next run after a timeout or a worker crash
+                if cache and not _is_transient_failure(error):
+                    cache.store_failure(content_hash, error)
+                continue
+            if cache:
+                cache.store_tokens(content_hash, tokens)
+                if len(stats['timings']) % 50 == 0:
+                    cache.save()
+            yield midi_path, content_hash, tokens
+    finally:
+        conversions.close()
+        if cache:
+            cache.save()
+
+def _peak_rss_mb():
+    """Peak resident memory (MB) of this process and of its finished children, if available"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None, None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+def _print_summary(stats, elapsed):
+    """Print cache usage, failures, timing and memory statistics of an ingestion run"""
+    timings, failures = stats['timings'], stats['failures']
+    print(f"\nConverted {len(timings)} files in {elapsed:.1f}s "
+          f"({len(timings) / max(elapsed, 1e-9):.1f} files/s), "
+          f"reused {stats['cached']} from cache, skipped {len(stats['duplicates'])} duplicates")
+    if stats['resumed']:
+        print(f"Kept {stats['resumed']} songs already written before the run was interrupted")
+    main_rss, children_rss = _peak_rss_mb()
+    if main_rss is not None:
+        print(f"Peak memory: {main_rss:.1f} MB (workers: {children_rss:.1f} MB), "
+              f"largest song held in memory: {stats['peak_song_bytes'] / (1024 * 1024):.2f} MB")
+    if timings:
+        durations = sorted(timings.values())
+        print(f"Per-file time: mean {sum(durations) / len(durations):.3f}s, "
+              f"median {durations[len(durations) // 2]:.3f}s, max {durations[-1]:.3f}s")
+        slowest = sorted(timings.items(), key=lambda item: item[1], reverse=True)[:5]
+        print("Slowest files:")
+        for midi_path, seconds in slowest:
+            print(f"  {seconds:.3f}s  {midi_path}")
+    if failures:
+        print(f"Failed files ({len(failures)}):")
+        for midi_path, error in failures:
+            print(f"  {midi_path}: {error}")
+
+def process_midi_directory(input_dir, output_dir, workers=1, timeout=DEFAULT_FILE_TIMEOUT,
+                           cache_dir=None, use_cache=True, retry_failed=False, output_format='pt',
+                           shard_timesteps=DEFAULT_SHARD_TIMESTEPS, resume=True):
+    """Process all MIDI files in a directory and save the converted data
+    
+    Converted files are cached by content hash in `cache_dir` (default
+    ``<output_dir>/.ingest_cache``), so a rerun only converts new or changed
+    files. Byte-identical files are included in the dataset only once.
+    
+    output_format 'pt' writes a single int64 tensor to music_dataset.pt,
+    which needs the whole corpus in memory. 'shards' streams each song into
+    a memory-mappable token store in music_dataset/ as soon as it is
+    converted (see src.data_processing.token_store), so memory stays bounded
+    by the songs in flight; with `resume` an interrupted run continues from
+    the last completed shard.
+    """
     converter = MidiConverter(max_vocab_size=128)  # Limiting vocabulary size to 128
     
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
     
+    cache = None
+    if use_cache:
+        cache_settings = {
+            'channels': converter.channels,
+            'time_step': converter.time_step,
+            'vocab_hash': converter.tokenizer.vocab_hash(),
+        }
+        cache = IngestionCache(cache_dir or os.path.join(output_dir, '.ingest_cache'), cache_settings)
+    
+    midi_files = find_midi_files(input_dir)
+    stats = {'timings': {}, 'failures': [], 'duplicates': [], 'cached': 0, 'resumed': 0, 'peak_song_bytes': 0}
+    start_time = time.perf_counter()
+    
+    if output_format == 'shards':
+        output_path = os.path.join(output_dir, 'music_dataset')
+        vocab_size = len(converter.tokenizer.note_to_id)
+        writer = ShardWriter(output_path, channels=converter.channels, dtype=token_dtype(vocab_size),
+                             shard_timesteps=shard_timesteps, vocab_hash=converter.tokenizer.vocab_hash(),
+                             resume=resume)
+        if writer.resumed:
+            print(f"Resuming {output_path}: {len(writer.songs)} songs in {len(writer.shards)} completed shards")
+        with writer:
+            # Each song goes straight to the open shard file; nothing is accumulated
+            for midi_path, content_hash, sequence in _iter_corpus(
+                    converter, midi_files, cache, workers, timeout, retry_failed, stats,
+                    known_hashes=writer.committed_hashes()):
+                stats['peak_song_bytes'] = max(stats['peak_song_bytes'], sequence.nbytes)
+                writer.add_song(os.path.relpath(midi_path, input_dir), sequence, content_hash)
+        
+        _print_summary(stats, time.perf_counter() - start_time)
+        if writer.songs:
+            print(f"\nDataset saved to {output_path}")
+            print(f"Total sequences: {len(writer.songs)}")
+            print(f"Total timesteps: {sum(song['length'] for song in writer.songs)} "
+                  f"({writer.dtype.name}, {len(writer.shards)} shards)")
+        else:
+            print("No valid sequences were processed.")
+        return
+    
     # Process each MIDI file
     all_sequences = []
-    midi_files = list(Path(input_dir).glob('**/*.mid')) + \
-                 list(Path(input_dir).glob('**/*.midi')) + \
-                 list(Path(input_dir).glob('**/*.kar'))  # Aggiunto supporto per file .kar
+    song_names = []
+    for midi_path, content_hash, sequence in _iter_corpus(converter, midi_files, cache, workers, timeout,
+                                                          retry_failed, stats):
+        stats['peak_song_bytes'] = max(stats['peak_song_bytes'], sequence.nbytes)
+        all_sequences.append(torch.from_numpy(sequence))
+        song_names.append(os.path.relpath(midi_path, input_dir))
     
-    for midi_path in midi_files:
-        print(f"Processing {midi_path}")
-        sequence = converter.convert_midi_file(midi_path)
-        if sequence is not None:
-            all_sequences.append(sequence)
+    _print_summary(stats, time.perf_counter() - start_time)
     
     if all_sequences:
         # Combine all sequences and save
         combined_data = torch.cat(all_sequences, dim=0)
         output_path = os.path.join(output_dir, 'music_dataset.pt')
         torch.save(combined_data, output_path)
+        # Song boundaries, so that training windows do not span two songs
+        write_songs_index(output_path, song_names, [len(sequence) for sequence in all_sequences])
         print(f"\nDataset saved to {output_path}")
         print(f"Total sequences: {len(all_sequences)}")
         print(f"Total timesteps: {combined_data.size(0)}")
@@ -118,6 +496,25 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Convert MIDI files to tokenized dataset')
     parser.add_argument('input_dir', help='Directory containing MIDI files')
     parser.add_argument('output_dir', help='Directory to save the processed dataset')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes (1 = convert in this process)')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_FILE_TIMEOUT,
+                        help='Per-file conversion timeout in seconds (0 = no limit)')
+    parser.add_argument('--cache-dir',
+                        help='Ingestion cache directory (default: <output_dir>/.ingest_cache)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Convert every file, ignoring and not updating the cache')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='Retry files whose conversion failed in a previous run')
+    parser.add_argument('--format', choices=['pt', 'shards'], default='pt',
+                        help="Output format: single int64 tensor ('pt') or memory-mapped token shards ('shards')")
+    parser.add_argument('--shard-timesteps', type=int, default=DEFAULT_SHARD_TIMESTEPS,
+                        help='Timesteps per shard with --format shards')
+    parser.add_argument('--no-resume', action='store_true',
+                        help='With --format shards, rebuild an unfinished store from scratch instead of resuming it')
     
     args = parser.parse_args()
-    process_midi_directory(args.input_dir, args.output_dir) 
\ No newline at end of file
+    process_midi_directory(args.input_dir, args.output_dir, args.workers, args.timeout,
+                           cache_dir=args.cache_dir, use_cache=not args.no_cache,
+                           retry_failed=args.retry_failed, output_format=args.format,
+                           shard_timesteps=args.shard_timesteps, resume=not args.no_resume)
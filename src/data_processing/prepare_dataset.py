@@ -1,58 +1,256 @@
+# Standard library imports
+import os
+from pathlib import Path
+
 # Third-party imports
 import numpy as np
 import torch
-from torch.utils.data import Dataset, DataLoader, random_split
+from torch.utils.data import BatchSampler, Dataset, DataLoader, RandomSampler, SequentialSampler
+
+# Local imports
+from src.data_processing.token_store import INDEX_FILE, TokenStore, load_token_dataset, song_boundaries, songs_index_path
 
 class MusicSequenceDataset(Dataset):
-    def __init__(self, data, sequence_length):
+    """Next-timestep prediction windows over a token tensor or a memory-mapped TokenStore.
+    
+    `starts` holds the first timestep of every window (see build_window_starts);
+    by default every window of the corpus, seen as one single stream, is used.
+    """
+    def __init__(self, data, sequence_length, starts=None, stride=1):
         self.data = data
         self.sequence_length = sequence_length
-        self.num_sequences = (len(data) - sequence_length) // 1  # No overlap between sequences
+        if starts is None:
+            starts = build_window_starts(np.zeros(1, dtype=np.int64), np.array([len(data)]),
+                                         sequence_length, stride)
+        self.starts = starts
+    
+    def share_memory(self):
+        """Move the token tensor and window starts to shared memory, so DataLoader workers do not copy them"""
+        if torch.is_tensor(self.data):
+            self.data.share_memory_()
+        self.starts = torch.from_numpy(np.asarray(self.starts, dtype=np.int64)).share_memory_()
+        return self
         
     def __len__(self):
-        return self.num_sequences
+        return len(self.starts)
         
     def __getitem__(self, idx):
-        # Get sequence starting at idx
-        start_idx = idx
+        # Get sequence starting at the idx-th window start
+        start_idx = int(self.starts[idx])
         end_idx = start_idx + self.sequence_length
         
+        if isinstance(self.data, TokenStore):
+            # Read straight from the memory map; only this window is copied (and widened to int64)
+            window = torch.from_numpy(self.data.read(start_idx, end_idx + 1).astype(np.int64))
+            return window[:-1], window[1:]
+        
         sequence = self.data[start_idx:end_idx]
         target = self.data[start_idx+1:end_idx+1]  # Target is next token for each position
         
         return sequence, target
 
-def prepare_dataloaders(dataset_path, sequence_length, batch_size):
+class BatchedWindowDataset(Dataset):
+    """Same windows as MusicSequenceDataset, but indexed by a whole batch of window indices at once.
+    
+    Each token array is viewed as overlapping windows with unfold (no copy),
+    so a batch is one gather over that view instead of batch_size Python
+    __getitem__ calls plus a collate. Use with a BatchSampler and batch_size=None.
+    """
+    def __init__(self, data, sequence_length, starts):
+        self.data = data
+        self.sequence_length = sequence_length
+        self.starts = torch.from_numpy(np.asarray(starts, dtype=np.int64))
+        self._build_views()
+    
+    def _build_views(self):
+        if isinstance(self.data, TokenStore):
+            arrays = [torch.from_numpy(shard) for shard in self.data.shards]  # zero-copy over the memory map
+            self.shard_starts = torch.from_numpy(self.data.shard_starts[:-1].astype(np.int64))
+        else:
+            arrays = [self.data]
+            self.shard_starts = torch.zeros(1, dtype=torch.long)
+        # (num_windows, channels, sequence_length + 1) strided views; windows never span shards
+        self.windows = [array.unfold(0, self.sequence_length + 1, 1) if len(array) > self.sequence_length else None
+                        for array in arrays]
+    
+    def share_memory(self):
+        """Move the token tensor and window starts to shared memory, so DataLoader workers do not copy them"""
+        if torch.is_tensor(self.data):
+            self.data.share_memory_()
+        self.starts.share_memory_()
+        return self
+    
+    def __getstate__(self):
+        # The views are rebuilt in the worker; memory-mapped shards are reopened by path
+        state = self.__dict__.copy()
+        del state['windows'], state['shard_starts']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build_views()
+    
+    def __len__(self):
+        return len(self.starts)
+    
+    def __getitem__(self, indices):
+        starts = self.starts[torch.as_tensor(indices, dtype=torch.long)]
+        if len(self.windows) == 1:
+            batch = self.windows[0][starts]
+        else:
+            shard_of_window = torch.searchsorted(self.shard_starts, starts, right=True) - 1
+            # Shards shorter than a window have no view; any other gives the window shape and dtype
+            view = next(windows for windows in self.windows if windows is not None)
+            batch = torch.empty((len(starts),) + view.shape[1:], dtype=view.dtype)
+            for shard in torch.unique(shard_of_window).tolist():
+                mask = shard_of_window == shard
+                batch[mask] = self.windows[shard][starts[mask] - self.shard_starts[shard]]
+        # (batch, channels, time) -> (batch, time, channels); inputs and targets must be contiguous for .view()
+        batch = batch.transpose(1, 2)
+        return batch[:, :-1].contiguous().long(), batch[:, 1:].contiguous().long()
+
+def build_window_starts(song_starts, song_lengths, sequence_length, stride=1):
+    """Start of every window (input plus one-step-shifted target) that lies inside a single song.
+    
+    stride=1 gives fully overlapping windows; stride=sequence_length gives
+    non-overlapping ones. Returned as uint32 when the corpus allows it.
+    """
+    song_starts = np.asarray(song_starts, dtype=np.int64)
+    song_lengths = np.asarray(song_lengths, dtype=np.int64)
+    # A window needs sequence_length + 1 timesteps
+    counts = np.maximum(0, (song_lengths - sequence_length - 1) // stride + 1)
+    first_window = np.cumsum(counts) - counts
+    song_of_window = np.repeat(np.arange(len(counts)), counts)
+    local_starts = (np.arange(counts.sum()) - first_window[song_of_window]) * stride
+    starts = song_starts[song_of_window] + local_starts
+    
+    end = int(song_starts[-1] + song_lengths[-1]) if len(song_starts) else 0
+    return starts.astype(np.uint32 if end < 2 ** 32 else np.int64)
+
+def window_index_path(dataset_path, sequence_length, stride):
+    """Where the window index of a dataset is cached (next to the dataset)"""
+    name = f"windows_L{sequence_length}_S{stride}.npy"
+    dataset_path = Path(dataset_path)
+    if dataset_path.name == INDEX_FILE:
+        dataset_path = dataset_path.parent
+    if dataset_path.is_dir():
+        return dataset_path / name
+    return dataset_path.with_name(f"{dataset_path.stem}.{name}")
+
+def load_window_index(dataset_path, data, sequence_length, stride=1):
+    """Window starts for a dataset, from the cache next to it if up to date"""
+    index_path = window_index_path(dataset_path, sequence_length, stride)
+    if isinstance(data, TokenStore):
+        sources = [data.path / INDEX_FILE]
+    else:
+        sources = [Path(dataset_path), songs_index_path(dataset_path)]
+    newest_source = max(os.path.getmtime(path) for path in sources if path.exists())
+    if index_path.exists() and os.path.getmtime(index_path) >= newest_source:
+        return np.load(index_path, mmap_mode='r')
+    
+    starts = build_window_starts(*song_boundaries(dataset_path, data), sequence_length, stride)
+    try:
+        np.save(index_path, starts)
+    except OSError as e:
+        print(f"Could not cache window index at {index_path}: {e}")
+    return starts
+
+def split_windows(starts, song_starts, val_fraction=0.1, split='window', seed=0):
+    """Split window starts into train and validation sets.
+    
+    split='song' holds out whole songs, so no validation window overlaps a
+    training one; split='window' holds out random windows.
+    """
+    rng = np.random.default_rng(seed)
+    if split == 'song' and len(song_starts) < 2:
+        print("Song boundaries unknown: splitting by window instead of by song")
+        split = 'window'
+    
+    if split == 'song':
+        song_of_window = np.searchsorted(song_starts, starts, side='right') - 1
+        num_val_songs = max(1, int(round(val_fraction * len(song_starts))))
+        val_songs = rng.permutation(len(song_starts))[:num_val_songs]
+        is_val = np.isin(song_of_window, val_songs)
+    else:
+        train_size = int((1 - val_fraction) * len(starts))
+        is_val = np.zeros(len(starts), dtype=bool)
+        is_val[rng.permutation(len(starts))[train_size:]] = True
+    return starts[~is_val], starts[is_val]
+
+def prepare_dataloaders(dataset_path, sequence_length, batch_size, stride=1, split='window',
+                        val_fraction=0.1, samples_per_epoch=None, seed=0, gather='batch',
+                        num_workers=0, pin_memory=False, persistent_workers=True, prefetch_factor=2):
     """
     Prepare train and validation dataloaders.
+    
+    Windows never cross song boundaries (when the dataset records them) and
+    start every `stride` timesteps. `samples_per_epoch` caps (or extends)
+    the number of training windows drawn per epoch. gather='batch' builds
+    each batch with one vectorized gather (BatchedWindowDataset); 'item'
+    uses per-window __getitem__ and the default collate.
+    
+    With num_workers > 0 batches are produced by worker processes; token
+    tensors are placed in shared memory (memory-mapped shards are shared by
+    the OS page cache) so workers do not each hold a copy of the corpus.
+    pin_memory speeds up non_blocking host-to-GPU copies.
     """
     print(f"Loading dataset from {dataset_path}")
-    data = torch.load(dataset_path)
+    data = load_token_dataset(dataset_path)
     print(f"Dataset size: {len(data)} timesteps")
     
-    # Create dataset
-    dataset = MusicSequenceDataset(data, sequence_length)
+    # Create datasets from the window index
+    starts = load_window_index(dataset_path, data, sequence_length, stride)
+    song_starts, _ = song_boundaries(dataset_path, data)
+    train_starts, val_starts = split_windows(starts, song_starts, val_fraction, split, seed)
+    print(f"Windows: {len(starts)} from {len(song_starts)} songs (stride {stride}, split by {split})")
     
-    # Split into train and validation (90/10)
-    train_size = int(0.9 * len(dataset))
-    val_size = len(dataset) - train_size
+    loader_options = {'num_workers': num_workers, 'pin_memory': pin_memory}
+    if num_workers > 0:
+        loader_options['persistent_workers'] = persistent_workers
+        loader_options['prefetch_factor'] = prefetch_factor
     
-    train_dataset, val_dataset = random_split(dataset, [train_size, val_size])
+    if gather == 'batch':
+        train_dataset = BatchedWindowDataset(data, sequence_length, train_starts)
+        val_dataset = BatchedWindowDataset(data, sequence_length, val_starts)
+    else:
+        train_dataset = MusicSequenceDataset(data, sequence_length, train_starts)
+        val_dataset = MusicSequenceDataset(data, sequence_length, val_starts)
     
-    # Create dataloaders
-    train_loader = DataLoader(
-        train_dataset,
-        batch_size=batch_size,
-        shuffle=True,
-        num_workers=0
-    )
+    if num_workers > 0:
+        train_dataset.share_memory()
+        val_dataset.share_memory()
     
-    val_loader = DataLoader(
-        val_dataset,
-        batch_size=batch_size,
-        shuffle=False,
-        num_workers=0
-    )
+    if gather == 'batch':
+        # The samplers yield lists of indices; automatic batching is disabled
+        train_loader = DataLoader(
+            train_dataset,
+            sampler=BatchSampler(RandomSampler(train_dataset, num_samples=samples_per_epoch),
+                                 batch_size, drop_last=False),
+            batch_size=None,
+            **loader_options
+        )
+        
+        val_loader = DataLoader(
+            val_dataset,
+            sampler=BatchSampler(SequentialSampler(val_dataset), batch_size, drop_last=False),
+            batch_size=None,
+            **loader_options
+        )
+    else:
+        # Create dataloaders
+        train_loader = DataLoader(
+            train_dataset,
+            batch_size=batch_size,
+            sampler=RandomSampler(train_dataset, num_samples=samples_per_epoch),
+            **loader_options
+        )
+        
+        val_loader = DataLoader(
+            val_dataset,
+            batch_size=batch_size,
+            shuffle=False,
+            **loader_options
+        )
     
     print(f"Created dataloaders with sequence length {sequence_length} and batch size {batch_size}")
     print(f"Training batches: {len(train_loader)}, Validation batches: {len(val_loader)}")
@@ -64,11 +262,21 @@ if __name__ == "__main__":
     
     parser = argparse.ArgumentParser(description='Prepara il dataset per il training')
     parser.add_argument('--dataset', default='output/music_dataset.pt',
-                      help='Percorso del dataset PyTorch')
+                      help='Percorso del dataset (file .pt o directory di shard)')
     parser.add_argument('--sequence-length', type=int, default=32,
                       help='Lunghezza delle sequenze per il training')
     parser.add_argument('--batch-size', type=int, default=32,
                       help='Dimensione del batch')
+    parser.add_argument('--window-stride', type=int, default=1,
+                      help='Passo tra finestre consecutive (= sequence-length per finestre senza sovrapposizione)')
+    parser.add_argument('--split', choices=['window', 'song'], default='window',
+                      help='Separa train/validazione per finestra o per brano')
+    parser.add_argument('--samples-per-epoch', type=int,
+                      help='Numero di finestre di training per epoca (default: tutte)')
+    parser.add_argument('--gather', choices=['batch', 'item'], default='batch',
+                      help='Costruisce ogni batch con un unico gather vettoriale o finestra per finestra')
+    parser.add_argument('--num-workers', type=int, default=0,
+                      help='Processi worker del DataLoader')
     
     args = parser.parse_args()
     
@@ -76,7 +284,12 @@ if __name__ == "__main__":
     train_loader, val_loader = prepare_dataloaders(
         args.dataset,
         sequence_length=args.sequence_length,
-        batch_size=args.batch_size
+        batch_size=args.batch_size,
+        stride=args.window_stride,
+        split=args.split,
+        samples_per_epoch=args.samples_per_epoch,
+        gather=args.gather,
+        num_workers=args.num_workers
     )
     
     # Stampa informazioni sui loader
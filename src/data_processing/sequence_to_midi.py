@@ -1,4 +1,5 @@
 import argparse
+import io
 from pathlib import Path
 import midiutil
 
@@ -44,19 +45,14 @@ def note_to_midi_number(note):
     
     return midi_number
 
-def sequence_to_midi(input_file, output_file, tempo=120):
+def notes_to_midi(sequence, tempo=120):
     """
-    Converte una sequenza di note in un file MIDI.
+    Crea un file MIDI (midiutil.MIDIFile) da una sequenza di note.
     
     Args:
-        input_file: File di testo con le note (una riga per timestep, note separate da virgole)
-        output_file: Dove salvare il file MIDI
+        sequence: Lista di timestep, ognuno una lista di note (una per canale)
         tempo: Tempo in BPM
     """
-    # Leggi la sequenza
-    with open(input_file, 'r') as f:
-        sequence = [line.strip().split(',') for line in f]
-    
     # Crea il file MIDI
     midi = midiutil.MIDIFile(4)  # 4 tracce, una per canale
     
@@ -72,9 +68,30 @@ def sequence_to_midi(input_file, output_file, tempo=120):
                 # Aggiungi la nota (track, pitch, time, duration, volume)
                 midi.addNote(track, 0, midi_number, time, 1, 100)
     
+    return midi
+
+def notes_to_midi_bytes(sequence, tempo=120):
+    """Contenuto (bytes) del file MIDI di una sequenza di note"""
+    buffer = io.BytesIO()
+    notes_to_midi(sequence, tempo).writeFile(buffer)
+    return buffer.getvalue()
+
+def sequence_to_midi(input_file, output_file, tempo=120):
+    """
+    Converte una sequenza di note in un file MIDI.
+    
+    Args:
+        input_file: File di testo con le note (una riga per timestep, note separate da virgole)
+        output_file: Dove salvare il file MIDI
+        tempo: Tempo in BPM
+    """
+    # Leggi la sequenza
+    with open(input_file, 'r') as f:
+        sequence = [line.strip().split(',') for line in f]
+    
     # Salva il file MIDI
     with open(output_file, 'wb') as f:
-        midi.writeFile(f)
+        notes_to_midi(sequence, tempo).writeFile(f)
 
 def main(args):
     # Assicurati che la directory di output esista
@@ -0,0 +1,253 @@
+# Standard library imports
+import json
+import os
+from pathlib import Path
+
+# Third-party imports
+import numpy as np
+import torch
+
+INDEX_FILE = 'index.json'
+STORE_VERSION = 1
+DEFAULT_SHARD_TIMESTEPS = 1 << 22  # 4M timesteps = 16 MB per shard with 4 uint8 channels
+
+def token_dtype(vocab_size):
+    """Smallest unsigned dtype that can hold every token id"""
+    return np.uint8 if vocab_size <= 256 else np.uint16
+
+def is_token_store(path):
+    """True if path is a sharded token store (its directory or its index.json)"""
+    path = Path(path)
+    return (path / INDEX_FILE).is_file() or (path.name == INDEX_FILE and path.is_file())
+
+class ShardWriter:
+    """Streams songs into a sharded token store.
+
+    Layout of the store directory:
+        index.json          dtype, channels, shard list and per-song offsets/names
+        shard_00000.bin     raw (timesteps, channels) token array
+
+    Songs are written to the current shard file as soon as they are added
+    (nothing is buffered in memory) and never split across shards; a new
+    shard is started once `shard_timesteps` is reached. Every completed
+    shard is committed to the index, so with resume=True an interrupted
+    ingest restarts from the last completed shard instead of from scratch.
+    close() commits the last shard and marks the store complete.
+    """
+    def __init__(self, path, channels=4, dtype=np.uint8, shard_timesteps=DEFAULT_SHARD_TIMESTEPS,
+                 vocab_hash=None, resume=False):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.channels = channels
+        self.dtype = np.dtype(dtype)
+        self.shard_timesteps = shard_timesteps
+        self.vocab_hash = vocab_hash
+        self.shards = []
+        self.songs = []
+        self._file = None
+        self.resumed = resume and self._load_committed()
+        self._remove_stale_files()
+
+    def _load_committed(self):
+        """Load the committed part of an unfinished store with the same layout"""
+        index_path = self.path / INDEX_FILE
+        if not index_path.is_file():
+            return False
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('complete', True) or index.get('version') != STORE_VERSION or \
+                (index['dtype'], index['channels'], index.get('vocab_hash')) != \
+                (self.dtype.name, self.channels, self.vocab_hash):
+            return False
+        self.shards = index['shards']
+        self.songs = index['songs']
+        return True
+
+    def _remove_stale_files(self):
+        """Delete shards that are not part of the committed index (e.g. a half-written one)"""
+        keep = {shard['file'] for shard in self.shards}
+        for shard_path in self.path.glob('shard_*.bin'):
+            if shard_path.name not in keep:
+                shard_path.unlink()
+        if not self.resumed and (self.path / INDEX_FILE).exists():
+            (self.path / INDEX_FILE).unlink()
+
+    def committed_hashes(self):
+        """Content hash -> song name of every song already in the store"""
+        return {song['hash']: song['name'] for song in self.songs if song.get('hash')}
+
+    def _start_shard(self):
+        self._close_shard()
+        name = f"shard_{len(self.shards):05d}.bin"
+        self.shards.append({'file': name, 'timesteps': 0})
+        self._file = open(self.path / name, 'wb')
+
+    def _close_shard(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+            self._write_index(complete=False)
+
+    def add_song(self, name, tokens, content_hash=None):
+        """Append one song's (timesteps, channels) token array"""
+        tokens = tokens.numpy() if torch.is_tensor(tokens) else np.asarray(tokens)
+        if tokens.size == 0:
+            return
+        if tokens.ndim != 2 or tokens.shape[1] != self.channels:
+            raise ValueError(f"Expected a (timesteps, {self.channels}) array, got shape {tokens.shape}")
+        if tokens.min() < 0 or tokens.max() > np.iinfo(self.dtype).max:
+            raise ValueError(f"Token ids of {name} do not fit in {self.dtype}")
+
+        if self._file is None or (self.shards[-1]['timesteps'] > 0 and
+                                  self.shards[-1]['timesteps'] + len(tokens) > self.shard_timesteps):
+            self._start_shard()
+        shard = self.shards[-1]
+        self._file.write(np.ascontiguousarray(tokens, dtype=self.dtype).tobytes())
+        self.songs.append({
+            'name': str(name),
+            'shard': len(self.shards) - 1,
+            'offset': shard['timesteps'],
+            'length': len(tokens),
+            'hash': content_hash,
+        })
+        shard['timesteps'] += len(tokens)
+
+    def _write_index(self, complete):
+        # While a shard is open, only the shards and songs before it are committed
+        num_shards = len(self.shards) - (self._file is not None)
+        index = {
+            'version': STORE_VERSION,
+            'complete': complete,
+            'dtype': self.dtype.name,
+            'channels': self.channels,
+            'vocab_hash': self.vocab_hash,
+            'shards': self.shards[:num_shards],
+            'songs': [song for song in self.songs if song['shard'] < num_shards],
+        }
+        tmp_path = self.path / (INDEX_FILE + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.path / INDEX_FILE)
+
+    def close(self):
+        self._close_shard()
+        self._write_index(complete=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Leave the store resumable: keep committed shards, drop the open one on next start
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+class TokenStore:
+    """Read-only, memory-mapped view of a sharded token store (see ShardWriter).
+
+    Opening a store only parses the index; token data is paged in by the OS
+    on access, so startup time and resident memory do not grow with the corpus.
+    Timesteps are addressed globally, as if all shards were concatenated.
+    """
+    def __init__(self, path):
+        path = Path(path)
+        self.path = path.parent if path.name == INDEX_FILE else path
+        with open(self.path / INDEX_FILE, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('version') != STORE_VERSION:
+            raise ValueError(f"Unsupported token store version in {self.path}: {index.get('version')}")
+        self.dtype = np.dtype(index['dtype'])
+        self.channels = index['channels']
+        self.vocab_hash = index.get('vocab_hash')
+        self.complete = index.get('complete', True)
+        if not self.complete:
+            print(f"Warning: {self.path} is an unfinished token store; using its committed shards only")
+        self.songs = index['songs']
+        # Copy-on-write mapping: views are writable (as torch.from_numpy wants) but the files are never modified
+        self.shards = [
+            np.memmap(self.path / shard['file'], dtype=self.dtype, mode='c',
+                      shape=(shard['timesteps'], self.channels))
+            for shard in index['shards']
+        ]
+        self.shard_starts = np.cumsum([0] + [len(shard) for shard in self.shards])
+
+    def __getstate__(self):
+        # Pickle by path (e.g. for DataLoader workers): reopening maps the same files instead of copying them
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def __len__(self):
+        return int(self.shard_starts[-1])
+
+    @property
+    def shape(self):
+        return (len(self), self.channels)
+
+    def __iter__(self):
+        """Iterate over timesteps (rows of `channels` token ids)"""
+        for shard in self.shards:
+            yield from shard
+
+    def song(self, i):
+        """Token array of the i-th song (a view into its shard)"""
+        song = self.songs[i]
+        return self.shards[song['shard']][song['offset']:song['offset'] + song['length']]
+
+    def song_starts(self):
+        """Global timestep offset of every song"""
+        return np.array([self.shard_starts[song['shard']] + song['offset'] for song in self.songs],
+                        dtype=np.int64)
+
+    def read(self, start, stop):
+        """Timesteps [start, stop) as a numpy array; a view unless the range spans shards"""
+        shard = int(np.searchsorted(self.shard_starts, start, side='right')) - 1
+        local = start - int(self.shard_starts[shard])
+        if stop <= self.shard_starts[shard + 1]:
+            return self.shards[shard][local:local + (stop - start)]
+        parts = []
+        while start < stop:
+            shard_start, shard_end = int(self.shard_starts[shard]), int(self.shard_starts[shard + 1])
+            end = min(stop, shard_end)
+            parts.append(self.shards[shard][start - shard_start:end - shard_start])
+            start, shard = end, shard + 1
+        return np.concatenate(parts)
+
+    def to_tensor(self):
+        """Whole corpus as one int64 tensor (copies everything into memory)"""
+        return torch.from_numpy(np.concatenate(self.shards).astype(np.int64))
+
+def songs_index_path(dataset_path):
+    """Side file listing the songs of a legacy .pt dataset (music_dataset.songs.json)"""
+    return Path(dataset_path).with_suffix('.songs.json')
+
+def write_songs_index(dataset_path, names, lengths):
+    with open(songs_index_path(dataset_path), 'w', encoding='utf-8') as f:
+        json.dump({'songs': [{'name': str(name), 'length': int(length)}
+                             for name, length in zip(names, lengths)]}, f)
+
+def song_boundaries(dataset_path, data):
+    """(starts, lengths) arrays of the songs in a dataset; one single song if boundaries are unknown"""
+    if isinstance(data, TokenStore):
+        lengths = np.array([song['length'] for song in data.songs], dtype=np.int64)
+        return data.song_starts(), lengths
+    side_path = songs_index_path(dataset_path)
+    if side_path.is_file():
+        with open(side_path, 'r', encoding='utf-8') as f:
+            lengths = np.array([song['length'] for song in json.load(f)['songs']], dtype=np.int64)
+        if lengths.sum() == len(data):
+            return np.cumsum(lengths) - lengths, lengths
+        print(f"Ignoring {side_path}: song lengths do not match the dataset")
+    return np.zeros(1, dtype=np.int64), np.array([len(data)], dtype=np.int64)
+
+def load_token_dataset(path):
+    """Open a dataset: a TokenStore for sharded stores, else the legacy torch.save'd tensor"""
+    if is_token_store(path):
+        return TokenStore(path)
+    return torch.load(path)
@@ -0,0 +1,13 @@
+"""Generation package initialization.
+
+This package contains the generation engines for the trained models.
+"""
+
+from .batched import generate_batch, stream_batch
+from .beam import Constraint, KeyConstraint, NoVoiceCrossing, VoiceRange, beam_search
+from .incremental import IncrementalGenerator
+from .sampling import Sampler, channel_mask
+from .seeds import load_seeds
+
+__all__ = ['Constraint', 'IncrementalGenerator', 'KeyConstraint', 'NoVoiceCrossing', 'Sampler', 'VoiceRange',
+           'beam_search', 'channel_mask', 'generate_batch', 'load_seeds', 'stream_batch']
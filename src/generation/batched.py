@@ -0,0 +1,45 @@
+# Third-party imports
+import torch
+
+# Local imports
+from .incremental import IncrementalGenerator, collect
+from .sampling import Sampler
+
+@torch.no_grad()
+def stream_batch(model, seed_sequence, num_steps, temperature=0.8, sequence_length=32, num_samples=1, sampler=None):
+    """
+    Generate many sequences in parallel, yielding each new (batch, channels) timestep as soon as it is sampled.
+
+    seed_sequence is a (num_seeds, time, channels) tensor; every seed is continued
+    num_samples times (the samples of a seed are adjacent rows). Each step is one
+    forward pass over the whole batch and one `sampler` call over all sequences and
+    channels (default: plain sampling at `temperature`). Bidirectional models see
+    the last `sequence_length` steps; causal models are run incrementally from
+    their LSTM state (see IncrementalGenerator). Only that recent context is kept,
+    so memory does not grow with num_steps.
+    """
+    model.eval()
+    if sampler is None:
+        sampler = Sampler(temperature=temperature)
+    seeds = seed_sequence.repeat_interleave(num_samples, dim=0) if num_samples > 1 else seed_sequence
+    if not getattr(model, 'bidirectional', True):
+        yield from IncrementalGenerator(model).stream(seeds, num_steps, sampler=sampler)
+        return
+
+    history_length = max(sequence_length, sampler.repetition_window)
+    history = seeds[:, -history_length:]
+    for _ in range(num_steps):
+        logits = model(history[:, -sequence_length:])[:, -1]
+        tokens = sampler(logits, history)
+        yield tokens
+        history = torch.cat([history, tokens.unsqueeze(1)], dim=1)[:, -history_length:]
+
+def generate_batch(model, seed_sequence, num_steps, temperature=0.8, sequence_length=32, num_samples=1,
+                   show_progress=False, sampler=None):
+    """
+    Like stream_batch(), but returns the whole (num_seeds * num_samples, time + num_steps, channels) tensor.
+    """
+    seeds = seed_sequence.repeat_interleave(num_samples, dim=0) if num_samples > 1 else seed_sequence
+    steps = stream_batch(model, seeds, num_steps, temperature=temperature, sequence_length=sequence_length,
+                         sampler=sampler)
+    return collect(seeds, steps, num_steps, show_progress)
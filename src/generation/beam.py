@@ -0,0 +1,183 @@
+# Third-party imports
+import torch
+import torch.nn.functional as F
+
+# Local imports
+from src.model.tokenizer import note_to_pitch
+from .sampling import channel_mask
+
+SCALES = {
+    'major': (0, 2, 4, 5, 7, 9, 11),
+    'minor': (0, 2, 3, 5, 7, 8, 10),  # natural minor
+}
+
+class Constraint:
+    """
+    A decoding constraint, applied as logit masks.
+
+    token_mask() restricts each channel on its own: a (channels, vocab) boolean
+    tensor of allowed tokens, or None. transition_mask(channel) couples a channel
+    with the one below it in the same timestep: a (vocab, vocab) boolean tensor
+    whose [a, b] entry allows token b in `channel` when `channel - 1` holds token a,
+    or None.
+    """
+    def token_mask(self, tokenizer, channels):
+        return None
+
+    def transition_mask(self, tokenizer, channel):
+        return None
+
+class VoiceRange(Constraint):
+    """Every channel stays within an inclusive (lowest, highest) pitch range (see channel_mask); rests optional"""
+    def __init__(self, pitch_ranges=None, allow_rest=True):
+        self.pitch_ranges = pitch_ranges
+        self.allow_rest = allow_rest
+
+    def token_mask(self, tokenizer, channels):
+        return channel_mask(tokenizer, channels, allow_rest=self.allow_rest, pitch_ranges=self.pitch_ranges)
+
+class KeyConstraint(Constraint):
+    """Only notes of a key (e.g. 'D', 'minor'); rests are allowed"""
+    def __init__(self, tonic, mode='major'):
+        if mode not in SCALES:
+            raise ValueError(f"Unknown mode: {mode} (expected one of {', '.join(SCALES)})")
+        try:
+            # note_to_pitch takes the vocabulary format, accidental after the octave ('B0b')
+            self.tonic = note_to_pitch(tonic[0].upper() + '4' + tonic[1:]) % 12
+        except (KeyError, ValueError, IndexError):
+            raise ValueError(f"Unknown tonic: {tonic} (e.g. C, F#, Bb)")
+        self.mode = mode
+
+    def token_mask(self, tokenizer, channels):
+        pitches = torch.tensor(tokenizer.pitch_table())
+        in_key = torch.zeros(12, dtype=torch.bool)
+        in_key[[(self.tonic + step) % 12 for step in SCALES[self.mode]]] = True
+        allowed = (pitches < 0) | in_key[pitches % 12]
+        return allowed.expand(channels, -1)
+
+class NoVoiceCrossing(Constraint):
+    """
+    Voices keep the converter's layout: channel 0 holds the lowest note and each
+    channel is strictly higher than the one below; rests only fill the upper channels.
+    """
+    def transition_mask(self, tokenizer, channel):
+        pitches = torch.tensor(tokenizer.pitch_table())
+        below_rest = (pitches < 0)[:, None]
+        rest = (pitches < 0)[None, :]
+        higher = pitches[None, :] > pitches[:, None]
+        return torch.where(below_rest, rest, rest | higher)
+
+def combined_token_mask(constraints, tokenizer, channels):
+    """AND of the token masks of all constraints, or None if none restricts single tokens"""
+    masks = [mask for mask in (c.token_mask(tokenizer, channels) for c in constraints) if mask is not None]
+    if not masks:
+        return None
+    mask = masks[0].clone()
+    for other in masks[1:]:
+        mask &= other
+    return mask
+
+def combined_transition_masks(constraints, tokenizer, channels):
+    """Per channel, AND of the transition masks of all constraints (None where there is none)"""
+    transitions = [None]
+    for channel in range(1, channels):
+        masks = [mask for mask in (c.transition_mask(tokenizer, channel) for c in constraints) if mask is not None]
+        mask = None
+        if masks:
+            mask = masks[0].clone()
+            for other in masks[1:]:
+                mask &= other
+        transitions.append(mask)
+    return transitions
+
+def _expand_beams(scores, log_probs, transitions, beam_width):
+    """
+    Best beam_width joint (all channels) extensions over all beams of each sequence.
+
+    Given the context, the model scores channels independently, so within a beam
+    the log-probability of a timestep is a sum over channels: adding channels one
+    at a time and keeping the best beam_width partial timesteps finds the beam's
+    best beam_width timesteps exactly (transition masks are applied to these
+    partial candidates). The best of all beams' candidates survive.
+    """
+    batch_size, num_beams, channels, vocab = log_probs.shape
+    partial_scores, index = log_probs[:, :, 0].topk(beam_width, dim=-1)
+    tokens = index.unsqueeze(-1)  # (batch, beams, candidates, channels so far)
+    for channel in range(1, channels):
+        candidates = partial_scores[..., None] + log_probs[:, :, channel, None, :]
+        if transitions[channel] is not None:
+            candidates = candidates.masked_fill(~transitions[channel][tokens[..., -1]], float('-inf'))
+        partial_scores, index = candidates.view(batch_size, num_beams, -1).topk(beam_width, dim=-1)
+        parent = index // vocab
+        tokens = torch.cat([tokens.gather(2, parent[..., None].expand(-1, -1, -1, channel)),
+                            (index % vocab).unsqueeze(-1)], dim=-1)
+
+    totals = (scores[:, :, None] + partial_scores).view(batch_size, -1)
+    new_scores, index = totals.topk(beam_width, dim=-1)
+    origin = index // beam_width
+    tokens = tokens.view(batch_size, -1, channels).gather(1, index[..., None].expand(-1, -1, channels))
+    return origin, tokens, new_scores
+
+@torch.no_grad()
+def beam_search(model, seed_sequence, num_steps, tokenizer, beam_width=8, constraints=(), sequence_length=32):
+    """
+    Beam search over whole timesteps (all channels jointly) for every sequence of a batch.
+
+    All beams of all sequences go through the model together: one forward pass of
+    batch * beam_width rows per step (causal models are fed only the new timestep,
+    from their LSTM state). Constraints are applied as logit masks.
+    Returns (sequences, scores): (batch, beam_width, seed + num_steps, channels)
+    tokens with the beams of each sequence sorted best first, and their total
+    log-probabilities.
+    """
+    model.eval()
+    batch_size, seed_length, channels = seed_sequence.shape
+    device = seed_sequence.device
+    token_mask = combined_token_mask(constraints, tokenizer, channels)
+    token_mask = token_mask.to(device) if token_mask is not None else None
+    transitions = [mask.to(device) if mask is not None else None
+                   for mask in combined_transition_masks(constraints, tokenizer, channels)]
+
+    rows = seed_sequence.repeat_interleave(beam_width, dim=0)
+    # All beams start from the same seed: only the first one may be expanded at the first step
+    scores = torch.full((batch_size, beam_width), float('-inf'), device=device)
+    scores[:, 0] = 0
+    row_offsets = torch.arange(batch_size, device=device)[:, None] * beam_width
+    causal = not getattr(model, 'bidirectional', True)
+    if causal:
+        logits, state = model.step(rows, None)
+        logits = logits[:, -1]
+    else:
+        history = rows[:, -sequence_length:]
+
+    backpointers, step_tokens = [], []
+    for step in range(num_steps):
+        if not causal:
+            logits = model(history)[:, -1]
+        log_probs = F.log_softmax(logits.float(), dim=-1).view(batch_size, beam_width, channels, -1)
+        if token_mask is not None:
+            log_probs = log_probs.masked_fill(~token_mask, float('-inf'))
+        origin, tokens, scores = _expand_beams(scores, log_probs, transitions, beam_width)
+        backpointers.append(origin)
+        step_tokens.append(tokens)
+        if step + 1 == num_steps:
+            break
+        # Reorder the model context to follow the surviving beams, then append their new timestep
+        source_rows = (row_offsets + origin).view(-1)
+        new_step = tokens.view(batch_size * beam_width, 1, channels)
+        if causal:
+            state = tuple(s[:, source_rows] for s in state)
+            logits, state = model.step(new_step, state)
+            logits = logits[:, -1]
+        else:
+            history = torch.cat([history[source_rows], new_step], dim=1)[:, -sequence_length:]
+
+    # Follow the backpointers from the final beams to rebuild their sequences
+    sequences = torch.empty((batch_size, beam_width, seed_length + num_steps, channels),
+                            dtype=seed_sequence.dtype, device=device)
+    sequences[:, :, :seed_length] = seed_sequence[:, None]
+    beam = torch.arange(beam_width, device=device).expand(batch_size, -1)
+    for step in reversed(range(num_steps)):
+        sequences[:, :, seed_length + step] = step_tokens[step].gather(1, beam[..., None].expand(-1, -1, channels))
+        beam = backpointers[step].gather(1, beam)
+    return sequences, scores
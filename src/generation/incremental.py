@@ -0,0 +1,67 @@
+# Third-party imports
+import torch
+
+# Local imports
+from .sampling import Sampler
+
+class IncrementalGenerator:
+    """
+    Stateful generation with a causal EfficientHarmonicMusicNet (bidirectional=False).
+
+    The seed is run through the model once; after that only the newly sampled
+    timestep is fed, continuing from the LSTM (h, c) state. The cost of a step
+    is therefore constant, however long the piece already is, and the whole
+    history conditions every step (no sliding window).
+    """
+    def __init__(self, model):
+        if getattr(model, 'bidirectional', False):
+            raise ValueError("Incremental generation needs a causal model (bidirectional=False)")
+        self.model = model.eval()
+        self.state = None
+
+    def reset(self):
+        self.state = None
+
+    @torch.no_grad()
+    def feed(self, tokens):
+        """Advance the state over (batch, time, channels) tokens; returns the (batch, channels, vocab) next-step logits"""
+        logits, self.state = self.model.step(tokens, self.state)
+        return logits[:, -1]
+
+    @torch.no_grad()
+    def stream(self, seed_sequence, num_steps, temperature=0.8, sampler=None):
+        """Continue seed_sequence (batch, time, channels) by num_steps timesteps drawn by `sampler`
+        (default: plain sampling at `temperature`), yielding each (batch, channels) timestep as soon
+        as it is sampled. Only the LSTM state and the sampler's recent history are kept."""
+        if sampler is None:
+            sampler = Sampler(temperature=temperature)
+        self.reset()
+        history = seed_sequence[:, -sampler.repetition_window:]
+        logits = self.feed(seed_sequence)
+        for step in range(num_steps):
+            tokens = sampler(logits, history)
+            yield tokens
+            if step + 1 < num_steps:
+                new_step = tokens.unsqueeze(1)
+                history = torch.cat([history, new_step], dim=1)[:, -sampler.repetition_window:]
+                logits = self.feed(new_step)
+
+    def generate(self, seed_sequence, num_steps, temperature=0.8, show_progress=False, sampler=None):
+        """Like stream(), but returns the whole (batch, seed + num_steps, channels) sequence"""
+        return collect(seed_sequence, self.stream(seed_sequence, num_steps, temperature, sampler), num_steps,
+                       show_progress)
+
+def collect(seed_sequence, steps, num_steps, show_progress=False):
+    """Gather the timesteps yielded by a stream after seed_sequence into one tensor"""
+    batch_size, seed_length, channels = seed_sequence.shape
+    sequence = torch.empty((batch_size, seed_length + num_steps, channels),
+                           dtype=seed_sequence.dtype, device=seed_sequence.device)
+    sequence[:, :seed_length] = seed_sequence
+    for step, tokens in enumerate(steps):
+        if show_progress:
+            print(f'Generating step {step + 1}/{num_steps}', end='\r')
+        sequence[:, seed_length + step] = tokens
+    
+    if show_progress:
+        print('\nGeneration completed!')
+    return sequence
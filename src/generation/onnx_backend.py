@@ -0,0 +1,55 @@
+# Standard library imports
+import json
+
+# Third-party imports
+import numpy as np
+import torch
+
+class OnnxModel:
+    """
+    A model exported by export_efficient.py onnx, run by onnxruntime on CPU.
+
+    It has the interface the generation code uses from EfficientHarmonicMusicNet: calling
+    it returns the logits and step() runs a causal model from its LSTM state, with torch
+    tensors in and out, so sampling, beam search and the server work unchanged. Sizes and
+    direction are read from the graph's inputs and outputs; `metadata` holds what the
+    checkpoint recorded about training (see checkpoint_metadata), when the export stored it.
+    """
+    def __init__(self, path, threads=None):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("onnxruntime is needed to run ONNX models: pip install onnxruntime") from None
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        inputs = {graph_input.name: graph_input for graph_input in self.session.get_inputs()}
+        self.num_channels, self.num_notes = self.session.get_outputs()[0].shape[2:]
+        self.bidirectional = 'h' not in inputs
+        if not self.bidirectional:
+            self.num_layers, _, self.hidden_size = inputs['h'].shape
+        properties = self.session.get_modelmeta().custom_metadata_map
+        self.metadata = {key: json.loads(value) for key, value in properties.items()}
+        self.metadata.setdefault('vocab_size', self.num_notes)
+
+    def eval(self):
+        return self
+
+    def __call__(self, x):
+        logits, _ = self.step(x, None)
+        return logits
+
+    def step(self, x, state=None):
+        if x.dim() == 2:
+            x = x.unsqueeze(0)
+        feeds = {'tokens': np.ascontiguousarray(x.cpu().numpy())}
+        if self.bidirectional:
+            return torch.from_numpy(self.session.run(None, feeds)[0]), None
+        if state is None:
+            state = [np.zeros((self.num_layers, x.shape[0], self.hidden_size), dtype=np.float32)] * 2
+        else:
+            state = [np.ascontiguousarray(s.cpu().numpy()) for s in state]
+        feeds['h'], feeds['c'] = state
+        logits, h, c = self.session.run(None, feeds)
+        return torch.from_numpy(logits), (torch.from_numpy(h), torch.from_numpy(c))
@@ -0,0 +1,100 @@
+# Third-party imports
+import torch
+import torch.nn.functional as F
+
+# Local imports
+from src.model.tokenizer import note_to_pitch
+
+def channel_mask(tokenizer, num_channels=4, allow_rest=True, pitch_ranges=None):
+    """
+    (num_channels, vocab) boolean mask of the tokens each channel may produce.
+
+    allow_rest=False forbids the rest token 'O'. pitch_ranges limits the notes of
+    each channel to an inclusive (lowest, highest) range of MIDI numbers or note
+    names; a single range applies to every channel, None leaves a channel free.
+    """
+    pitches = torch.tensor(tokenizer.pitch_table())
+    rest_id = tokenizer.note_to_id['O']
+    if pitch_ranges is None or (len(pitch_ranges) == 2 and not isinstance(pitch_ranges[0], (tuple, list))):
+        pitch_ranges = [pitch_ranges] * num_channels
+
+    mask = torch.ones((num_channels, len(pitches)), dtype=torch.bool)
+    for channel, pitch_range in enumerate(pitch_ranges):
+        if pitch_range is not None:
+            lowest, highest = [note_to_pitch(p) if isinstance(p, str) else p for p in pitch_range]
+            mask[channel] = (pitches >= lowest) & (pitches <= highest)
+        mask[channel, rest_id] = allow_rest
+    return mask
+
+class Sampler:
+    """
+    Batched sampling of the next timestep from (batch, channels, vocab) logits.
+
+    Every option is applied to all sequences and channels at once:
+    - mask:               (channels, vocab) or (vocab,) boolean tensor of allowed tokens (see channel_mask)
+    - repetition_penalty: logits of tokens played by the same channel in the last
+                          `repetition_window` steps are divided by it (multiplied if negative)
+    - temperature:        0 = greedy (argmax)
+    - top_k:              keep only the k most likely tokens (0 = off)
+    - top_p:              keep the smallest set of tokens with total probability >= top_p (1.0 = off)
+    followed by one multinomial draw. `seed` makes the draws reproducible with a
+    dedicated torch.Generator, independent of the global RNG.
+    """
+    def __init__(self, temperature=1.0, top_k=0, top_p=1.0, repetition_penalty=1.0, repetition_window=32,
+                 mask=None, seed=None):
+        self.temperature = temperature
+        self.top_k = top_k
+        self.top_p = top_p
+        self.repetition_penalty = repetition_penalty
+        self.repetition_window = repetition_window
+        self.mask = mask
+        self.seed = seed
+        self.generator = None
+
+    def _generator(self, device):
+        if self.seed is None:
+            return None
+        if self.generator is None or self.generator.device != device:
+            self.generator = torch.Generator(device=device).manual_seed(self.seed)
+        return self.generator
+
+    def _apply_repetition_penalty(self, logits, history):
+        recent = history[:, -self.repetition_window:].transpose(1, 2)  # (batch, channels, window)
+        played = torch.zeros_like(logits, dtype=torch.bool).scatter_(2, recent, True)
+        penalized = torch.where(logits > 0, logits / self.repetition_penalty, logits * self.repetition_penalty)
+        return torch.where(played, penalized, logits)
+
+    def _apply_top_k(self, logits):
+        kth_best = torch.topk(logits, min(self.top_k, logits.shape[-1]), dim=-1).values[..., -1:]
+        return logits.masked_fill(logits < kth_best, float('-inf'))
+
+    def _apply_top_p(self, logits):
+        sorted_logits, order = torch.sort(logits, dim=-1, descending=True)
+        probs = F.softmax(sorted_logits, dim=-1)
+        # Drop a token when the more likely ones already reach top_p (the most likely one always stays)
+        drop = (probs.cumsum(dim=-1) - probs) >= self.top_p
+        drop = torch.zeros_like(drop).scatter_(-1, order, drop)
+        return logits.masked_fill(drop, float('-inf'))
+
+    def __call__(self, logits, history=None):
+        """
+        Sample (batch, channels) tokens from (batch, channels, vocab) logits.
+        history is the (batch, time, channels) sequence generated so far (for the repetition penalty).
+        """
+        logits = logits.float()
+        if self.mask is not None:
+            logits = logits.masked_fill(~self.mask.to(logits.device), float('-inf'))
+        if self.repetition_penalty != 1.0 and history is not None and history.shape[1] > 0:
+            logits = self._apply_repetition_penalty(logits, history)
+        if self.temperature == 0:
+            return torch.argmax(logits, dim=-1)
+
+        logits = logits / self.temperature
+        if self.top_k > 0:
+            logits = self._apply_top_k(logits)
+        if self.top_p < 1.0:
+            logits = self._apply_top_p(logits)
+        probs = F.softmax(logits, dim=-1)
+        samples = torch.multinomial(probs.reshape(-1, probs.shape[-1]), num_samples=1,
+                                    generator=self._generator(probs.device))
+        return samples.view(probs.shape[:-1])
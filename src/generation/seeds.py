@@ -0,0 +1,48 @@
+# Standard library imports
+import random
+
+# Third-party imports
+import torch
+
+def parse_line_selection(spec, num_lines):
+    """
+    1-based line numbers selected by spec: 'all', or comma separated numbers and
+    inclusive ranges ('1-100', '3,7,10-20'); numbers beyond num_lines are ignored.
+    """
+    if spec == 'all':
+        return list(range(1, num_lines + 1))
+    selected = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if '-' in part:
+            first, last = (int(n) for n in part.split('-', 1))
+            selected.update(range(first, last + 1))
+        elif part:
+            selected.add(int(part))
+    return sorted(n for n in selected if 1 <= n <= num_lines)
+
+def load_seeds(seed_file, tokenizer, lines='all', sample=None, random_seed=None, channels=4):
+    """
+    Read seeds from a seed file (one timestep per line, `channels` comma separated notes).
+
+    lines is a list of 1-based line numbers or a selection spec (see parse_line_selection);
+    sample optionally keeps a random subset of that many lines. Lines without exactly
+    `channels` notes are skipped. Returns (line numbers, (seeds, 1, channels) token tensor).
+    """
+    with open(seed_file, 'r') as f:
+        file_lines = f.readlines()
+    if isinstance(lines, str):
+        lines = parse_line_selection(lines, len(file_lines))
+    lines = [n for n in lines if 1 <= n <= len(file_lines)]
+    if sample is not None and sample < len(lines):
+        lines = sorted(random.Random(random_seed).sample(lines, sample))
+
+    line_numbers, seeds = [], []
+    for n in lines:
+        notes = [note.strip() for note in file_lines[n - 1].strip().split(',')]
+        if len(notes) != channels:
+            print(f"Skipping line {n} of {seed_file}: expected {channels} notes, got {len(notes)}")
+            continue
+        line_numbers.append(n)
+        seeds.append(tokenizer.encode(notes))
+    return line_numbers, torch.tensor(seeds, dtype=torch.long).view(len(seeds), 1, channels)
@@ -0,0 +1,361 @@
+# Standard library imports
+import collections
+import json
+import math
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Third-party imports
+import numpy as np
+import torch
+
+# Local imports
+from .sampling import Sampler, channel_mask
+from src.data_processing.sequence_to_midi import notes_to_midi_bytes
+
+class GenerationRequest:
+    """One client request: num_samples continuations of a seed, generated inside the shared batch"""
+    def __init__(self, seed_sequence, num_steps, num_samples, sampler):
+        seed_length, channels = seed_sequence.shape
+        self.rows = num_samples
+        self.sequence = torch.empty((num_samples, seed_length + num_steps, channels), dtype=torch.long)
+        self.sequence[:, :seed_length] = seed_sequence
+        self.position = seed_length
+        self.end = seed_length + num_steps
+        self.sampler = sampler
+        self.state = None  # LSTM (h, c) of causal models
+        self.logits = None
+        self.submitted = time.perf_counter()
+        self.done = threading.Event()
+        self.error = None
+
+class GenerationService:
+    """
+    Keeps the model resident and generates for many clients at once.
+
+    Requests are merged step by step (continuous batching): every iteration runs
+    one forward pass over the rows of all active requests, samples each request
+    with its own Sampler, retires the finished ones and admits queued requests,
+    up to max_batch_size rows. An idle service that receives a request waits up
+    to max_wait_ms for more before the first step. Bidirectional models see the
+    last `sequence_length` steps of every row (rows with the same window length
+    share a forward pass); causal models carry each row's LSTM state, so the
+    batched step only feeds the newly sampled timesteps.
+    """
+    def __init__(self, model, tokenizer, device, max_batch_size=64, max_wait_ms=10, sequence_length=32):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.sequence_length = sequence_length
+        self.causal = not getattr(model, 'bidirectional', True)
+        self.queue = queue.Queue()
+        self.active = []
+        self._held = None  # request that did not fit in the current batch
+        self._masks = {}
+        self.stats = {'requests': 0, 'sequences': 0, 'timesteps': 0, 'forward_passes': 0, 'forward_rows': 0,
+                      'errors': 0}
+        self.latencies = collections.deque(maxlen=1000)
+        self.started = time.time()
+        self.busy = 0.0  # seconds spent generating
+        self._thread = threading.Thread(target=self._run, name='generation', daemon=True)
+        self._thread.start()
+
+    def _mask(self, no_rest, pitch_range):
+        key = (no_rest, tuple(pitch_range) if pitch_range else None)
+        if key not in self._masks:
+            self._masks[key] = channel_mask(self.tokenizer, allow_rest=not no_rest,
+                                            pitch_ranges=pitch_range).to(self.device)
+        return self._masks[key]
+
+    def _sampler(self, temperature, top_k, top_p, repetition_penalty, no_rest, pitch_range, random_seed):
+        """
+        Sampler of a request, checked before it joins the shared batch: invalid options raise
+        ValueError instead of failing (with NaN probabilities, say) in the middle of a step.
+        """
+        def number(name, value, valid, expected):
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) \
+                    or not valid(value):
+                raise ValueError(f"{name} must be {expected}, got {value!r}")
+            return value
+        number('temperature', temperature, lambda v: v >= 0, 'a number >= 0')
+        number('top_k', top_k, lambda v: v >= 0 and v == int(v), 'an integer >= 0')
+        number('top_p', top_p, lambda v: 0 < v <= 1, 'a number in (0, 1]')
+        number('repetition_penalty', repetition_penalty, lambda v: v > 0, 'a number > 0')
+        if random_seed is not None:
+            number('random_seed', random_seed, lambda v: v == int(v), 'an integer')
+        if not isinstance(no_rest, bool):
+            raise ValueError(f"no_rest must be true or false, got {no_rest!r}")
+        mask = None
+        if no_rest or pitch_range:
+            try:
+                mask = self._mask(no_rest, pitch_range)
+            except (KeyError, ValueError, TypeError, IndexError):
+                raise ValueError(f"Invalid pitch_range {pitch_range!r}: expected [lowest, highest] note names "
+                                 f"(e.g. ['C2', 'C6']) or MIDI numbers, or one such range per channel") from None
+            empty = [channel for channel in range(mask.shape[0]) if not mask[channel].any()]
+            if empty:
+                raise ValueError(f"no_rest and pitch_range leave no token to sample for channels {empty}")
+        return Sampler(temperature=temperature, top_k=int(top_k), top_p=top_p, repetition_penalty=repetition_penalty,
+                       mask=mask, seed=None if random_seed is None else int(random_seed))
+
+    def submit(self, seed_notes=None, num_steps=64, num_samples=1, temperature=0.8, top_k=0, top_p=1.0,
+               repetition_penalty=1.0, no_rest=False, pitch_range=None, random_seed=None):
+        """
+        Queue a request and wait for it; returns a (num_samples, time, channels) token tensor.
+        Invalid sampling options raise ValueError before the request is queued.
+        """
+        if seed_notes is None:
+            seed_notes = [['C4', 'E4', 'G4', 'C5']]
+        sampler = self._sampler(temperature, top_k, top_p, repetition_penalty, no_rest, pitch_range, random_seed)
+        seed = torch.tensor([self.tokenizer.encode(step) for step in seed_notes], dtype=torch.long)
+        request = GenerationRequest(seed, num_steps, num_samples, sampler)
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            # RuntimeError whatever the cause: ValueError means a rejected request (HTTP 400)
+            raise RuntimeError(f"Generation failed: {request.error}") from request.error
+        return request.sequence
+
+    def _admit(self):
+        """Move queued requests into the active batch while they fit"""
+        rows = sum(request.rows for request in self.active)
+        deadline = None
+        while True:
+            if self._held is not None:
+                request, self._held = self._held, None
+            else:
+                try:
+                    if not self.active and deadline is None:
+                        request = self.queue.get()  # idle: block until a request arrives
+                        deadline = time.perf_counter() + self.max_wait
+                    elif deadline is not None:
+                        request = self.queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+                    else:
+                        request = self.queue.get_nowait()
+                except queue.Empty:
+                    return
+            if self.active and rows + request.rows > self.max_batch_size:
+                self._held = request
+                return
+            request.sequence = request.sequence.to(self.device)
+            self.active.append(request)
+            rows += request.rows
+
+    def _forward(self, x, state=None):
+        self.stats['forward_passes'] += 1
+        self.stats['forward_rows'] += x.shape[0]
+        if not self.causal:
+            return self.model(x), None  # forward is what torch.compile / TorchScript optimize
+        return self.model.step(x, state)
+
+    def _isolated(self, function, requests):
+        """
+        function(requests) as one batch; if it raises, function([request]) for each request
+        alone, so that an error only finishes the requests that fail on their own. function
+        must leave the requests untouched when it raises.
+        """
+        try:
+            function(requests)
+        except Exception as e:
+            if len(requests) == 1:
+                self._finish(requests[0], e)
+                return
+            for request in requests:
+                try:
+                    function([request])
+                except Exception as e:
+                    self._finish(request, e)
+
+    def _window_logits(self, requests):
+        """Bidirectional models: logits of requests that share the same window length"""
+        window = min(requests[0].position, self.sequence_length)
+        logits, _ = self._forward(torch.cat([r.sequence[:, r.position - window:r.position] for r in requests]))
+        for request, request_logits in zip(requests, logits[:, -1].split([r.rows for r in requests])):
+            request.logits = request_logits
+
+    def _seed_logits(self, requests):
+        """Causal models, new request: run its seed once to build the state"""
+        request, = requests
+        logits, state = self._forward(request.sequence[:, :request.position])
+        request.logits, request.state = logits[:, -1], state
+
+    def _step_logits(self, requests):
+        """Causal models: feed the last sampled timestep of running requests from their states"""
+        tokens = torch.cat([r.sequence[:, r.position - 1:r.position] for r in requests])
+        state = tuple(torch.cat([r.state[i] for r in requests], dim=1) for i in range(2))
+        logits, (h, c) = self._forward(tokens, state)
+        rows = [r.rows for r in requests]
+        for request, request_logits, request_h, request_c in zip(
+                requests, logits[:, -1].split(rows), h.split(rows, dim=1), c.split(rows, dim=1)):
+            request.logits, request.state = request_logits, (request_h, request_c)
+
+    def _compute_logits(self):
+        """Next-step logits of every active request (requests that fail are finished with the error)"""
+        if not self.causal:
+            groups = collections.defaultdict(list)
+            for request in self.active:
+                groups[min(request.position, self.sequence_length)].append(request)
+            for requests in groups.values():
+                self._isolated(self._window_logits, requests)
+        else:
+            running = []
+            for request in self.active:
+                if request.state is None:
+                    self._isolated(self._seed_logits, [request])
+                else:
+                    running.append(request)
+            if running:
+                self._isolated(self._step_logits, running)
+        self.active = [request for request in self.active if not request.done.is_set()]
+
+    def _sample(self):
+        """Sample the next timestep of every active request and retire the finished ones"""
+        still_active = []
+        for request in self.active:
+            try:
+                request.sequence[:, request.position] = request.sampler(request.logits,
+                                                                        request.sequence[:, :request.position])
+            except Exception as e:  # Only this request fails
+                self._finish(request, e)
+                continue
+            request.position += 1
+            self.stats['timesteps'] += request.rows
+            if request.position < request.end:
+                still_active.append(request)
+            else:
+                self._finish(request)
+        self.active = still_active
+
+    def _finish(self, request, error=None):
+        request.sequence = request.sequence.cpu()
+        request.error = error
+        self.stats['requests'] += 1
+        self.stats['sequences'] += request.rows
+        if error is not None:
+            self.stats['errors'] += 1
+        self.latencies.append(time.perf_counter() - request.submitted)
+        request.done.set()
+
+    def _run(self):
+        # no_grad is per thread: set it in the thread that runs the model
+        with torch.no_grad():
+            while True:
+                self._admit()
+                try:
+                    # Requests without steps to generate are done as soon as they are admitted
+                    for request in [r for r in self.active if r.position >= r.end]:
+                        self.active.remove(request)
+                        self._finish(request)
+                    if self.active:
+                        start = time.perf_counter()
+                        self._compute_logits()
+                        self._sample()
+                        self.busy += time.perf_counter() - start
+                except Exception as e:  # Not tied to a request (see _isolated): fail the whole batch
+                    for request in self.active:
+                        self._finish(request, e)
+                    self.active = []
+
+    def get_stats(self):
+        """Latency and throughput counters"""
+        uptime = time.time() - self.started
+        latencies = np.array(self.latencies) * 1000
+        stats = dict(self.stats)
+        stats.update({
+            'uptime_s': round(uptime, 3),
+            'queued': self.queue.qsize() + (self._held is not None),
+            'active_sequences': sum(request.rows for request in self.active),
+            'busy_s': round(self.busy, 3),
+            'timesteps_per_s': round(self.stats['timesteps'] / uptime, 1) if uptime > 0 else 0.0,
+            'busy_timesteps_per_s': round(self.stats['timesteps'] / self.busy, 1) if self.busy > 0 else 0.0,
+            'mean_batch_rows': round(self.stats['forward_rows'] / self.stats['forward_passes'], 2)
+                               if self.stats['forward_passes'] else 0.0,
+        })
+        for percentile in (50, 95, 99):
+            stats[f'latency_p{percentile}_ms'] = round(float(np.percentile(latencies, percentile)), 2) \
+                if len(latencies) else None
+        return stats
+
+class GenerationHandler(BaseHTTPRequestHandler):
+    """
+    POST /generate  JSON body with any of: seed (list of timesteps, each a list of note names),
+                    num_steps, num_samples, temperature, top_k, top_p, repetition_penalty,
+                    no_rest, pitch_range, random_seed, format ('notes' or 'midi'), tempo.
+                    'notes' answers {"sequences": [...], "latency_ms": ...}; 'midi' answers the
+                    MIDI file of the (single) generated sequence.
+    GET  /stats     service counters
+    """
+    service = None
+    max_steps = 4096
+    max_samples = 256
+
+    def _send(self, status, body, content_type='application/json'):
+        if content_type == 'application/json':
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send(200, self.service.get_stats())
+        else:
+            self._send(404, {'error': f"Unknown path: {self.path}"})
+
+    def do_POST(self):
+        if self.path != '/generate':
+            self._send(404, {'error': f"Unknown path: {self.path}"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            output_format = body.pop('format', 'notes')
+            tempo = body.pop('tempo', 120)
+            seed_notes = body.pop('seed', None)
+            num_steps = int(body.pop('num_steps', 64))
+            num_samples = int(body.pop('num_samples', 1))
+            if output_format not in ('notes', 'midi'):
+                raise ValueError(f"Unknown format: {output_format}")
+            if output_format == 'midi' and num_samples != 1:
+                raise ValueError("format 'midi' returns a single sequence: use num_samples=1")
+            if not 0 <= num_steps <= self.max_steps or not 1 <= num_samples <= self.max_samples:
+                raise ValueError(f"num_steps must be in [0, {self.max_steps}], num_samples in [1, {self.max_samples}]")
+            if seed_notes is not None and (not seed_notes or any(len(step) != 4 for step in seed_notes)):
+                raise ValueError("seed must be a non-empty list of timesteps of 4 notes")
+        except (ValueError, TypeError, json.JSONDecodeError) as e:
+            self._send(400, {'error': str(e)})
+            return
+
+        start = time.perf_counter()
+        try:
+            sequences = self.service.submit(seed_notes, num_steps=num_steps, num_samples=num_samples, **body)
+        except (TypeError, ValueError) as e:  # unknown or invalid sampling option
+            self._send(400, {'error': str(e)})
+            return
+        except Exception as e:
+            self._send(500, {'error': str(e)})
+            return
+        notes = [[self.service.tokenizer.decode(step) for step in sequence] for sequence in sequences.tolist()]
+        if output_format == 'midi':
+            self._send(200, notes_to_midi_bytes(notes[0], tempo), content_type='audio/midi')
+        else:
+            self._send(200, {'sequences': notes, 'latency_ms': round((time.perf_counter() - start) * 1000, 2)})
+
+    def log_message(self, format, *args):
+        pass  # one line per request would flood the console under load
+
+def serve(service, host='127.0.0.1', port=8765):
+    handler = type('Handler', (GenerationHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"Serving on http://{host}:{port} (POST /generate, GET /stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
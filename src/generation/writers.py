@@ -0,0 +1,109 @@
+# Standard library imports
+import struct
+
+# Third-party imports
+import numpy as np
+
+# Local imports
+from src.model.tokenizer import note_to_pitch
+
+class NoteDecoder:
+    """Token ids -> note names for whole tensors at once (one numpy lookup instead of one .item() per cell)"""
+    def __init__(self, tokenizer):
+        self.table = np.array(tokenizer.note_table())
+
+    def __call__(self, tokens):
+        return self.table[tokens.cpu().numpy()]
+
+class TextSequenceWriter:
+    """
+    Appends timesteps to a note sequence file (one line per timestep, notes separated
+    by commas, the format of sequence_to_midi.py) as soon as they are generated.
+    """
+    def __init__(self, path, flush=True):
+        self.file = open(path, 'w')
+        self.flush = flush
+
+    def write(self, step_notes):
+        self.file.write(','.join(step_notes) + '\n')
+        if self.flush:
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def _variable_length(value):
+    """MIDI variable-length quantity (7 bits per byte, high bit set on all but the last)"""
+    data = [value & 0x7F]
+    value >>= 7
+    while value:
+        data.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(data))
+
+class MidiStreamWriter:
+    """
+    Appends timesteps to a standard MIDI file (format 0, a single track) as soon as they are generated.
+
+    As in sequence_to_midi.py every timestep lasts one beat and every note is played
+    again at each step; voice i of the sequence plays on MIDI channel i. Nothing is
+    buffered: the events of a step are written when the next one (or close()) ends it.
+    The track length in the chunk header is only known at the end, so close() seeks
+    back and patches it; until then the file holds a valid event stream with a zero length.
+    """
+    TICKS_PER_BEAT = 480
+
+    def __init__(self, path, tempo=120, velocity=100, flush=True):
+        self.file = open(path, 'wb')
+        self.velocity = velocity
+        self.flush = flush
+        self.file.write(b'MThd' + struct.pack('>IHHH', 6, 0, 1, self.TICKS_PER_BEAT))
+        self._length_offset = self.file.tell() + 4
+        self.file.write(b'MTrk' + struct.pack('>I', 0))
+        self._track_length = 0
+        self._last_tick = 0
+        self._steps = 0
+        self._sounding = []  # (channel, pitch) of the notes of the last step
+        self._event(0, b'\xff\x51\x03' + (60_000_000 // tempo).to_bytes(3, 'big'))  # tempo
+
+    def _event(self, tick, data):
+        event = _variable_length(tick - self._last_tick) + data
+        self._last_tick = tick
+        self.file.write(event)
+        self._track_length += len(event)
+
+    def _release(self, tick):
+        for channel, pitch in self._sounding:
+            self._event(tick, bytes((0x80 | channel, pitch, 0)))
+        self._sounding = []
+
+    def write(self, step_notes):
+        tick = self._steps * self.TICKS_PER_BEAT
+        self._release(tick)
+        for channel, note in enumerate(step_notes):
+            pitch = note_to_pitch(note)
+            if pitch is not None:  # rests are silence
+                self._event(tick, bytes((0x90 | channel, pitch, self.velocity)))
+                self._sounding.append((channel, pitch))
+        self._steps += 1
+        if self.flush:
+            self.file.flush()
+
+    def close(self):
+        self._release(self._steps * self.TICKS_PER_BEAT)
+        self._event(self._last_tick, b'\xff\x2f\x00')  # end of track
+        self.file.seek(self._length_offset)
+        self.file.write(struct.pack('>I', self._track_length))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
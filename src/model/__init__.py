@@ -6,7 +6,7 @@ This package contains the neural network models for music generation.
 import torch
 import torch.nn as nn
 
-from .music_net import EfficientHarmonicMusicNet
+from .music_net import EfficientHarmonicMusicNet, FusedChannelEmbedding
 from .tokenizer import MusicTokenizer
 
-__all__ = ['EfficientHarmonicMusicNet', 'MusicTokenizer']
+__all__ = ['EfficientHarmonicMusicNet', 'FusedChannelEmbedding', 'MusicTokenizer']
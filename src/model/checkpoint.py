@@ -0,0 +1,237 @@
+# Standard library imports
+import os
+import queue
+import shutil
+import threading
+import time
+import warnings
+
+# Third-party imports
+import torch
+
+# Local imports
+from .music_net import EfficientHarmonicMusicNet
+from .quantize import is_quantized_checkpoint, quantize_dynamic_int8
+from .tokenizer import MusicTokenizer
+
+DEFAULT_SEQUENCE_LENGTH = 32
+
+def model_config(model):
+    """Constructor arguments that rebuild `model` (dropout aside, which inference does not use)"""
+    return {
+        'num_notes': model.num_notes,
+        'embedding_dim': model.embedding_dim,
+        'hidden_size': model.hidden_size,
+        'num_channels': model.num_channels,
+        'bidirectional': model.bidirectional,
+    }
+
+def checkpoint_metadata(model, tokenizer, sequence_length):
+    """
+    Entries saved next to the weights so that a checkpoint describes itself: the model
+    hyperparameters, the vocabulary it was trained with and its training window length.
+    """
+    return {
+        'model_config': model_config(model),
+        'vocab_size': len(tokenizer.note_to_id),
+        'vocab_hash': tokenizer.vocab_hash(),
+        'sequence_length': sequence_length,
+    }
+
+def load_checkpoint(path, map_location='cpu'):
+    """
+    torch.load of a checkpoint, weights only and memory-mapped: tensors are backed by the
+    file (through the page cache) instead of being read and copied at load time. Files in
+    the legacy, non-zip format cannot be mapped and are read normally. Quantized checkpoints,
+    whose packed int8 weights are ScriptObjects, are accepted too.
+    """
+    with torch.serialization.safe_globals([torch.ScriptObject]), warnings.catch_warnings():
+        # Deprecation notices raised while unpickling quantized weights (see quantize.py)
+        warnings.filterwarnings('ignore', message='torch.quantize_per_tensor')
+        warnings.filterwarnings('ignore', message='TypedStorage is deprecated')
+        try:
+            return torch.load(path, map_location=map_location, mmap=True)
+        except RuntimeError as e:
+            if 'mmap' not in str(e):
+                raise
+            return torch.load(path, map_location=map_location)
+
+def model_state_dict(checkpoint):
+    """The weights of a training checkpoint, of a model checkpoint or of a bare state dict"""
+    if isinstance(checkpoint, dict) and 'model_state_dict' in checkpoint:
+        return checkpoint['model_state_dict']
+    return checkpoint
+
+def infer_model_config(state_dict, num_channels=4):
+    """Hyperparameters of an fp32 checkpoint saved without model_config, from the shapes of its weights"""
+    return {
+        'num_notes': state_dict['output.weight'].shape[0] // num_channels,
+        'embedding_dim': state_dict['lstm.weight_ih_l0'].shape[1] // num_channels,
+        'hidden_size': state_dict['lstm.weight_hh_l0'].shape[1],
+        'num_channels': num_channels,
+        'bidirectional': 'lstm.weight_hh_l0_reverse' in state_dict,
+    }
+
+def checkpoint_config(checkpoint, fallback=None):
+    """
+    The model_config of a checkpoint. Older checkpoints do not record it: fp32 ones reveal
+    it through their weight shapes, quantized ones need `fallback` (e.g. from the command line).
+    """
+    if isinstance(checkpoint, dict) and 'model_config' in checkpoint:
+        return dict(checkpoint['model_config'])
+    try:
+        return infer_model_config(model_state_dict(checkpoint))
+    except KeyError:
+        if fallback is None or any(value is None for value in fallback.values()):
+            raise ValueError("The checkpoint does not describe its model: give its sizes (--embedding-dim, "
+                             "--hidden-size, --causal)") from None
+        return dict(fallback)
+
+def build_model(checkpoint, config=None):
+    """
+    EfficientHarmonicMusicNet holding the weights of a loaded checkpoint (see load_checkpoint),
+    in eval mode. `config` defaults to checkpoint_config(checkpoint). The model is built on
+    the meta device and the checkpoint's tensors become its parameters (assign=True), so no
+    parameter memory is allocated, initialized or copied; with a memory-mapped checkpoint
+    the weights are read from disk only when first used. Quantized checkpoints are rebuilt
+    as int8 models.
+    """
+    if config is None:
+        config = checkpoint_config(checkpoint)
+    state_dict = model_state_dict(checkpoint)
+    if is_quantized_checkpoint(checkpoint):
+        # The packed int8 weights only load into an already quantized model
+        model = quantize_dynamic_int8(EfficientHarmonicMusicNet(dropout=0.0, **config).eval())
+        model.load_state_dict(state_dict)
+        return model
+    with torch.device('meta'):
+        model = EfficientHarmonicMusicNet(dropout=0.0, **config)
+    model.load_state_dict(state_dict, assign=True)
+    return model.eval()
+
+def checkpoint_tokenizer(checkpoint, vocab_file='vocab.txt'):
+    """
+    The tokenizer a checkpoint was trained with: vocab_file cut to the checkpoint's vocabulary
+    size. Warns if the vocabulary differs from the recorded one (e.g. vocab.txt was changed).
+    """
+    if isinstance(checkpoint, dict) and 'vocab_size' in checkpoint:
+        vocab_size = checkpoint['vocab_size']
+    else:
+        vocab_size = checkpoint_config(checkpoint, fallback={'num_notes': 128})['num_notes']
+    tokenizer = MusicTokenizer(vocab_file=vocab_file, max_vocab_size=vocab_size)
+    expected = checkpoint.get('vocab_hash') if isinstance(checkpoint, dict) else None
+    if expected is not None and tokenizer.vocab_hash() != expected:
+        print(f"Warning: {vocab_file} is not the vocabulary the model was trained with "
+              f"(hash {tokenizer.vocab_hash()}, expected {expected})")
+    return tokenizer
+
+def snapshot_to_cpu(state):
+    """
+    Copy of a (nested) state dict with every tensor copied to CPU: a consistent snapshot that
+    training can keep updating, without deep-copying the modules the state comes from.
+    """
+    if isinstance(state, torch.Tensor):
+        return state.detach().to('cpu', copy=True)
+    if isinstance(state, dict):
+        return {key: snapshot_to_cpu(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(snapshot_to_cpu(value) for value in state)
+    return state
+
+def atomic_save(state, path):
+    """torch.save through a temporary file renamed over `path`: readers never see a partial checkpoint"""
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        torch.save(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+def _atomic_copy(source, path):
+    temporary = path + '.tmp'
+    shutil.copyfile(source, temporary)
+    os.replace(temporary, path)
+
+class CheckpointWriter:
+    """
+    Writes training checkpoints on a background thread, so that training only waits for the
+    CPU snapshot. Under `directory`:
+      last/last_model.pt    the latest checkpoint (what train_efficient.sh resumes from)
+      best/best_model.pt    the checkpoint with the best validation loss
+      recent/step_N.pt      the `keep` most recent checkpoints
+    Besides the end of every epoch, due() asks for a checkpoint every `every_steps` training
+    steps and/or every `every_seconds` (0 = off). At most one snapshot waits while another is
+    being written: save() blocks if training produces them faster than the disk takes them.
+    """
+    def __init__(self, directory='checkpoints', keep=3, every_steps=0, every_seconds=0):
+        self.directory = directory
+        self.keep = keep
+        self.every_steps = every_steps
+        self.every_seconds = every_seconds
+        self.last_path = os.path.join(directory, 'last', 'last_model.pt')
+        self.best_path = os.path.join(directory, 'best', 'best_model.pt')
+        for path in (self.last_path, self.best_path, os.path.join(directory, 'recent', '')):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Recent checkpoints already on disk (e.g. from the run being resumed), oldest first
+        recent_dir = os.path.join(directory, 'recent')
+        self.recent = sorted((os.path.join(recent_dir, name) for name in os.listdir(recent_dir)
+                              if name.startswith('step_') and name.endswith('.pt')), key=os.path.getmtime)
+        self._last_step, self._last_time = 0, time.monotonic()
+        self._queue = queue.Queue(maxsize=1)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='checkpoint-writer', daemon=True)
+        self._thread.start()
+
+    def start_from(self, step):
+        """Count periodic checkpoints from training step `step`, e.g. the step a resumed run starts at"""
+        self._last_step, self._last_time = step, time.monotonic()
+
+    def due(self, step):
+        """Whether a periodic checkpoint is due at training step `step` (counted across epochs)"""
+        return bool((self.every_steps and step - self._last_step >= self.every_steps)
+                    or (self.every_seconds and time.monotonic() - self._last_time >= self.every_seconds))
+
+    def save(self, state, step, best=False):
+        """
+        Snapshot `state` (a dict of state dicts and values) to CPU and queue it for last/ and
+        recent/, and for best/ if `best`. Returns the snapshot.
+        """
+        self._raise_error()
+        snapshot = snapshot_to_cpu(state)
+        self._last_step, self._last_time = step, time.monotonic()
+        self._queue.put((snapshot, step, best))
+        return snapshot
+
+    def close(self):
+        """Wait for the queued checkpoints to be written"""
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError(f"Writing a checkpoint failed: {error}") from error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                self._write(*item)
+            except Exception as e:  # Raised in the training thread by the next save() or close()
+                self._error = e
+
+    def _write(self, snapshot, step, best):
+        atomic_save(snapshot, self.last_path)
+        if best:
+            _atomic_copy(self.last_path, self.best_path)
+        if self.keep > 0:
+            path = os.path.join(self.directory, 'recent', f"step_{step:09d}.pt")
+            _atomic_copy(self.last_path, path)
+            if path in self.recent:
+                self.recent.remove(path)
+            self.recent.append(path)
+            while len(self.recent) > self.keep:
+                os.remove(self.recent.pop(0))
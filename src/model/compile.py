@@ -0,0 +1,41 @@
+# Standard library imports
+import os
+
+# Third-party imports
+import torch
+
+COMPILE_MODES = ('eager', 'compile', 'script')
+DEFAULT_CACHE_DIR = '.compile_cache'
+
+def compile_model(model, mode='eager', cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Return a callable that runs `model` in the requested execution mode.
+
+    - 'eager':   the model itself
+    - 'compile': torch.compile with dynamic shapes (batch and sequence length
+                 vary during generation). torch.compile only compiles
+                 `forward`, so `step` (incremental causal generation) is
+                 compiled separately. Inductor's compiled kernels are cached
+                 on disk in `cache_dir`, so only the first run pays the full
+                 compilation time.
+    - 'script':  a TorchScript module (`step` is exported with it)
+
+    The returned module shares its parameters with `model`, so training it
+    trains `model`; save checkpoints from `model`, whose state-dict keys are
+    unchanged. The train/eval mode is shared only in 'eager' and 'compile'
+    mode: a TorchScript module has its own, so call train()/eval() on the
+    module that runs the forward pass.
+    """
+    if mode == 'eager':
+        return model
+    if mode == 'compile':
+        # Must be set before the first compilation; an explicit environment setting wins
+        os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', os.path.abspath(os.path.join(cache_dir, 'inductor')))
+        compiled = torch.compile(model, dynamic=True)
+        # Set on the wrapper only: assigning an attribute of the compiled module would set it on
+        # `model`, whose forward calls its own (eager) step
+        object.__setattr__(compiled, 'step', torch.compile(model.step, dynamic=True))
+        return compiled
+    if mode == 'script':
+        return torch.jit.script(model)
+    raise ValueError(f"Unknown compile mode: {mode}")
@@ -1,89 +1,141 @@
 # Third-party imports
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import math
+from typing import Optional, Tuple
+
+# Local imports
+from .profiler import parameter_bytes, parameter_counts
+
+class FusedChannelEmbedding(nn.Module):
+    """
+    One embedding table per channel, stored as a single (num_channels * num_embeddings, embedding_dim)
+    weight. Token t of channel c lives at row c * num_embeddings + t, so all channels are looked up
+    with one gather whose output is already in the concatenated (..., num_channels * embedding_dim) layout.
+    """
+    def __init__(self, num_embeddings, embedding_dim, num_channels=4):
+        super().__init__()
+        self.num_embeddings = num_embeddings
+        self.embedding_dim = embedding_dim
+        self.num_channels = num_channels
+        self.weight = nn.Parameter(torch.empty(num_channels * num_embeddings, embedding_dim))
+        if self.weight.is_meta:
+            # Built to receive a checkpoint's tensors (see checkpoint.build_model): initializing on the
+            # meta device only costs time, offsets are filled in by _load_from_state_dict
+            offsets = torch.empty(num_channels, dtype=torch.long)
+        else:
+            nn.init.normal_(self.weight)  # same init as nn.Embedding
+            offsets = torch.arange(num_channels) * num_embeddings
+        self.register_buffer('offsets', offsets, persistent=False)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+        if self.offsets.is_meta:
+            # Built on the meta device and loaded with assign=True: offsets are not saved, rebuild them
+            self.offsets = torch.arange(self.num_channels, device=self.weight.device) * self.num_embeddings
+
+    def forward(self, x):
+        # x: (..., num_channels) token ids -> (..., num_channels * embedding_dim)
+        embedded = F.embedding(x + self.offsets, self.weight)
+        return embedded.flatten(-2)
+
+def fuse_embedding_optimizer_state(optimizer_state, num_channels=4):
+    """
+    Convert the optimizer state of a checkpoint saved with separate embedding1..N tables
+    (the first N parameters of the model) to the fused embedding layout.
+    """
+    state = optimizer_state['state']
+    fused = {}
+    for key in state.get(0, {}):
+        values = [state[i][key] for i in range(num_channels) if i in state]
+        if len(values) == num_channels and values[0].dim() > 0:
+            fused[key] = torch.cat(values)
+        else:
+            fused[key] = values[0]  # e.g. Adam's step counter, the same for every table
+    new_state = {0: fused} if fused else {}
+    for index, value in state.items():
+        if index >= num_channels:
+            new_state[index - num_channels + 1] = value
+    
+    param_groups = [{**group, 'params': [0] + [p - num_channels + 1 for p in group['params'] if p >= num_channels]}
+                    for group in optimizer_state['param_groups']]
+    return {'state': new_state, 'param_groups': param_groups}
 
 class EfficientHarmonicMusicNet(nn.Module):
     """
     Simplified model for harmonic music generation.
     """
-    def __init__(self, num_notes, embedding_dim=16, hidden_size=32, dropout=0.2):
+    def __init__(self, num_notes, embedding_dim=16, hidden_size=32, dropout=0.2, num_channels=4, bidirectional=True):
         super().__init__()
         self.num_notes = num_notes
         self.embedding_dim = embedding_dim
         self.hidden_size = hidden_size
+        self.num_channels = num_channels
+        # bidirectional=False gives a causal model: the output at step t only depends on steps <= t,
+        # so it can be generated incrementally from the LSTM state (see src/generation)
+        self.bidirectional = bidirectional
         
-        # Embedding layers for each channel
-        self.embedding1 = nn.Embedding(num_notes, embedding_dim)
-        self.embedding2 = nn.Embedding(num_notes, embedding_dim)
-        self.embedding3 = nn.Embedding(num_notes, embedding_dim)
-        self.embedding4 = nn.Embedding(num_notes, embedding_dim)
+        # One embedding table per channel, looked up in a single gather
+        self.embedding = FusedChannelEmbedding(num_notes, embedding_dim, num_channels)
         
         # Single LSTM layer
         self.lstm = nn.LSTM(
-            4 * embedding_dim,
+            num_channels * embedding_dim,
             hidden_size,
             num_layers=3,
             batch_first=True,
-            bidirectional=True,
+            bidirectional=bidirectional,
             dropout=dropout
         )
         
         # Output layer
-        self.output = nn.Linear(2 * hidden_size, 4 * num_notes)
+        self.output = nn.Linear((2 if bidirectional else 1) * hidden_size, num_channels * num_notes)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # Checkpoints from before the fused embedding have one table per channel: embedding1..N
+        legacy_keys = [f"{prefix}embedding{i + 1}.weight" for i in range(self.num_channels)]
+        if all(key in state_dict for key in legacy_keys):
+            state_dict[f"{prefix}embedding.weight"] = torch.cat([state_dict.pop(key) for key in legacy_keys])
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
 
     def forward(self, x):
+        logits, _ = self.step(x, None)
+        return logits
+
+    @torch.jit.export
+    def step(self, x, state: Optional[Tuple[torch.Tensor, torch.Tensor]] = None):
+        """
+        Run the model over x starting from the LSTM `state` (None = start of a sequence).
+        Returns the logits and the LSTM (h, c) state after the last timestep; for a causal
+        model, feeding a sequence in pieces gives the same logits as feeding it whole.
+        """
         # Handle single batch case
         if len(x.shape) == 2:
             x = x.unsqueeze(0)
             
         batch_size, seq_length, _ = x.shape
         
-        # Split input into separate channels
-        x1, x2, x3, x4 = x.split(1, dim=2)
-        
-        # Get embeddings for each channel
-        embed1 = self.embedding1(x1.squeeze(-1))
-        embed2 = self.embedding2(x2.squeeze(-1))
-        embed3 = self.embedding3(x3.squeeze(-1))
-        embed4 = self.embedding4(x4.squeeze(-1))
-        
-        # Concatenate embeddings
-        concatenated = torch.cat((embed1, embed2, embed3, embed4), dim=2)
+        # Embeddings of all channels, already concatenated
+        concatenated = self.embedding(x)
         
         # LSTM layer
-        lstm_out, _ = self.lstm(concatenated)
+        lstm_out, state = self.lstm(concatenated, state)
         
         # Output layer
         logits = self.output(lstm_out)
         
         # Reshape output for each channel
-        logits = logits.view(batch_size, seq_length, 4, self.num_notes)
+        logits = logits.view(batch_size, seq_length, self.num_channels, self.num_notes)
         
-        return logits
+        return logits, state
 
     def get_complexity(self):
         """
-        Calculate model complexity in terms of parameters and memory usage.
+        Parameter count and parameter memory of the model (see src/model/profiler.py for
+        FLOPs and activation memory).
         """
-        # Embedding layers
-        emb_params = 4 * (self.num_notes * self.embedding_dim)
-        emb_memory = emb_params * 4
-        
-        # LSTM parameters
-        input_size = 4 * self.embedding_dim
-        lstm_params = 4 * (input_size * self.hidden_size + self.hidden_size * self.hidden_size)
-        lstm_params += 4 * self.hidden_size * 2  # bias parameters
-        lstm_memory = lstm_params * 4
-        
-        # Output layer
-        output_params = self.hidden_size * (4 * self.num_notes)
-        output_memory = output_params * 4
-        
-        total_params = emb_params + lstm_params + output_params
-        total_memory = emb_memory + lstm_memory + output_memory
-        
         return {
-            'total_parameters': total_params,
-            'total_memory_mb': total_memory / (1024 * 1024)  # Convert to MB
-        }
\ No newline at end of file
+            'total_parameters': parameter_counts(self)['total'],
+            'total_memory_mb': parameter_bytes(self) / (1024 * 1024)  # Convert to MB
+        }
@@ -0,0 +1,50 @@
+# Standard library imports
+import json
+import warnings
+
+# Third-party imports
+import torch
+import torch.nn as nn
+
+class StatefulStep(nn.Module):
+    """model.step() with the LSTM (h, c) state as plain inputs and outputs, the form ONNX graphs take"""
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, tokens, h, c):
+        logits, (h, c) = self.model.step(tokens, (h, c))
+        return logits, h, c
+
+def export_onnx(model, path, opset=17, metadata=None):
+    """
+    Export an EfficientHarmonicMusicNet to ONNX, with dynamic batch and time axes.
+
+    Bidirectional models become tokens (batch, time, channels) -> logits (batch, time,
+    channels, notes). Causal models are exported through StatefulStep: inputs tokens, h, c
+    (layers, batch, hidden), outputs logits, h_out, c_out; a zero state gives the logits of
+    the whole sequence and feeding h_out, c_out back continues it one step at a time.
+    Uses the TorchScript-based exporter, which handles the LSTM state inputs. `metadata`
+    (see checkpoint_metadata) is stored JSON-encoded in the graph's metadata properties.
+    """
+    model.eval()
+    tokens = torch.randint(0, model.num_notes, (2, 3, model.num_channels))
+    axes = {'tokens': {0: 'batch', 1: 'time'}, 'logits': {0: 'batch', 1: 'time'}}
+    if model.bidirectional:
+        module, inputs, input_names, output_names = model, (tokens,), ['tokens'], ['logits']
+    else:
+        state = torch.zeros(model.lstm.num_layers, tokens.shape[0], model.hidden_size)
+        module, inputs = StatefulStep(model), (tokens, state, state.clone())
+        input_names, output_names = ['tokens', 'h', 'c'], ['logits', 'h_out', 'c_out']
+        axes.update({name: {1: 'batch'} for name in ('h', 'c', 'h_out', 'c_out')})
+    with torch.no_grad(), warnings.catch_warnings():
+        # The exporter warns about LSTMs and batch sizes; export_efficient.py checks other shapes numerically
+        warnings.simplefilter('ignore')
+        torch.onnx.export(module, inputs, path, input_names=input_names, output_names=output_names,
+                          dynamic_axes=axes, opset_version=opset, dynamo=False)
+    if metadata:
+        import onnx  # optional dependency, only needed to export
+        graph = onnx.load(path)
+        for key, value in metadata.items():
+            graph.metadata_props.add(key=key, value=json.dumps(value))
+        onnx.save(graph, path)
@@ -0,0 +1,174 @@
+# Standard library imports
+import os
+
+# Third-party imports
+import torch
+
+# Bytes of the int64 token ids kept by the embedding for its backward
+INDEX_BYTES = 8
+
+def parameter_counts(model):
+    """Exact parameter count of each top-level layer of the model (embedding, lstm, output) and in total"""
+    counts = {name: sum(p.numel() for p in module.parameters()) for name, module in model.named_children()}
+    counts['total'] = sum(p.numel() for p in model.parameters())
+    counts['trainable'] = sum(p.numel() for p in model.parameters() if p.requires_grad)
+    return counts
+
+def parameter_bytes(model):
+    """Bytes of the parameters and buffers as stored (works on meta models too)"""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+def _lstm_layer_sizes(lstm):
+    """(input size, hidden size) of every layer of an nn.LSTM"""
+    directions = 2 if lstm.bidirectional else 1
+    return [(lstm.input_size if layer == 0 else directions * lstm.hidden_size, lstm.hidden_size)
+            for layer in range(lstm.num_layers)]
+
+def forward_flops(model, batch_size, seq_len):
+    """
+    FLOPs of one forward pass over (batch_size, seq_len) tokens, per layer: 2 per multiply-add
+    of the matmuls, 1 per bias add and per elementwise op of the LSTM cell. The embedding is a
+    gather and costs none.
+    """
+    positions = batch_size * seq_len
+    directions = 2 if model.lstm.bidirectional else 1
+    lstm = 0
+    for input_size, hidden_size in _lstm_layer_sizes(model.lstm):
+        gates = 4 * hidden_size
+        # x @ W_ih, h @ W_hh, the two biases, 4 gate activations, c = f*c + i*g, h = o*tanh(c)
+        lstm += 2 * gates * (input_size + hidden_size) + 2 * gates + gates + 5 * hidden_size
+    lstm *= directions * positions
+    output = positions * (2 * model.output.in_features + 1) * model.output.out_features
+    return {'embedding': 0, 'lstm': lstm, 'output': output, 'total': lstm + output}
+
+def backward_flops(model, batch_size, seq_len):
+    """
+    FLOPs of the backward pass matching forward_flops: twice the forward (gradients of the
+    inputs and of the weights) plus the scatter-add into the embedding table.
+    """
+    forward = forward_flops(model, batch_size, seq_len)
+    flops = {name: 2 * value for name, value in forward.items()}
+    flops['embedding'] = batch_size * seq_len * model.embedding.weight.shape[1] * model.num_channels
+    flops['total'] = sum(value for name, value in flops.items() if name != 'total')
+    return flops
+
+def _saved_tensor_bytes(model, batch_size, seq_len, dtype):
+    """Bytes of the tensors, other than the parameters, that autograd saves in one forward pass"""
+    device = next(model.parameters()).device
+    # Sizes do not depend on the token values; zeros leave the random number generator alone
+    tokens = torch.zeros(batch_size, seq_len, model.num_channels, dtype=torch.long, device=device)
+    parameters = {p.untyped_storage().data_ptr() for p in model.parameters()}
+    saved = {}
+
+    def pack(tensor):
+        storage = tensor.untyped_storage()
+        if storage.data_ptr() not in parameters:
+            saved[storage.data_ptr()] = storage.nbytes()
+        return tensor
+
+    autocast = torch.autocast(device.type, dtype=dtype, enabled=dtype not in (None, torch.float32))
+    with torch.enable_grad(), autocast, torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        model(tokens)
+    return sum(saved.values())
+
+def _activation_bytes_fit(model, seq_len, dtype):
+    """(fixed, per window) bytes kept for backward, from batches of 1 and 2 seq_len windows"""
+    one = _saved_tensor_bytes(model, 1, seq_len, dtype)
+    two = _saved_tensor_bytes(model, 2, seq_len, dtype)
+    return 2 * one - two, two - one
+
+def activation_bytes(model, batch_size, seq_len, dtype=None):
+    """
+    Bytes of the activations autograd keeps for the backward pass of a (batch_size, seq_len)
+    batch, `dtype` being the autocast dtype (None = fp32). Measured on the model's device with
+    batches of 1 and 2 windows and extrapolated linearly, so it includes what the LSTM kernel
+    of that device keeps (the oneDNN workspace on CPU, the cuDNN reserve on GPU). Workspaces are
+    counted at their allocated size, so on CPU the figure errs on the high side of the resident
+    memory (see benchmarks/training_cost.py).
+    """
+    fixed, per_window = _activation_bytes_fit(model, seq_len, dtype)
+    return fixed + batch_size * per_window
+
+def logits_bytes(model, batch_size, seq_len, dtype=None):
+    element = torch.empty(0, dtype=dtype or torch.float32).element_size()
+    return batch_size * seq_len * model.output.out_features * element
+
+def _training_state_bytes(model):
+    """fp32 weights, gradients and the two Adam moments"""
+    return 4 * sum(p.numel() for p in model.parameters()) * 4
+
+def peak_training_bytes(model, batch_size, seq_len, dtype=None, activations=None):
+    """
+    Peak memory of an Adam training step: fp32 weights, gradients and the two Adam moments,
+    plus the saved activations (activation_bytes, unless given) and, at the start of the
+    backward pass, the logits, the log-probabilities the cross entropy keeps and their gradient.
+    """
+    if activations is None:
+        activations = activation_bytes(model, batch_size, seq_len, dtype)
+    return _training_state_bytes(model) + activations + 3 * logits_bytes(model, batch_size, seq_len, dtype)
+
+def peak_inference_bytes(model, batch_size, seq_len, dtype=None):
+    """
+    Peak activation memory of a no-grad forward pass: the largest stage, counting the input
+    and output of each layer and, for the LSTM, the input projections of the whole sequence
+    that the CPU kernel computes up front.
+    """
+    element = torch.empty(0, dtype=dtype or torch.float32).element_size()
+    directions = 2 if model.lstm.bidirectional else 1
+    stages = [model.num_channels * INDEX_BYTES + model.lstm.input_size * element]
+    for input_size, hidden_size in _lstm_layer_sizes(model.lstm):
+        stages.append((input_size + directions * 5 * hidden_size) * element)
+    stages.append((model.output.in_features + model.output.out_features) * element)
+    return batch_size * seq_len * max(stages)
+
+def profile_model(model, batch_size, seq_len, dtype=None):
+    """
+    Cost of a model on (batch_size, seq_len) batches: parameters, forward and backward FLOPs,
+    activation and peak memory. `dtype` is the autocast dtype of training (None = fp32).
+    """
+    forward = forward_flops(model, batch_size, seq_len)
+    backward = backward_flops(model, batch_size, seq_len)
+    activations = activation_bytes(model, batch_size, seq_len, dtype)
+    return {
+        'batch_size': batch_size,
+        'seq_len': seq_len,
+        'parameters': parameter_counts(model),
+        'parameter_bytes': parameter_bytes(model),
+        'forward_flops': forward['total'],
+        'backward_flops': backward['total'],
+        'flops_by_layer': {name: forward[name] + backward[name] for name in forward if name != 'total'},
+        'activation_bytes': activations,
+        'peak_training_bytes': peak_training_bytes(model, batch_size, seq_len, dtype, activations),
+        'peak_inference_bytes': peak_inference_bytes(model, batch_size, seq_len, dtype),
+    }
+
+def max_batch_size(model, seq_len, memory_bytes, dtype=None):
+    """Largest training batch of seq_len windows whose peak_training_bytes fits in memory_bytes (0 if none)"""
+    fixed, per_window = _activation_bytes_fit(model, seq_len, dtype)
+    fixed += _training_state_bytes(model)
+    per_window += 3 * logits_bytes(model, 1, seq_len, dtype)
+    return max(0, (memory_bytes - fixed) // per_window)
+
+def device_memory_bytes(device):
+    """Total memory of a CUDA device, or the physical RAM for the CPU; None if unknown"""
+    if device.type == 'cuda':
+        return torch.cuda.get_device_properties(device).total_memory
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):  # Not available on Windows
+        return None
+
+def format_profile(profile):
+    """Lines describing a profile_model() result, for printing"""
+    mb = 1024 * 1024
+    parameters = profile['parameters']
+    layers = ', '.join(f"{name} {count:,}" for name, count in parameters.items() if name not in ('total', 'trainable'))
+    return [
+        f"Parameters: {parameters['total']:,} ({layers}), {profile['parameter_bytes'] / mb:.2f} MB",
+        f"Batch {profile['batch_size']} x {profile['seq_len']}: forward {profile['forward_flops'] / 1e9:.3f} GFLOPs, "
+        f"backward {profile['backward_flops'] / 1e9:.3f} GFLOPs",
+        f"Activations kept for backward: {profile['activation_bytes'] / mb:.2f} MB",
+        f"Peak memory: training {profile['peak_training_bytes'] / mb:.2f} MB "
+        f"(weights, gradients, Adam state, activations, logits), inference {profile['peak_inference_bytes'] / mb:.2f} MB",
+    ]
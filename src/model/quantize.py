@@ -0,0 +1,25 @@
+# Standard library imports
+import warnings
+
+# Third-party imports
+import torch
+import torch.nn as nn
+
+# Value of the 'quantization' entry of a checkpoint written by export_efficient.py quantize
+DYNAMIC_INT8 = 'dynamic_int8'
+
+def quantize_dynamic_int8(model):
+    """
+    Copy of `model` with the LSTM and Linear weights stored as int8 (dynamic quantization).
+
+    Activations stay fp32 and are quantized on the fly at every matmul, so no calibration
+    data is needed; the embedding stays fp32. CPU only: the quantized kernels have no CUDA
+    implementation.
+    """
+    with warnings.catch_warnings():
+        # torch.ao.quantization is deprecated in favour of torchao, which is not a dependency here
+        warnings.simplefilter('ignore')
+        return torch.ao.quantization.quantize_dynamic(model, {nn.LSTM, nn.Linear}, dtype=torch.qint8)
+
+def is_quantized_checkpoint(checkpoint):
+    return isinstance(checkpoint, dict) and checkpoint.get('quantization') == DYNAMIC_INT8
@@ -1,4 +1,30 @@
 import ast
+import hashlib
+import json
+
+NOTE_OFFSETS = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+PITCH_CLASSES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+
+
+def note_to_pitch(note):
+    """Numero MIDI di una nota nel formato del vocabolario ('C4', 'C4#', 'D4b'); None per la pausa 'O'."""
+    if note == 'O':
+        return None
+    accidental = 0
+    if note.endswith('#'):
+        accidental, note = 1, note[:-1]
+    elif note.endswith('b'):
+        accidental, note = -1, note[:-1]
+    return (int(note[1:]) + 1) * 12 + NOTE_OFFSETS[note[0]] + accidental
+
+
+def pitch_to_note(pitch):
+    """Nome canonico (diesis dopo l'ottava, es. 60 -> 'C4', 61 -> 'C4#') di un numero MIDI."""
+    name = PITCH_CLASSES[pitch % 12]
+    octave = (pitch // 12) - 1
+    if name.endswith('#'):
+        return f"{name[0]}{octave}#"
+    return f"{name}{octave}"
 
 
 class MusicTokenizer:
@@ -56,6 +82,26 @@ class MusicTokenizer:
     def decode(self, token_sequence):
         """Decodifica una sequenza di token (lista di interi) in una sequenza di note (stringhe)."""
         return [self.id_to_note.get(token, 'O') for token in token_sequence]
+    
+    def pitch_table(self):
+        """Numero MIDI di ogni token, indicizzato per id (-1 per la pausa)."""
+        table = [-1] * (max(self.id_to_note) + 1)
+        for note, idx in self.note_to_id.items():
+            pitch = note_to_pitch(note)
+            table[idx] = -1 if pitch is None else pitch
+        return table
+    
+    def note_table(self):
+        """Nome della nota di ogni token, indicizzato per id ('O' per gli id senza nota)."""
+        table = ['O'] * (max(self.id_to_note) + 1)
+        for idx, note in self.id_to_note.items():
+            table[idx] = note
+        return table
+    
+    def vocab_hash(self):
+        """Hash stabile del vocabolario (nota -> id), per riconoscere dati e modelli compatibili."""
+        items = sorted(self.note_to_id.items(), key=lambda item: item[1])
+        return hashlib.sha256(json.dumps(items).encode('utf-8')).hexdigest()[:16]
 
 
 if __name__ == '__main__':
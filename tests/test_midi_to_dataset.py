@@ -0,0 +1,85 @@
+# Standard library imports
+import json
+import shutil
+import multiprocessing
+import os
+from pathlib import Path
+
+# Third-party imports
+import pretty_midi
+import pytest
+
+# Local imports
+from src.data_processing.ingest_cache import file_content_hash
+from src.data_processing.midi_to_dataset import (MidiConverter, _iter_corpus, convert_midi_files,
+                                                 process_midi_directory)
+from src.data_processing.token_store import songs_index_path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# The crash is patched into the converter class, which only forked workers inherit
+needs_fork = pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                                reason="needs worker processes started with fork")
+
+def write_midi_files(directory, count):
+    """`count` small MIDI files with different notes (so different content hashes)"""
+    directory.mkdir()
+    for i in range(count):
+        midi = pretty_midi.PrettyMIDI()
+        piano = pretty_midi.Instrument(program=0)
+        for beat in range(8):
+            piano.notes.append(pretty_midi.Note(velocity=80, pitch=48 + i + beat % 3,
+                                                start=beat * 0.25, end=(beat + 1) * 0.25))
+        midi.instruments.append(piano)
+        midi.write(str(directory / f"song_{i}.mid"))
+    return sorted(directory.glob('*.mid'))
+
+@pytest.fixture
+def crashing_converter(monkeypatch):
+    """Make the worker converting a file named crash.mid die, as a crash in a native library would"""
+    monkeypatch.chdir(REPO_ROOT)  # vocab.txt
+    convert = MidiConverter._convert
+
+    def crash_or_convert(self, midi_path):
+        if Path(midi_path).name == 'crash.mid':
+            os._exit(1)
+        return convert(self, midi_path)
+
+    monkeypatch.setattr(MidiConverter, '_convert', crash_or_convert)
+
+@needs_fork
+def test_dead_worker_fails_only_its_file(tmp_path, crashing_converter):
+    # Enough files that more are submitted after the crash than were in flight during it
+    midi_files = write_midi_files(tmp_path / 'midi', 20)
+    midi_files[2] = midi_files[2].rename(midi_files[2].with_name('crash.mid'))
+    results = list(convert_midi_files(MidiConverter(), midi_files, workers=3, timeout=60))
+    assert [result[0] for result in results] == midi_files
+    for midi_path, tokens, _, error in results:
+        if midi_path.name == 'crash.mid':
+            assert tokens is None and error.startswith('BrokenProcessPool')
+        else:
+            assert error is None and len(tokens) == 8
+
+@needs_fork
+def test_dead_worker_failures_are_not_cached(tmp_path, crashing_converter):
+    midi_files = write_midi_files(tmp_path / 'midi', 6)
+    midi_files[0].rename(midi_files[0].with_name('crash.mid'))
+    output_dir = tmp_path / 'output'
+    process_midi_directory(tmp_path / 'midi', output_dir, workers=2)
+    with open(output_dir / '.ingest_cache' / 'manifest.json', encoding='utf-8') as f:
+        failures = json.load(f)['failures']
+    assert all(not by_hash for by_hash in failures.values())
+    with open(songs_index_path(output_dir / 'music_dataset.pt'), encoding='utf-8') as f:
+        assert len(json.load(f)['songs']) == 5
+
+def test_resumed_songs_and_duplicates_are_counted_apart(tmp_path, monkeypatch):
+    monkeypatch.chdir(REPO_ROOT)  # vocab.txt
+    midi_files = write_midi_files(tmp_path / 'midi', 3)
+    midi_files = sorted(midi_files + [Path(shutil.copy(midi_files[0], tmp_path / 'midi' / 'song_0b.mid'))])
+    # song_0 was written before the interruption; its copy is a duplicate, not a second resumed song
+    known_hashes = {file_content_hash(midi_files[0]): 'song_0.mid'}
+    stats = {'timings': {}, 'failures': [], 'duplicates': [], 'cached': 0, 'resumed': 0}
+    songs = list(_iter_corpus(MidiConverter(), midi_files, None, 1, 60, False, stats, known_hashes))
+    assert [midi_path.name for midi_path, _, _ in songs] == ['song_1.mid', 'song_2.mid']
+    assert stats['resumed'] == 1
+    assert [(path.name, first.name) for path, first in stats['duplicates']] == [('song_0b.mid', 'song_0.mid')]
@@ -0,0 +1,49 @@
+# Third-party imports
+import pytest
+import torch
+
+pytest.importorskip('onnx')
+pytest.importorskip('onnxruntime')
+
+# Local imports
+from src.generation.onnx_backend import OnnxModel
+from src.model.music_net import EfficientHarmonicMusicNet
+from src.model.onnx_export import export_onnx
+
+VOCAB_SIZE = 20
+TOLERANCE = 1e-4
+
+def exported(tmp_path, bidirectional):
+    """A small random model and the OnnxModel of its export"""
+    torch.manual_seed(0)
+    model = EfficientHarmonicMusicNet(VOCAB_SIZE, embedding_dim=8, hidden_size=16, dropout=0.0,
+                                      bidirectional=bidirectional).eval()
+    path = str(tmp_path / 'model.onnx')
+    export_onnx(model, path, metadata={'vocab_size': VOCAB_SIZE})
+    return model, OnnxModel(path)
+
+@pytest.mark.parametrize('bidirectional', [True, False], ids=['bidirectional', 'causal'])
+def test_logits_match_pytorch(tmp_path, bidirectional):
+    model, onnx_model = exported(tmp_path, bidirectional)
+    assert onnx_model.bidirectional == bidirectional
+    assert onnx_model.metadata['vocab_size'] == VOCAB_SIZE
+    # Batch and length other than the ones used to trace the export
+    tokens = torch.randint(0, VOCAB_SIZE, (5, 11, model.num_channels))
+    with torch.no_grad():
+        expected = model(tokens)
+    actual = onnx_model(tokens)
+    assert actual.shape == expected.shape
+    torch.testing.assert_close(actual, expected, atol=TOLERANCE, rtol=TOLERANCE)
+
+def test_causal_step_continues_from_state(tmp_path):
+    model, onnx_model = exported(tmp_path, bidirectional=False)
+    tokens = torch.randint(0, VOCAB_SIZE, (3, 9, model.num_channels))
+    with torch.no_grad():
+        expected = model(tokens)
+    # A prefix, then one timestep at a time from the returned state
+    logits, state = onnx_model.step(tokens[:, :4], None)
+    pieces = [logits]
+    for t in range(4, tokens.shape[1]):
+        logits, state = onnx_model.step(tokens[:, t:t + 1], state)
+        pieces.append(logits)
+    torch.testing.assert_close(torch.cat(pieces, dim=1), expected, atol=TOLERANCE, rtol=TOLERANCE)
@@ -0,0 +1,30 @@
+# Third-party imports
+import numpy as np
+import torch
+
+# Local imports
+from src.data_processing.prepare_dataset import BatchedWindowDataset, MusicSequenceDataset, build_window_starts
+from src.data_processing.token_store import ShardWriter, TokenStore
+
+SEQUENCE_LENGTH = 8
+
+def test_batched_windows_with_a_short_first_shard(tmp_path):
+    # A first song shorter than a window, alone in its shard, then longer songs over several shards
+    rng = np.random.default_rng(0)
+    lengths = [SEQUENCE_LENGTH - 3, 30, 25, 40]
+    with ShardWriter(tmp_path / 'store', shard_timesteps=32) as writer:
+        for i, length in enumerate(lengths):
+            writer.add_song(f"song_{i}", rng.integers(0, 100, (length, 4)))
+    store = TokenStore(tmp_path / 'store')
+    assert len(store.shards) == 4 and len(store.shards[0]) <= SEQUENCE_LENGTH
+
+    lengths = np.array([song['length'] for song in store.songs])
+    starts = build_window_starts(store.song_starts(), lengths, SEQUENCE_LENGTH)
+    batched = BatchedWindowDataset(store, SEQUENCE_LENGTH, starts)
+    items = MusicSequenceDataset(store, SEQUENCE_LENGTH, starts)
+    indices = list(range(0, len(starts), 3))
+    inputs, targets = batched[indices]
+    assert inputs.shape == (len(indices), SEQUENCE_LENGTH, 4) and inputs.dtype == torch.long
+    for row, index in enumerate(indices):
+        sequence, target = items[index]
+        assert torch.equal(inputs[row], sequence) and torch.equal(targets[row], target)
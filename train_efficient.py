@@ -6,7 +6,6 @@ from pathlib import Path
 import time
 import multiprocessing
 import math
-import copy
 import os
 
 # Third-party imports
@@ -17,9 +16,13 @@ import torch.optim as optim
 from torch.utils.data import DataLoader
 
 # Local imports
-from src.model.music_net import EfficientHarmonicMusicNet
+from src.model.music_net import EfficientHarmonicMusicNet, fuse_embedding_optimizer_state
 from src.model.tokenizer import MusicTokenizer
+from src.model.compile import COMPILE_MODES, compile_model
+from src.model.checkpoint import CheckpointWriter, checkpoint_metadata, snapshot_to_cpu
+from src.model.profiler import device_memory_bytes, format_profile, max_batch_size, profile_model
 from src.data_processing.prepare_dataset import prepare_dataloaders
+from src.data_processing.augment import TranspositionAugmenter
 
 # Ottimizzazioni per CUDA
 if torch.cuda.is_available():
@@ -29,93 +32,182 @@ if torch.cuda.is_available():
 # Calcola il numero ottimale di workers
 NUM_WORKERS = min(8, multiprocessing.cpu_count())
 
+# Dtype usato da autocast per ogni modalità di precisione (None = fp32 puro)
+PRECISION_DTYPES = {'fp32': None, 'bf16': torch.bfloat16, 'fp16': torch.float16}
+
+def autocast_context(device, precision):
+    """Autocast for the forward pass and loss; weights and optimizer state stay fp32"""
+    dtype = PRECISION_DTYPES[precision]
+    return torch.autocast(device_type=device.type, dtype=dtype, enabled=dtype is not None)
+
 @torch.no_grad()
-def validate(model, val_loader, criterion, device):
+def validate(model, val_loader, criterion, device, precision='fp32'):
     model.eval()
     total_loss = 0
     
     for data, target in val_loader:
         data = data.to(device, non_blocking=True)
         target = target.to(device, non_blocking=True)
-        output = model(data)
-        
-        # Reshape output and target for loss calculation
-        batch_size, seq_len = target.shape[:2]
-        output = output.view(batch_size * seq_len * 4, -1)
-        target = target.view(-1)
-        
-        loss = criterion(output, target)
+        with autocast_context(device, precision):
+            output = model(data)
+            
+            # Reshape output and target for loss calculation
+            batch_size, seq_len = target.shape[:2]
+            output = output.view(batch_size * seq_len * 4, -1)
+            target = target.view(-1)
+            
+            loss = criterion(output, target)
         total_loss += loss.item()
     
     return total_loss / len(val_loader)
 
-def train_model(model, train_loader, val_loader, num_epochs, learning_rate, start_epoch=0, checkpoint_path=None):
+@torch.no_grad()
+def loss_parity(model, val_loader, criterion, device, precision):
+    """Loss of one validation batch in fp32 and in `precision`, to check that reduced precision is harmless"""
+    model.eval()
+    data, target = next(iter(val_loader))
+    data, target = data.to(device), target.to(device).view(-1)
+    losses = {}
+    for mode in ('fp32', precision):
+        with autocast_context(device, mode):
+            output = model(data)
+            losses[mode] = criterion(output.view(target.numel(), -1), target).item()
+    return losses['fp32'], losses[precision]
+
+def train_model(model, train_loader, val_loader, num_epochs, learning_rate, start_epoch=0, checkpoint_path=None,
+                augmenter=None, precision='fp32', compile_mode='eager', metadata=None, checkpoint_writer=None):
+    """
+    Train with early stopping. `metadata` (see checkpoint_metadata) is saved in every
+    checkpoint, so that they can be loaded without knowing how the model was built.
+    Checkpoints go through `checkpoint_writer` (a CheckpointWriter): at the end of every
+    epoch and whenever it says one is due. Returns the model with the best weights.
+    """
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     print(f"Using {'CUDA' if device.type == 'cuda' else 'CPU'} device")
     
     model = model.to(device)
+    # Forward passes go through the compiled module; `model` (same parameters) is what gets saved
+    forward_model = compile_model(model, compile_mode)
+    if compile_mode != 'eager':
+        print(f"Execution mode: {compile_mode}")
+    if augmenter is not None:
+        augmenter.to(device)  # Transpose batches where they are consumed
     criterion = nn.CrossEntropyLoss()
     optimizer = optim.Adam(model.parameters(), lr=learning_rate, weight_decay=1e-4)
     scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode='min', factor=0.5, patience=5)
+    if precision == 'fp16' and device.type == 'cpu':
+        print("fp16 autocast is not supported by the CPU LSTM kernels, using bf16 instead")
+        precision = 'bf16'
+    # fp16 needs loss scaling to keep small gradients from underflowing; bf16 has fp32's exponent range
+    scaler = torch.amp.GradScaler(device.type, enabled=precision == 'fp16')
+    print(f"Precision: {precision}")
     
     patience, best_val_loss, epochs_without_improvement = 10, float('inf'), 0
-    best_model = None
+    best_state = None
 
     # Carica il checkpoint se specificato ed esiste
     if checkpoint_path and os.path.exists(checkpoint_path):
         try:
             print(f"Loading checkpoint from {checkpoint_path}")
             checkpoint = torch.load(checkpoint_path, map_location=device)
+            optimizer_state = checkpoint['optimizer_state_dict']
+            if 'embedding1.weight' in checkpoint['model_state_dict']:
+                # Checkpoint from before the fused embedding table
+                optimizer_state = fuse_embedding_optimizer_state(optimizer_state, model.num_channels)
             model.load_state_dict(checkpoint['model_state_dict'])
-            optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+            optimizer.load_state_dict(optimizer_state)
+            if 'scaler_state_dict' in checkpoint:
+                scaler.load_state_dict(checkpoint['scaler_state_dict'])
+            if 'scheduler_state_dict' in checkpoint:
+                scheduler.load_state_dict(checkpoint['scheduler_state_dict'])
             start_epoch = checkpoint.get('epoch', 0)
             best_val_loss = checkpoint.get('best_val_loss', float('inf'))
+            epochs_without_improvement = checkpoint.get('epochs_without_improvement', 0)
             print(f"Resuming from epoch {start_epoch} with best validation loss: {best_val_loss:.6f}")
         except (KeyError, ValueError, RuntimeError) as e:
             print(f"Error loading checkpoint: {e}. Starting training from scratch.")
             start_epoch = 0
             best_val_loss = float('inf')
+            epochs_without_improvement = 0
+
+    def training_state(epoch):
+        # `epoch` epochs completed: a checkpoint taken during an epoch resumes from its start
+        return {
+            'epoch': epoch,
+            'model_state_dict': model.state_dict(),
+            'optimizer_state_dict': optimizer.state_dict(),
+            'scheduler_state_dict': scheduler.state_dict(),
+            'scaler_state_dict': scaler.state_dict(),
+            'best_val_loss': best_val_loss,
+            'epochs_without_improvement': epochs_without_improvement,
+            **(metadata or {}),
+        }
+    
+    if precision != 'fp32':
+        fp32_loss, reduced_loss = loss_parity(forward_model, val_loader, criterion, device, precision)
+        print(f"Loss parity on a validation batch: fp32 {fp32_loss:.6f}, {precision} {reduced_loss:.6f} "
+              f"(diff {abs(reduced_loss - fp32_loss):.2e})")
+    
+    if checkpoint_writer is not None:
+        # A resumed run already has the checkpoint of its start: count from there
+        checkpoint_writer.start_from(start_epoch * len(train_loader))
     
     for epoch in range(start_epoch, num_epochs):
         model.train()
+        # A TorchScript module keeps its own mode, which validate() left in eval
+        forward_model.train()
         train_loss = 0.0
+        epoch_samples, epoch_start_time = 0, time.time()
         for batch_idx, (data, target) in enumerate(train_loader):
             batch_start_time = time.time()
             data, target = data.to(device, non_blocking=True), target.to(device, non_blocking=True)
+            if augmenter is not None:
+                data, target = augmenter(data, target)
             optimizer.zero_grad(set_to_none=True)
-            output = model(data)
-            output = output.view(-1, output.shape[-1])
-            target = target.view(-1)
-            loss = criterion(output, target)
-            loss.backward()
-            optimizer.step()
+            with autocast_context(device, precision):
+                output = forward_model(data)
+                output = output.view(-1, output.shape[-1])
+                target = target.view(-1)
+                loss = criterion(output, target)
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
             samples_per_sec = data.shape[0] / (time.time() - batch_start_time)
+            epoch_samples += data.shape[0]
             train_loss += loss.item()
             print(f"\rEpoch {epoch+1}/{num_epochs} [{batch_idx+1}/{len(train_loader)}] Loss: {loss.item():.6f} | {samples_per_sec:.1f} samples/s", end="")
+            step = epoch * len(train_loader) + batch_idx + 1
+            if checkpoint_writer is not None and checkpoint_writer.due(step):
+                checkpoint_writer.save(training_state(epoch), step)
         
+        epoch_samples_per_sec = epoch_samples / (time.time() - epoch_start_time)
         train_loss /= len(train_loader)
-        val_loss = validate(model, val_loader, criterion, device)
+        val_loss = validate(forward_model, val_loader, criterion, device, precision)
         scheduler.step(val_loss)
-        print(f"\nEpoch {epoch+1}: Train loss: {train_loss:.6f}, Val loss: {val_loss:.6f}, LR: {optimizer.param_groups[0]['lr']:.6f}")
+        print(f"\nEpoch {epoch+1}: Train loss: {train_loss:.6f}, Val loss: {val_loss:.6f}, LR: {optimizer.param_groups[0]['lr']:.6f}, "
+              f"{epoch_samples_per_sec:.1f} samples/s ({precision})")
         
-        if val_loss < best_val_loss:
+        improved = val_loss < best_val_loss
+        if improved:
             best_val_loss = val_loss
-            best_model = copy.deepcopy(model)
             epochs_without_improvement = 0
-            torch.save({
-                'epoch': epoch + 1,
-                'model_state_dict': model.state_dict(),
-                'optimizer_state_dict': optimizer.state_dict(),
-                'best_val_loss': best_val_loss,
-            }, 'checkpoint.pt')
-            print("Checkpoint saved at 'checkpoint.pt'")
         else:
             epochs_without_improvement += 1
-            if epochs_without_improvement >= patience:
-                print("Early stopping triggered")
-                break
+        if checkpoint_writer is not None:
+            # Only the CPU snapshot happens here, the file is written in the background
+            snapshot = checkpoint_writer.save(training_state(epoch + 1), (epoch + 1) * len(train_loader), best=improved)
+            print(f"Checkpoint queued for {checkpoint_writer.last_path}" + (" and the best model" if improved else ""))
+            if improved:
+                best_state = snapshot['model_state_dict']
+        elif improved:
+            best_state = snapshot_to_cpu(model.state_dict())
+        if epochs_without_improvement >= patience:
+            print("Early stopping triggered")
+            break
     
-    return best_model
+    if best_state is not None:
+        model.load_state_dict(best_state)
+    return model
 
 def main(args):
     # Set device
@@ -126,7 +218,15 @@ def main(args):
     train_loader, val_loader = prepare_dataloaders(
         args.dataset,
         args.sequence_length,
-        args.batch_size
+        args.batch_size,
+        stride=args.window_stride,
+        split=args.split,
+        samples_per_epoch=args.samples_per_epoch,
+        gather=args.gather,
+        num_workers=args.num_workers,
+        pin_memory=device.type == 'cuda' and not args.no_pin_memory,
+        persistent_workers=not args.no_persistent_workers,
+        prefetch_factor=args.prefetch_factor
     )
     
     # Initialize tokenizer to get vocabulary size
@@ -138,30 +238,62 @@ def main(args):
         num_notes=args.vocab_size,
         embedding_dim=args.embedding_dim,
         hidden_size=args.hidden_size,
-        dropout=0.0
+        dropout=0.0,
+        bidirectional=not args.causal
     )
 
+    augmenter = None
+    if args.transpose > 0:
+        augmenter = TranspositionAugmenter(
+            MusicTokenizer(max_vocab_size=args.vocab_size),
+            max_shift=args.transpose,
+            out_of_range=args.transpose_out_of_range
+        )
+        print(f"Transposition augmentation: ±{args.transpose} semitones ({args.transpose_out_of_range})")
+
+    # Saved with the weights: generation rebuilds the model and its vocabulary from the checkpoint alone
+    metadata = checkpoint_metadata(model, MusicTokenizer(max_vocab_size=args.vocab_size), args.sequence_length)
+
     # Print model complexity
-    complexity = model.get_complexity()
+    # train_model runs fp16 as bf16 on CPU, whose LSTM kernels have no fp16 version
+    activation_dtype = PRECISION_DTYPES['bf16' if args.precision == 'fp16' and device.type == 'cpu' else args.precision]
+    # On the training device, whose LSTM kernel decides the activation memory
+    profile = profile_model(model.to(device), args.batch_size, args.sequence_length, activation_dtype)
     print(f"\nModel complexity:")
-    print(f"Total parameters: {complexity['total_parameters']:,}")
-    print(f"Memory required: {complexity['total_memory_mb']:.2f} MB")
+    for line in format_profile(profile):
+        print(line)
+    memory = device_memory_bytes(device)
+    if memory is not None:
+        print(f"Largest batch that fits in the {memory / 1024 ** 3:.1f} GB of the {device.type.upper()}: "
+              f"{max_batch_size(model, args.sequence_length, memory, activation_dtype):,}")
+        if profile['peak_training_bytes'] > memory:
+            print(f"Warning: batch size {args.batch_size} needs more memory than the device has")
     
     # Train
     start_time = time.time()
-    model = train_model(
-        model,
-        train_loader,
-        val_loader,
-        args.num_epochs,
-        args.learning_rate,
-        checkpoint_path=args.checkpoint
-    )
+    checkpoint_writer = CheckpointWriter(args.checkpoint_dir, keep=args.keep_checkpoints,
+                                         every_steps=args.checkpoint_steps, every_seconds=args.checkpoint_minutes * 60)
+    try:
+        model = train_model(
+            model,
+            train_loader,
+            val_loader,
+            args.num_epochs,
+            args.learning_rate,
+            checkpoint_path=args.checkpoint,
+            augmenter=augmenter,
+            precision=args.precision,
+            compile_mode=args.compile,
+            metadata=metadata,
+            checkpoint_writer=checkpoint_writer
+        )
+    finally:
+        checkpoint_writer.close()
     
     print(f'\nTraining completed in {time.time() - start_time:.2f}s')
 
     # Save the trained model
-    torch.save(model.state_dict(), "model.pt")
+    torch.save({'model_state_dict': model.state_dict(), **metadata}, "model.pt")
     print("Final model saved at 'model.pt'")
 
 if __name__ == '__main__':
@@ -184,10 +316,44 @@ if __name__ == '__main__':
                         help='Force CPU usage even if GPU is available')
     parser.add_argument('--checkpoint', type=str,
                         help='Path to checkpoint to resume training from')
+    parser.add_argument('--checkpoint-dir', type=str, default='checkpoints',
+                        help='Where checkpoints are written: last/, best/ and recent/')
+    parser.add_argument('--keep-checkpoints', type=int, default=3,
+                        help='Most recent checkpoints kept in recent/ besides last/ and best/ (0 = none)')
+    parser.add_argument('--checkpoint-steps', type=int, default=0,
+                        help='Also checkpoint every N training steps (0 = only at the end of each epoch)')
+    parser.add_argument('--checkpoint-minutes', type=float, default=0,
+                        help='Also checkpoint every N minutes (0 = only at the end of each epoch)')
     parser.add_argument('--time-limit-hours', type=float, default=24,
                         help='Time limit in hours')
     parser.add_argument('--vocab-size', type=int, default=128,
                         help='MIDI note range')
+    parser.add_argument('--window-stride', type=int, default=1,
+                        help='Timesteps between consecutive training windows (sequence length = no overlap)')
+    parser.add_argument('--split', choices=['window', 'song'], default='window',
+                        help='Hold out random windows or whole songs for validation')
+    parser.add_argument('--samples-per-epoch', type=int,
+                        help='Training windows drawn per epoch (default: all)')
+    parser.add_argument('--gather', choices=['batch', 'item'], default='batch',
+                        help='Build each batch with one vectorized gather or window by window')
+    parser.add_argument('--num-workers', type=int, default=NUM_WORKERS,
+                        help='DataLoader worker processes (0 = load batches in the training process)')
+    parser.add_argument('--prefetch-factor', type=int, default=2,
+                        help='Batches prefetched by each DataLoader worker')
+    parser.add_argument('--no-persistent-workers', action='store_true',
+                        help='Restart DataLoader workers at every epoch')
+    parser.add_argument('--no-pin-memory', action='store_true',
+                        help='Do not pin host memory for CUDA transfers')
+    parser.add_argument('--precision', choices=list(PRECISION_DTYPES), default='fp32',
+                        help='Autocast precision for forward pass and loss (bf16 works on CPU; checkpoints stay fp32)')
+    parser.add_argument('--causal', action='store_true',
+                        help='Unidirectional (causal) LSTM, for incremental generation with generate_efficient.py --causal')
+    parser.add_argument('--compile', choices=COMPILE_MODES, default='eager',
+                        help='Execution mode: eager, torch.compile (kernels cached in .compile_cache) or TorchScript')
+    parser.add_argument('--transpose', type=int, default=0,
+                        help='Randomly transpose training batches by up to ±N semitones (0 = off)')
+    parser.add_argument('--transpose-out-of-range', choices=['rest', 'fold'], default='rest',
+                        help="Transposed notes outside the vocabulary become rests or are octave-folded")
     
     args = parser.parse_args()
     main(args)
\ No newline at end of file
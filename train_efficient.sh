@@ -10,6 +10,13 @@ LEARNING_RATE=${LEARNING_RATE:-0.001}  # Valore stabile e comune per LSTM
 SEQUENCE_LENGTH=${SEQUENCE_LENGTH:-64}  # Per dipendenze più lunghe
 FORCE_CPU=${FORCE_CPU:-false}
 TIME_LIMIT_HOURS=${TIME_LIMIT_HOURS:-12}  # Ridotto, sufficiente con GPU
+PRECISION=${PRECISION:-fp32}  # fp32, bf16 (anche su CPU) o fp16 (solo GPU)
+COMPILE=${COMPILE:-eager}  # eager, compile (torch.compile) o script (TorchScript)
+CAUSAL=${CAUSAL:-false}  # LSTM unidirezionale, generazione incrementale
+NUM_WORKERS=${NUM_WORKERS:-""}  # Worker del DataLoader (vuoto = default dello script Python)
+KEEP_CHECKPOINTS=${KEEP_CHECKPOINTS:-""}  # Checkpoint recenti conservati in checkpoints/recent (vuoto = default)
+CHECKPOINT_STEPS=${CHECKPOINT_STEPS:-""}  # Checkpoint anche ogni N step (vuoto = solo a fine epoca)
+CHECKPOINT_MINUTES=${CHECKPOINT_MINUTES:-""}  # Checkpoint anche ogni N minuti (vuoto = solo a fine epoca)
 
 # Controlla se esiste l'ultimo checkpoint
 LAST_CHECKPOINT="checkpoints/last/last_model.pt"
@@ -33,6 +40,13 @@ echo "SEQUENCE_LENGTH: $SEQUENCE_LENGTH"
 echo "TIME_LIMIT_HOURS: $TIME_LIMIT_HOURS"
 echo "CHECKPOINT: $CHECKPOINT"
 echo "FORCE_CPU: $FORCE_CPU"
+echo "PRECISION: $PRECISION"
+echo "COMPILE: $COMPILE"
+echo "CAUSAL: $CAUSAL"
+echo "NUM_WORKERS: ${NUM_WORKERS:-default}"
+echo "KEEP_CHECKPOINTS: ${KEEP_CHECKPOINTS:-default}"
+echo "CHECKPOINT_STEPS: ${CHECKPOINT_STEPS:-off}"
+echo "CHECKPOINT_MINUTES: ${CHECKPOINT_MINUTES:-off}"
 echo
 
 # Costruisci il comando
@@ -44,13 +58,35 @@ CMD="python train_efficient.py \
     --hidden-size $HIDDEN_SIZE \
     --learning-rate $LEARNING_RATE \
     --sequence-length $SEQUENCE_LENGTH \
-    --time-limit-hours $TIME_LIMIT_HOURS"
+    --time-limit-hours $TIME_LIMIT_HOURS \
+    --precision $PRECISION \
+    --compile $COMPILE"
 
 # Aggiungi opzioni condizionali
 if [ "$FORCE_CPU" = true ]; then
     CMD="$CMD --force-cpu"
 fi
 
+if [ "$CAUSAL" = true ]; then
+    CMD="$CMD --causal"
+fi
+
+if [ ! -z "$NUM_WORKERS" ]; then
+    CMD="$CMD --num-workers $NUM_WORKERS"
+fi
+
+if [ ! -z "$KEEP_CHECKPOINTS" ]; then
+    CMD="$CMD --keep-checkpoints $KEEP_CHECKPOINTS"
+fi
+
+if [ ! -z "$CHECKPOINT_STEPS" ]; then
+    CMD="$CMD --checkpoint-steps $CHECKPOINT_STEPS"
+fi
+
+if [ ! -z "$CHECKPOINT_MINUTES" ]; then
+    CMD="$CMD --checkpoint-minutes $CHECKPOINT_MINUTES"
+fi
+
 if [ ! -z "$CHECKPOINT" ]; then
     CMD="$CMD --checkpoint $CHECKPOINT"
 fi